@@ -0,0 +1,147 @@
+"""
+Background processing of attendance photos.
+
+Uploads are queued and handled by a bounded pool of worker threads so the
+event loop keeps serving logins and dashboard reads while photos are
+processed. Job state lives in memory; clients poll it by job id.
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+import metrics
+from database import SessionLocal, AttendanceSession, AttendanceRecord
+from attendance_pipeline import AttendancePipeline, NoFacesDetected
+from inference_pool import INFERENCE_WORKERS
+from schemas import ImageProcessingResponse
+
+# Enough job threads by default to keep every inference worker process busy
+ATTENDANCE_WORKERS = int(os.getenv("ATTENDANCE_WORKERS", str(max(2, INFERENCE_WORKERS))))
+ATTENDANCE_QUEUE_DEPTH = int(os.getenv("ATTENDANCE_QUEUE_DEPTH", "32"))
+# Finished jobs kept around for polling before the oldest are forgotten
+ATTENDANCE_JOB_HISTORY = int(os.getenv("ATTENDANCE_JOB_HISTORY", "1000"))
+
+
+class JobQueueFull(Exception):
+    """Raised when the attendance queue is at its configured depth"""
+
+
+class AttendanceJob:
+    def __init__(self, session_id: int, img_bytes: bytes, threshold: float, user_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.user_id = user_id  # the teacher who uploaded the photo; only they can poll the job
+        self.threshold = threshold
+        self.img_bytes: Optional[bytes] = img_bytes
+        self.status = "queued"  # queued, detecting, embedding, matching, done, error
+        self.result: Optional[ImageProcessingResponse] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.updated_at = self.created_at
+        self.queued_at = time.perf_counter()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error")
+
+
+class AttendanceJobQueue:
+    """Bounded queue of attendance jobs processed by a fixed pool of workers"""
+
+    def __init__(
+        self,
+        pipeline: AttendancePipeline,
+        workers: int = ATTENDANCE_WORKERS,
+        max_depth: int = ATTENDANCE_QUEUE_DEPTH
+    ):
+        self.pipeline = pipeline
+        self.workers = workers
+        self.max_depth = max_depth
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="attendance")
+        self._jobs: "OrderedDict[str, AttendanceJob]" = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(
+        self, session_id: int, img_bytes: bytes, threshold: float, user_id: Optional[int] = None
+    ) -> AttendanceJob:
+        """Queue a photo; raises JobQueueFull when no slot is free"""
+        job = AttendanceJob(session_id, img_bytes, threshold, user_id)
+        with self._lock:
+            # Jobs currently on a worker do not count towards the queue depth
+            if self._pending >= self.workers + self.max_depth:
+                raise JobQueueFull(f"{self.max_depth} attendance photos are already waiting")
+            self._pending += 1
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        # Carry the request's context over, so the job's metrics are labelled with its endpoint
+        self._executor.submit(contextvars.copy_context().run, self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[AttendanceJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def _forget_old_jobs(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - ATTENDANCE_JOB_HISTORY)]:
+            del self._jobs[job_id]
+
+    def _set_status(self, job: AttendanceJob, status: str) -> None:
+        job.status = status
+        job.updated_at = datetime.utcnow()
+
+    def _status_after_failure(self, db, session: AttendanceSession, status: str) -> str:
+        """A failed photo leaves a session with records from earlier photos completed, else `status`"""
+        has_records = db.query(AttendanceRecord.id).filter(
+            AttendanceRecord.session_id == session.id
+        ).first() is not None
+        return "completed" if has_records else status
+
+    def _run(self, job: AttendanceJob) -> None:
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - job.queued_at, metrics.current_endpoint(), "queue")
+        db = SessionLocal()
+        session = None
+        try:
+            session = db.query(AttendanceSession).filter(AttendanceSession.id == job.session_id).first()
+            previous_status = session.status
+
+            def on_stage(stage: str) -> None:
+                # Clients follow the stages on the job; the session only records that
+                # processing started, and is completed in the same commit as its records
+                self._set_status(job, stage)
+                if stage == "detecting":
+                    session.status = stage
+                    db.commit()
+
+            job.result = self.pipeline.process(db, session, job.img_bytes, job.threshold, on_stage)
+            self._set_status(job, "done")
+        except NoFacesDetected as e:
+            # The photo adds no evidence: the session is as it was before it
+            db.rollback()
+            session.status = self._status_after_failure(db, session, previous_status)
+            db.commit()
+            job.error = str(e)
+            self._set_status(job, "error")
+        except Exception as e:
+            db.rollback()
+            if session is not None:
+                session.status = self._status_after_failure(db, session, "error")
+                db.commit()
+            job.error = str(e)
+            self._set_status(job, "error")
+        finally:
+            db.close()
+            job.img_bytes = None
+            with self._lock:
+                self._pending -= 1
@@ -0,0 +1,406 @@
+"""
+Attendance photo pipeline: detect -> embed -> match -> record.
+
+Every photo of a session adds to the same attendance: only the new photo's
+faces are detected and embedded, its matches are merged into the session's
+per-student evidence and the existing records are updated in place (see
+session_fusion).
+"""
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+import metrics
+from database import User, Enrollment, AttendanceSession, AttendanceRecord, AttendanceEvidence, SessionImage, upsert
+from face_assignment import ASSIGNMENT_POLICY, assign_faces
+from face_inference import EMBEDDING_SIZE, detect_and_embed
+from schemas import ImageProcessingResponse, DetectedStudent, AttendanceChange, RescoreResponse
+from session_fusion import content_hash, find_duplicate, perceptual_hash, session_lock
+
+
+class NoFacesDetected(Exception):
+    """Raised when the detector finds no face in an attendance photo"""
+
+
+class NoStoredFaces(Exception):
+    """Raised when a session has no processed photos to re-score"""
+
+
+def enrolled_students(db: Session, subject_id: int) -> Dict[int, Any]:
+    """The students enrolled in a subject (id, name, email, prn) by id, from one joined query.
+
+    Plain rows rather than ORM objects: attendance jobs commit their status
+    between stages, which expires loaded objects and would reload them one
+    query at a time.
+    """
+    rows = db.query(User.id, User.name, User.email, User.prn).join(
+        Enrollment, Enrollment.student_id == User.id
+    ).filter(Enrollment.subject_id == subject_id).order_by(Enrollment.id)
+    return {row.id: row for row in rows}
+
+
+def session_records(db: Session, session_id: int) -> Dict[int, Any]:
+    """The session's attendance records (status, confidence_score, manual_override) by student id"""
+    rows = db.query(
+        AttendanceRecord.student_id,
+        AttendanceRecord.status,
+        AttendanceRecord.confidence_score,
+        AttendanceRecord.manual_override
+    ).filter(AttendanceRecord.session_id == session_id)
+    return {row.student_id: row for row in rows}
+
+
+def add_evidence(evidence: Dict[int, List[float]], student_id: int, best: float, total: float, count: int) -> None:
+    """Fold a best score, score sum and match count into a student's [best, sum, count]"""
+    item = evidence.get(student_id)
+    if item is None:
+        evidence[student_id] = [best, total, count]
+    else:
+        item[0] = max(item[0], best)
+        item[1] += total
+        item[2] += count
+
+
+def session_evidence(db: Session, session_id: int):
+    """The session's evidence rows (student_id, source, best_score, score_sum, match_count)"""
+    return db.query(
+        AttendanceEvidence.student_id,
+        AttendanceEvidence.source,
+        AttendanceEvidence.best_score,
+        AttendanceEvidence.score_sum,
+        AttendanceEvidence.match_count
+    ).filter(AttendanceEvidence.session_id == session_id).all()
+
+
+def write_records(db: Session, session_id: int, records: List[dict]) -> None:
+    """Upsert attendance records (session_id, student_id, status, confidence_score,
+    manual_override) in one statement and recount the session's present students.
+
+    Manually overridden records are never overwritten, even by a write that
+    raced the override. Runs inside the caller's transaction.
+    """
+    upsert(
+        db, AttendanceRecord, records,
+        keys=("session_id", "student_id"),
+        update=("status", "confidence_score"),
+        where=AttendanceRecord.manual_override.isnot(True)
+    )
+    present = select(func.count(AttendanceRecord.id)).where(
+        AttendanceRecord.session_id == session_id,
+        AttendanceRecord.status == "present"
+    ).scalar_subquery()
+    db.execute(
+        update(AttendanceSession).where(AttendanceSession.id == session_id)
+        .values(present_students=present, status="completed")
+        .execution_options(synchronize_session=False)
+    )
+
+
+class AttendancePipeline:
+    """Turns a group photo into attendance records for a session.
+
+    `inference` is anything with `detect_faces(img_bytes)` and `embed(faces)`:
+    the in-process model registry, a pool of inference workers or a client
+    of the inference service. With a `cache` (result_cache.ResultCache),
+    photos seen before are scored without running the models again.
+    """
+
+    def __init__(self, inference, matcher, cache=None):
+        self.inference = inference
+        self.matcher = matcher
+        self.cache = cache
+
+    def detect_and_embed(self, img_bytes: bytes, sha256: str, on_embed: Optional[Callable[[], None]] = None):
+        """FaceDetections of a photo (None without faces), from the cache when possible"""
+        if self.cache is not None:
+            hit, detections = self.cache.get(sha256)
+            if hit:
+                return detections
+        detections = detect_and_embed(self.inference, img_bytes, on_embed=on_embed)
+        if self.cache is not None:
+            self.cache.put(sha256, detections)
+        return detections
+
+    def process(
+        self,
+        db: Session,
+        session: AttendanceSession,
+        img_bytes: bytes,
+        threshold: float,
+        on_stage: Optional[Callable[[str], None]] = None
+    ) -> ImageProcessingResponse:
+        """Run the full pipeline; `on_stage` is called as each stage starts"""
+        def stage(name: str) -> None:
+            if on_stage:
+                on_stage(name)
+
+        stage("detecting")
+        with metrics.stage("hash"):
+            sha256, phash = content_hash(img_bytes), perceptual_hash(img_bytes)
+        students = enrolled_students(db, session.subject_id)
+
+        # A photo the session already has adds no evidence, but its threshold still applies
+        if find_duplicate(db, session.id, sha256, phash) is not None:
+            return self._duplicate(db, session, students, threshold)
+
+        detections = self.detect_and_embed(img_bytes, sha256, on_embed=lambda: stage("embedding"))
+        if detections is None:
+            raise NoFacesDetected("No faces detected in the image.")
+        embeddings = detections.embeddings
+
+        stage("matching")
+        enrolled_student_ids = set(students)
+
+        with metrics.stage("match"):
+            # Score all faces against the enrolled students in one batch
+            similarity = self.matcher.similarity(
+                embeddings,
+                enrolled_ids=enrolled_student_ids,
+                subject_id=session.subject_id
+            )
+
+            # Assign faces to students one-to-one
+            matches = {
+                similarity.student_ids[a.column]: (a.score, a.face_index)
+                for a in assign_faces(similarity.scores, threshold)
+            }
+
+        with session_lock(session.id):
+            # The same photo may have been uploaded twice in quick succession
+            if find_duplicate(db, session.id, sha256, phash) is not None:
+                return self._duplicate(db, session, students, threshold)
+            db.add(SessionImage(
+                session_id=session.id,
+                sha256=sha256,
+                phash=phash,
+                image_path=session.image_path,
+                face_count=len(embeddings),
+                embeddings=np.ascontiguousarray(embeddings, dtype=np.float32).tobytes()
+            ))
+            return record_attendance(db, session, students, matches, quality=detections.quality)
+
+    def _duplicate(
+        self, db: Session, session: AttendanceSession, students: Dict[int, Any], threshold: float
+    ) -> ImageProcessingResponse:
+        """Re-score the session's stored photos with the uploaded threshold and answer with the result"""
+        self.rescore(db, session, threshold)
+        return record_attendance(db, session, students, {}, processing_status="duplicate")
+
+    def rescore(
+        self,
+        db: Session,
+        session: AttendanceSession,
+        threshold: float,
+        policy: str = ASSIGNMENT_POLICY
+    ) -> RescoreResponse:
+        """Re-match the stored face embeddings of a session's photos and update its records.
+
+        Only matching and record updates run, no detection or embedding. The
+        session's photo evidence is rebuilt from its photos with the new
+        threshold and policy; evidence from live streams, which keep no
+        embeddings, still counts as it is. Manually overridden records are
+        left as they are.
+        """
+        images = db.query(SessionImage).filter(
+            SessionImage.session_id == session.id
+        ).order_by(SessionImage.id).all()
+        if not images:
+            raise NoStoredFaces("This session has no processed photos to re-score.")
+        students = enrolled_students(db, session.subject_id)
+
+        # Score the faces of every photo in one batch; assignment stays one-to-one per photo
+        photos = [np.frombuffer(image.embeddings, dtype=np.float32).reshape(-1, EMBEDDING_SIZE) for image in images]
+        with metrics.stage("match"):
+            similarity = self.matcher.similarity(
+                np.concatenate(photos),
+                enrolled_ids=set(students),
+                subject_id=session.subject_id
+            )
+            evidence: Dict[int, List[float]] = {}  # student id -> [best score, score sum, match count]
+            offset = 0
+            for photo in photos:
+                scores = similarity.scores[offset:offset + len(photo)]
+                offset += len(photo)
+                for a in assign_faces(scores, threshold, policy):
+                    add_evidence(evidence, similarity.student_ids[a.column], a.score, a.score, 1)
+
+        with session_lock(session.id), metrics.stage("record"):
+            db.query(AttendanceEvidence).filter(
+                AttendanceEvidence.session_id == session.id,
+                AttendanceEvidence.source == "photo"
+            ).delete()
+            if evidence:
+                db.execute(insert(AttendanceEvidence), [
+                    {
+                        "session_id": session.id,
+                        "student_id": student_id,
+                        "source": "photo",
+                        "best_score": best,
+                        "score_sum": total,
+                        "match_count": count
+                    }
+                    for student_id, (best, total, count) in evidence.items()
+                ])
+            for e in session_evidence(db, session.id):
+                if e.source != "photo":
+                    add_evidence(evidence, e.student_id, e.best_score, e.score_sum, e.match_count)
+
+            records = session_records(db, session.id)
+            changes, writes = [], []
+            for student in students.values():
+                record = records.get(student.id)
+                if record is not None and record.manual_override:
+                    continue
+
+                item = evidence.get(student.id)
+                status = "present" if item else "absent"
+                confidence = item[0] if item else None
+                if record is None or record.status != status or record.confidence_score != confidence:
+                    writes.append({
+                        "session_id": session.id,
+                        "student_id": student.id,
+                        "status": status,
+                        "confidence_score": confidence,
+                        "manual_override": False
+                    })
+
+                previous_status = record.status if record else None
+                if previous_status != status:
+                    changes.append(AttendanceChange(
+                        student_id=student.id,
+                        name=student.name,
+                        prn=student.prn,
+                        previous_status=previous_status,
+                        status=status,
+                        previous_confidence=record.confidence_score if record else None,
+                        confidence=confidence
+                    ))
+
+            session_id = session.id
+            write_records(db, session_id, writes)
+            db.commit()
+
+        return RescoreResponse(
+            session_id=session_id,
+            threshold=threshold,
+            policy=policy,
+            photos=len(images),
+            total_detected=len(evidence),
+            changes=changes
+        )
+
+
+def record_attendance(
+    db: Session,
+    session: AttendanceSession,
+    students: Dict[int, Any],
+    matches: Dict[int, Tuple[float, Optional[int]]],
+    processing_status: str = "completed",
+    quality: Optional[np.ndarray] = None,
+    tracks: Optional[Dict[int, int]] = None
+) -> ImageProcessingResponse:
+    """Merge one photo's (or stream's) matches into the session and update its records in place.
+
+    `students` is the subject's roster from `enrolled_students`, `matches`
+    maps each recognized student to (confidence, face index), and `quality`
+    holds the photo's face quality scores by face index. A live stream
+    passes no face indexes but `tracks`, the track id of each match; its
+    evidence is kept apart from the photos' (source "stream"), so that
+    re-scoring the photos leaves it alone.
+    Students keep their best score over all photos; manually overridden
+    records are left as they are. Evidence, records and the session's
+    counters are written with one statement each and committed together.
+    """
+    session_id = session.id
+    with session_lock(session_id), metrics.stage("record"):
+        source = "photo" if tracks is None else "stream"
+        evidence: Dict[int, List[float]] = {}  # student id -> [best score, score sum, match count]
+        own: Dict[int, List[float]] = {}  # the same, from this source only
+        for e in session_evidence(db, session_id):
+            add_evidence(evidence, e.student_id, e.best_score, e.score_sum, e.match_count)
+            if e.source == source:
+                own[e.student_id] = [e.best_score, e.score_sum, e.match_count]
+        for student_id, (score, _) in matches.items():
+            add_evidence(evidence, student_id, score, score, 1)
+            add_evidence(own, student_id, score, score, 1)
+        now = datetime.utcnow()
+        rows = [
+            {
+                "session_id": session_id,
+                "student_id": student_id,
+                "source": source,
+                "best_score": own[student_id][0],
+                "score_sum": own[student_id][1],
+                "match_count": own[student_id][2],
+                "updated_at": now
+            }
+            for student_id in matches
+        ]
+        update_columns = ("best_score", "score_sum", "match_count", "updated_at")
+        if tracks is not None:
+            for row in rows:
+                row["track_id"] = tracks.get(row["student_id"])
+            update_columns += ("track_id",)
+        upsert(
+            db, AttendanceEvidence, rows,
+            keys=("session_id", "student_id", "source"),
+            update=update_columns
+        )
+
+        records = session_records(db, session_id)
+
+        present_students = []
+        absent_students = []
+        writes = []
+        for student in students.values():
+            item = evidence.get(student.id)
+
+            record = records.get(student.id)
+            if record is None or not record.manual_override:
+                status = "present" if item else "absent"
+                confidence = item[0] if item else None
+                if record is None or record.status != status or record.confidence_score != confidence:
+                    writes.append({
+                        "session_id": session_id,
+                        "student_id": student.id,
+                        "status": status,
+                        "confidence_score": confidence,
+                        "manual_override": False
+                    })
+
+            if item is None:
+                absent_students.append(DetectedStudent(
+                    student_id=student.id,
+                    name=student.name,
+                    email=student.email,
+                    prn=student.prn,
+                    detected=False
+                ))
+                continue
+            face_index = matches[student.id][1] if student.id in matches else None
+            present_students.append(DetectedStudent(
+                student_id=student.id,
+                name=student.name,
+                email=student.email,
+                prn=student.prn,
+                detected=True,
+                confidence=item[0],
+                average_confidence=item[1] / item[2],
+                matched_photos=item[2],
+                face_index=face_index,
+                track_id=tracks.get(student.id) if tracks else None,
+                quality=float(quality[face_index]) if quality is not None and face_index is not None else None
+            ))
+
+        write_records(db, session_id, writes)
+        db.commit()
+
+    return ImageProcessingResponse(
+        session_id=session_id,
+        detected_students=present_students + absent_students,
+        total_detected=len(present_students),
+        processing_status=processing_status
+    )
@@ -0,0 +1,169 @@
+"""
+Attendance from a classroom camera stream.
+
+Detection runs on every `detect_every`-th frame only; the faces in between
+are followed by face_tracking, and frames that are neither detected nor
+needed for a crop are never decoded. Each track is embedded once, and
+again only when a clearly better crop of it appears (a more confident
+detection or a bigger face), and not before one of its crops passes
+MIN_FACE_QUALITY (see face_quality). Identities accumulate over the whole stream:
+every student keeps the best score any of their tracks reached, so a
+student seen well once stays present after turning away.
+"""
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from face_assignment import assign_faces
+from face_inference import crop_faces, decode_image
+from face_quality import MIN_FACE_QUALITY, face_quality
+from face_tracking import FaceTracker, Track
+
+# Run the detector on every Nth frame and track faces in between
+STREAM_DETECT_EVERY = int(os.getenv("STREAM_DETECT_EVERY", "10"))
+# Quality gain over a track's best crop so far that triggers re-embedding
+STREAM_REEMBED_GAIN = float(os.getenv("STREAM_REEMBED_GAIN", "0.15"))
+# Face side (pixels) at which crop size stops adding to quality; FaceNet crops are 160
+STREAM_FULL_QUALITY_SIZE = float(os.getenv("STREAM_FULL_QUALITY_SIZE", "112"))
+
+
+def crop_quality(box: np.ndarray, prob: float, full_size: float = STREAM_FULL_QUALITY_SIZE) -> float:
+    """Detection confidence scaled down for faces smaller than `full_size`"""
+    side = min(box[2] - box[0], box[3] - box[1])
+    return float(prob) * min(1.0, max(side, 0.0) / full_size)
+
+
+class AttendanceStream:
+    """Per-session state of one camera stream.
+
+    `inference` needs `detect_boxes(img_bytes)` and `embed(faces)`; `matcher`
+    is the same face matcher the photo pipeline uses. Frames must be fed in
+    order from a single thread.
+    """
+
+    def __init__(
+        self,
+        inference,
+        matcher,
+        enrolled_ids: Iterable[int],
+        subject_id: int,
+        threshold: float,
+        detect_every: int = STREAM_DETECT_EVERY,
+        reembed_gain: float = STREAM_REEMBED_GAIN,
+        tracker: Optional[FaceTracker] = None,
+        min_quality: float = MIN_FACE_QUALITY
+    ):
+        self.inference = inference
+        self.matcher = matcher
+        self.enrolled_ids = set(enrolled_ids)
+        self.subject_id = subject_id
+        self.threshold = threshold
+        self.detect_every = max(1, detect_every)
+        self.reembed_gain = reembed_gain
+        self.min_quality = min_quality
+        self.tracker = tracker or FaceTracker()
+
+        # student id -> (best score, id of the track that reached it)
+        self.evidence: Dict[int, Tuple[float, int]] = {}
+        self.frames = 0
+        self.detections = 0
+        self.embeddings = 0
+
+    def process_frame(self, frame_bytes: bytes) -> Optional[dict]:
+        """Feed one encoded frame; returns a progress update on detection frames"""
+        frame = self.frames
+        self.frames += 1
+        if frame % self.detect_every:
+            return None
+
+        with metrics.stage("detect"):
+            boxes, probs = self.inference.detect_boxes(frame_bytes)
+        self.detections += 1
+        visible = self.tracker.update(boxes, probs, frame)
+
+        stale = []
+        for track in visible:
+            quality = crop_quality(track.box, track.prob)
+            if track.best_quality is None or quality >= track.best_quality + self.reembed_gain:
+                stale.append((track, quality))
+        if stale:
+            self._embed(frame_bytes, stale)
+        self._accumulate(visible)
+        return self.progress(frame, len(visible))
+
+    def _embed(self, frame_bytes: bytes, stale: List[Tuple[Track, float]]) -> None:
+        """Embed the crops of new or improved tracks in one batch and rescore them"""
+        with metrics.stage("decode"):
+            img, scale = decode_image(frame_bytes)
+        boxes = np.array([track.box for track, _ in stale], dtype=np.float32)
+        with metrics.stage("crop"):
+            faces = crop_faces(img, boxes * scale)
+        # Crops below the quality bar wait for a better frame instead of being embedded
+        with metrics.stage("quality"):
+            keep = np.flatnonzero(face_quality(boxes, [track.prob for track, _ in stale], faces) >= self.min_quality)
+        if not len(keep):
+            return
+        stale, faces = [stale[i] for i in keep], faces[keep]
+        metrics.EMBED_BATCH_SIZE.observe(len(faces), "stream")
+        with metrics.stage("embed"):
+            embeddings = self.inference.embed(faces)
+        self.embeddings += len(stale)
+
+        with metrics.stage("match"):
+            similarity = self.matcher.similarity(
+                embeddings,
+                enrolled_ids=self.enrolled_ids,
+                subject_id=self.subject_id
+            )
+        for row, (track, quality) in enumerate(stale):
+            track.best_quality = quality
+            track.scores = {
+                student_id: float(score)
+                for student_id, score in zip(similarity.student_ids, similarity.scores[row])
+            }
+
+    def _accumulate(self, visible: List[Track]) -> None:
+        """Assign the faces visible together one-to-one and keep each student's best score"""
+        tracks = [track for track in visible if track.scores]
+        student_ids = sorted({student_id for track in tracks for student_id in track.scores})
+        if not student_ids:
+            return
+        scores = np.full((len(tracks), len(student_ids)), -1.0, dtype=np.float32)
+        for row, track in enumerate(tracks):
+            for col, student_id in enumerate(student_ids):
+                scores[row, col] = track.scores.get(student_id, -1.0)
+
+        for a in assign_faces(scores, self.threshold):
+            student_id = student_ids[a.column]
+            if a.score > self.evidence.get(student_id, (-1.0, None))[0]:
+                self.evidence[student_id] = (a.score, tracks[a.face_index].id)
+
+    def matches(self) -> Dict[int, Tuple[float, Optional[int]]]:
+        """Recognized students as (best confidence, face index), for record_attendance.
+
+        Stream faces have no index in a photo; their tracks are in `track_ids`.
+        """
+        return {student_id: (score, None) for student_id, (score, _) in self.evidence.items()}
+
+    def track_ids(self) -> Dict[int, int]:
+        """The track that reached each recognized student's best score"""
+        return {student_id: track_id for student_id, (_, track_id) in self.evidence.items()}
+
+    def progress(self, frame: int, visible: int) -> dict:
+        return {
+            "type": "progress",
+            "frame": frame,
+            "faces": visible,
+            "tracks": len(self.tracker.tracks),
+            "present": sorted(self.evidence),
+            **self.stats(),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "detections": self.detections,
+            "embeddings": self.embeddings,
+        }
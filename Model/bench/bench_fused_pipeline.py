@@ -0,0 +1,157 @@
+"""
+Benchmark the fused decode -> detect -> crop -> embed path on a crowded photo.
+
+Builds a group photo of at least --faces faces by tiling --photo (any
+photo with faces) in a grid, optionally upscaled with --scale to make it
+huge, and measures each variant in a fresh interpreter:
+
+* legacy: PIL decode plus a full RGB convert, detection, MTCNN.extract
+  (a PIL image and a tensor per face, then torch.stack), embedding;
+* fused: decode_image (draft mode for huge JPEGs), detection, crop_faces
+  into one preallocated batch buffer, embedding.
+
+Per variant it reports the median milliseconds of each stage, the RSS
+with the models loaded and warmed up, and the peak RSS while processing
+the photo.
+
+Usage: python bench/bench_fused_pipeline.py --photo group.jpg [--faces 100] [--scale 1] [--repeats 5]
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from PIL import Image
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VARIANTS = ("legacy", "fused")
+STAGES = ("decode", "detect", "crop", "embed")
+
+_CHILD = """
+import io, json, resource, sys, time
+import numpy as np
+from PIL import Image
+from face_inference import crop_faces, decode_image
+from model_registry import registry
+
+variant, path, repeats = sys.argv[1], sys.argv[2], int(sys.argv[3])
+img_bytes = open(path, "rb").read()
+registry.load_all()
+detector = registry.crowd_detector
+
+
+def rss_kb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def legacy(img_bytes, times):
+    start = time.perf_counter()
+    img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
+    times["decode"].append(time.perf_counter() - start)
+    start = time.perf_counter()
+    boxes, _ = detector.detect(img)
+    times["detect"].append(time.perf_counter() - start)
+    start = time.perf_counter()
+    faces = registry.mtcnn_crowd.extract(img, boxes, None)
+    times["crop"].append(time.perf_counter() - start)
+    start = time.perf_counter()
+    registry.embed(faces)
+    times["embed"].append(time.perf_counter() - start)
+    return len(boxes)
+
+
+def fused(img_bytes, times):
+    start = time.perf_counter()
+    img, _ = decode_image(img_bytes)
+    times["decode"].append(time.perf_counter() - start)
+    start = time.perf_counter()
+    boxes, _, _ = registry._locate(img, True)
+    times["detect"].append(time.perf_counter() - start)
+    start = time.perf_counter()
+    faces = crop_faces(img, boxes)
+    times["crop"].append(time.perf_counter() - start)
+    start = time.perf_counter()
+    registry.embed(faces)
+    times["embed"].append(time.perf_counter() - start)
+    return len(boxes)
+
+
+run = legacy if variant == "legacy" else fused
+# Warm up on a small copy, so the peak below comes from the photo itself
+small = io.BytesIO()
+Image.open(io.BytesIO(img_bytes)).convert("RGB").resize((640, 480)).save(small, "JPEG")
+run(small.getvalue(), {s: [] for s in %r})
+baseline = rss_kb()
+
+times = {s: [] for s in %r}
+faces = [run(img_bytes, times) for _ in range(repeats)][-1]
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "faces": faces,
+    "stages_ms": {s: round(float(np.median(t)) * 1000, 1) for s, t in times.items()},
+    "baseline_rss_mb": round(baseline / 1024, 1),
+    "peak_rss_mb": round(peak / 1024, 1),
+}))
+""" % (STAGES, STAGES)
+
+
+def group_photo(photo: str, faces_per_photo: int, faces: int, scale: float) -> bytes:
+    """A grid of copies of `photo` holding at least `faces` faces, as a JPEG"""
+    tile = Image.open(photo).convert("RGB")
+    copies = -(-faces // max(faces_per_photo, 1))
+    columns = max(1, round(copies ** 0.5))
+    rows = -(-copies // columns)
+    grid = Image.new("RGB", (tile.width * columns, tile.height * rows))
+    for i in range(copies):
+        grid.paste(tile, ((i % columns) * tile.width, (i // columns) * tile.height))
+    if scale != 1:
+        grid = grid.resize((round(grid.width * scale), round(grid.height * scale)), Image.BICUBIC)
+    buf = io.BytesIO()
+    grid.save(buf, "JPEG", quality=92)
+    return buf.getvalue()
+
+
+def run(variant: str, path: str, repeats: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, variant, path, str(repeats)],
+        cwd=MODEL_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photo", required=True, help="A photo with one or more faces to tile")
+    parser.add_argument("--faces-per-photo", type=int, default=1, help="Faces the detector finds in --photo")
+    parser.add_argument("--faces", type=int, default=100)
+    parser.add_argument("--scale", type=float, default=1.0, help="Upscale the group photo, e.g. to test draft decoding")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "group.jpg")
+        img_bytes = group_photo(args.photo, args.faces_per_photo, args.faces, args.scale)
+        with open(path, "wb") as f:
+            f.write(img_bytes)
+        size = Image.open(path).size
+        results = {variant: run(variant, path, args.repeats) for variant in VARIANTS}
+
+    print(f"Group photo: {size[0]}x{size[1]}, {len(img_bytes) / (1024 * 1024):.1f} MB JPEG")
+    print(f"{'variant':<8}{'faces':>6}" + "".join(f"{s + ' ms':>11}" for s in STAGES)
+          + f"{'total ms':>11}{'base MB':>9}{'peak MB':>9}")
+    for variant, r in results.items():
+        stages = r["stages_ms"]
+        print(f"{variant:<8}{r['faces']:>6}" + "".join(f"{stages[s]:>11.1f}" for s in STAGES)
+              + f"{sum(stages.values()):>11.1f}{r['baseline_rss_mb']:>9.1f}{r['peak_rss_mb']:>9.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"size": size, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark attendance-photo throughput of the inference worker pool.
+
+Each synthetic "photo" runs crowd detection on a JPEG plus one batched
+embedding of --faces crops, which is the model work of one upload. Photos
+are fed from a thread pool so every worker stays busy, and the run is
+repeated for each worker count to show how throughput scales with cores.
+
+Each worker count runs three ways: the pool alone, the pool behind the
+embedding micro-batcher as build_inference() wires it (one batch in flight
+per worker), and behind a batcher with a single batch in flight, which
+leaves only one worker embedding at a time.
+
+Usage: python bench/bench_inference_pool.py --workers 1 2 4 8 [--photos 32] [--faces 60] [--window-ms 10]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_batcher import MicroBatchEmbedder, EMBED_BATCH_WINDOW_MS
+from inference_pool import InferencePool, TORCH_THREADS_PER_WORKER
+
+VARIANTS = ("pool", "batched", "1 in flight")
+
+
+def synthetic_photo(width: int, height: int, seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def run(workers: int, torch_threads: int, photos, faces: torch.Tensor, variant: str, window_ms: float) -> float:
+    pool = InferencePool(workers=workers, torch_threads=torch_threads)
+    inference = pool
+    if variant != "pool":
+        in_flight = workers if variant == "batched" else 1
+        inference = MicroBatchEmbedder(pool, window_ms=window_ms, max_in_flight=in_flight)
+    try:
+        pool.warm_up()
+
+        def one_photo(img_bytes):
+            inference.detect_faces(img_bytes)
+            inference.embed(faces)
+
+        with ThreadPoolExecutor(max_workers=workers * 2) as feeder:
+            start = time.perf_counter()
+            list(feeder.map(one_photo, photos))
+            elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+    return len(photos) / elapsed * 60
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--torch-threads", type=int, default=TORCH_THREADS_PER_WORKER)
+    parser.add_argument("--photos", type=int, default=32)
+    parser.add_argument("--faces", type=int, default=60)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--window-ms", type=float, default=EMBED_BATCH_WINDOW_MS or 10)
+    args = parser.parse_args()
+
+    photos = [synthetic_photo(args.width, args.height, seed) for seed in range(args.photos)]
+    faces = torch.randn(args.faces, 3, 160, 160)
+
+    print(f"{args.photos} photos of {args.width}x{args.height}, {args.faces} faces each, "
+          f"{args.torch_threads} torch thread(s) per worker, {os.cpu_count()} CPUs")
+    print(f"photos/min; speedup against 1 worker without batching; {args.window_ms:g} ms batching window")
+    print(f"{'workers':>8}" + "".join(f"{name:>14}{'speedup':>9}" for name in VARIANTS))
+    baseline = None
+    for workers in args.workers:
+        row = f"{workers:>8}"
+        for variant in VARIANTS:
+            rate = run(workers, args.torch_threads, photos, faces, variant, args.window_ms)
+            baseline = baseline or rate
+            row += f"{rate:>14.1f}{rate / baseline:>8.2f}x"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Overhead of the metrics layer on the hot path.
+
+Runs the same measurements in fresh interpreters, alternately with
+METRICS_ENABLED=0 and with metrics on, against a throw-away SQLite
+database, and keeps the best figure of each over --rounds:
+
+* observe / stage: one histogram observation, one `metrics.stage()` block;
+* sql: one `SELECT 1` through the instrumented engine;
+* http: one request to the health endpoint through the app's middleware
+  (TestClient, so the figure includes its in-process transport).
+
+The difference per call times the calls of one request gives the cost per
+attendance upload: about a dozen stages, a few dozen SQL statements and a
+handful of Qdrant calls.
+
+Usage: python bench/bench_metrics.py [--iterations 20000] [--rounds 3] [--json FILE]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEASUREMENTS = ("observe", "stage", "sql", "http")
+
+_CHILD = """
+import json, sys, time
+import metrics
+from database import engine
+
+iterations = int(sys.argv[1])
+
+
+def per_call_us(fn, n):
+    for _ in range(min(n, 1000)):
+        fn()
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, (time.perf_counter() - start) / n)
+    return best * 1e6
+
+
+def stage():
+    with metrics.stage("bench"):
+        pass
+
+
+with engine.connect() as conn:
+    sql = per_call_us(lambda: conn.exec_driver_sql("SELECT 1"), iterations // 4)
+
+import main
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    http = per_call_us(lambda: client.get("/"), iterations // 20)
+
+print(json.dumps({
+    "observe": per_call_us(lambda: metrics.STAGE_SECONDS.observe(0.01, "/bench", "bench"), iterations),
+    "stage": per_call_us(stage, iterations),
+    "sql": sql,
+    "http": http,
+}))
+"""
+
+
+def run(enabled: bool, iterations: int, workdir: str) -> dict:
+    env = dict(
+        os.environ,
+        METRICS_ENABLED="1" if enabled else "0",
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'metrics.db')}",
+        QDRANT_URL=":memory:",
+        MODEL_WARMUP="0",
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, str(iterations)],
+        cwd=MODEL_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = {"off": {}, "on": {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(args.rounds):
+            for variant, enabled in (("off", False), ("on", True)):
+                for name, value in run(enabled, args.iterations, workdir).items():
+                    results[variant][name] = min(value, results[variant].get(name, value))
+
+    print(f"{'per call':<10}{'off us':>10}{'on us':>10}{'added us':>10}")
+    for name in MEASUREMENTS:
+        off, on = results["off"][name], results["on"][name]
+        print(f"{name:<10}{off:>10.2f}{on:>10.2f}{on - off:>10.2f}")
+    added = {name: results["on"][name] - results["off"][name] for name in MEASUREMENTS}
+    # One upload: ~12 stages, ~40 SQL statements, ~10 Qdrant calls (timed like a stage), one request
+    per_upload = 22 * added["stage"] + 40 * added["sql"] + added["http"]
+    print(f"Estimated overhead per attendance upload: {per_upload:.0f} us")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "per_upload_us": per_upload}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+End-to-end benchmark of attendance uploads.
+
+Builds synthetic classroom photos offline: one face per student, drawn
+(MTCNN finds drawn faces; no download needed) or taken from --faces-dir,
+composited in rows of seats onto a background at every --sizes x
+--face-counts combination. A fresh interpreter then seeds a temporary
+SQLite database and an in-memory Qdrant, registers every student through
+the API and uploads each photo --repeats times through FastAPI's
+TestClient, each time into a new session, polling the job until it is
+done. The result cache is off, so every upload runs the models.
+
+Per scenario it reports the median of:
+
+* endpoint: from POST upload-image to the finished job;
+* post: the upload request itself (save and queue);
+* each pipeline stage of the job, from the metrics module (queue, hash,
+  detect and its decode / mtcnn / crop parts, quality, embed, match,
+  record), plus all SQL and Qdrant time and the SQL statement count.
+
+The ResNet weights are untrained unless FACENET_PRETRAINED is set (and
+downloaded): timings are the same, matches are not meaningful.
+
+Judge a performance change by running the suite before it with --json
+and after it with --compare: every figure more than --tolerance slower
+than the baseline (and at least --min-ms) is flagged, and the exit status
+is 1 when anything regressed.
+
+Usage: python bench/bench_pipeline.py [--sizes 1280x720,1920x1080] [--face-counts 10,40]
+                                      [--repeats 3] [--faces-dir DIR] [--json FILE]
+                                      [--compare BASELINE] [--tolerance 0.15]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(MODEL_DIR)
+
+UPLOAD_ENDPOINT = "/api/attendance/sessions/{session_id}/upload-image"
+STAGES = ("queue", "hash", "detect", "decode", "mtcnn", "crop", "quality", "embed", "match", "record")
+# Settings that change the figures, recorded next to the results
+PERF_ENV = (
+    "INFERENCE_RUNTIME", "DETECTION_MODE", "INFERENCE_WORKERS", "EMBED_BACKEND", "EMBED_MAX_BATCH_SIZE",
+    "MATCH_MODE", "MIN_FACE_QUALITY", "FACE_MIN_SIDE", "DECODE_MAX_SIDE", "ATTENDANCE_WORKERS", "FACENET_PRETRAINED"
+)
+
+
+# --------------------------
+# Synthetic photos
+# --------------------------
+def _color(rng, low, high):
+    return tuple(int(v) for v in rng.integers(low, high, 3))
+
+
+def draw_face(seed: int, size: int = 160) -> Image.Image:
+    """A schematic face (skin, hair, eyes, nose, mouth) that MTCNN detects; the same for the same seed"""
+    rng = np.random.default_rng(seed)
+    s = size
+    tone = rng.uniform(0, 1)
+    skin = (int(240 - 120 * tone), int(200 - 120 * tone), int(170 - 110 * tone))
+    hair = _color(rng, 10, 90)
+    # A background that contrasts with the skin, or MTCNN misses the outline
+    img = Image.new("RGB", (s, s), _color(rng, 150, 230) if sum(skin) < 450 else _color(rng, 40, 110))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse([s * 0.18, s * 0.08, s * 0.82, s * 0.95], fill=skin)
+    draw.chord([s * 0.16, s * 0.02, s * 0.84, s * 0.6], 180, 360, fill=hair)
+    for x in (0.36, 0.64):
+        draw.ellipse([s * (x - 0.07), s * 0.40, s * (x + 0.07), s * 0.48], fill=(245, 245, 245))
+        draw.ellipse([s * (x - 0.03), s * 0.41, s * (x + 0.03), s * 0.47], fill=(30, 25, 20))
+        draw.line([s * (x - 0.08), s * 0.36, s * (x + 0.08), s * 0.35], fill=hair, width=max(1, int(s * 0.02)))
+    draw.polygon([(s * 0.5, s * 0.47), (s * 0.45, s * 0.62), (s * 0.55, s * 0.62)], fill=tuple(max(0, c - 35) for c in skin))
+    draw.chord([s * 0.38, s * 0.66, s * 0.62, s * 0.80], 0, 180, fill=(150, 50, 60))
+    return img.filter(ImageFilter.GaussianBlur(s * 0.01))
+
+
+def load_faces(faces_dir: str) -> list:
+    """Square centre crops of every image in a directory, in name order"""
+    faces = []
+    for name in sorted(os.listdir(faces_dir)):
+        try:
+            img = Image.open(os.path.join(faces_dir, name)).convert("RGB")
+        except OSError:
+            continue
+        side = min(img.size)
+        left, top = (img.width - side) // 2, (img.height - side) // 2
+        faces.append(img.crop((left, top, left + side, top + side)).resize((160, 160), Image.BICUBIC))
+    if not faces:
+        raise SystemExit(f"No images in {faces_dir}")
+    return faces
+
+
+def student_face(student: int, faces: list = None) -> Image.Image:
+    return faces[student % len(faces)] if faces else draw_face(student)
+
+
+def classroom_photo(students, width: int, height: int, seed: int, faces: list = None) -> bytes:
+    """A JPEG of the students' faces in rows of seats, smaller towards the back"""
+    rng = np.random.default_rng(seed)
+    top = int(height * 0.15)  # the board
+    gradient = np.linspace(70, 150, height, dtype=np.float32)[:, None, None] * np.array([1.0, 0.95, 0.85])
+    canvas = np.broadcast_to(gradient, (height, width, 3)) + rng.normal(0, 6, (height, width, 3))
+    canvas[:top] = (40, 60, 50)
+    img = Image.fromarray(np.clip(canvas, 0, 255).astype(np.uint8))
+
+    seats = list(rng.permutation(len(students)))
+    columns = max(1, int(np.ceil(np.sqrt(len(students) * width / (height - top)))))
+    rows = int(np.ceil(len(students) / columns))
+    cell_w, cell_h = width / columns, (height - top) / rows
+    for student, seat in zip(students, seats):
+        row, column = divmod(int(seat), columns)
+        depth = 0.7 + 0.3 * (row + 1) / rows  # back rows are further away
+        size = int(min(cell_w, cell_h) * 0.7 * depth * rng.uniform(0.9, 1.1))
+        x = int(column * cell_w + (cell_w - size) / 2 + rng.uniform(-0.1, 0.1) * cell_w)
+        y = int(top + row * cell_h + (cell_h - size) / 2)
+        img.paste(student_face(student, faces).resize((size, size), Image.BICUBIC), (max(0, x), max(0, y)))
+
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def portrait(student: int, faces: list = None) -> bytes:
+    """A registration photo: the student's face alone on a plain background"""
+    img = Image.new("RGB", (320, 320), (128, 128, 128))
+    img.paste(student_face(student, faces).resize((200, 200), Image.BICUBIC), (60, 60))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=95)
+    return buf.getvalue()
+
+
+# --------------------------
+# Benchmark run (child interpreter)
+# --------------------------
+def _median_ms(values) -> float:
+    return round(float(np.median(values)) * 1000, 2) if len(values) else None
+
+
+def _delta(after: dict, before: dict, endpoint: str, key=None) -> dict:
+    """Count and seconds recorded for `endpoint` between two Histogram.totals() snapshots, by label"""
+    out = {}
+    for labels, (count, total) in after.items():
+        if labels[0] != endpoint:
+            continue
+        previous = before.get(labels, (0, 0.0))
+        name = labels[1] if key is None else key
+        count0, total0 = out.get(name, (0, 0.0))
+        out[name] = (count0 + count - previous[0], total0 + total - previous[1])
+    return out
+
+
+def run_suite(config: dict) -> dict:
+    """Seed a database, register the students and time every scenario; runs inside the child"""
+    import main
+    import metrics
+    from auth import create_access_token, get_password_hash
+    from database import SessionLocal, User, Subject, Enrollment
+    from fastapi.testclient import TestClient
+
+    faces = load_faces(config["faces_dir"]) if config["faces_dir"] else None
+    students_needed = max(config["face_counts"])
+
+    with TestClient(main.app) as client:
+        db = SessionLocal()
+        teacher = User(name="Bench Teacher", email="teacher@bench.local", role="teacher",
+                       password_hash=get_password_hash("bench"))
+        db.add(teacher)
+        db.flush()
+        subject = Subject(name="Benchmark", code="BENCH", teacher_id=teacher.id)
+        students = [
+            User(name=f"Student {i}", email=f"s{i}@bench.local", role="student", prn=f"B{i:05d}",
+                 password_hash=teacher.password_hash)
+            for i in range(students_needed)
+        ]
+        db.add(subject)
+        db.add_all(students)
+        db.flush()
+        db.add_all([Enrollment(student_id=s.id, subject_id=subject.id) for s in students])
+        db.commit()
+        student_ids, subject_id = [s.id for s in students], subject.id
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': str(teacher.id)})}"}
+        db.close()
+
+        start = time.perf_counter()
+        main.vision.load()
+        model_load = time.perf_counter() - start
+
+        register = []
+        for i, student_id in enumerate(student_ids):
+            start = time.perf_counter()
+            response = client.post(f"/api/students/{student_id}/register-face", headers=headers,
+                                   files={"img": ("face.jpg", portrait(i, faces), "image/jpeg")})
+            register.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                print(f"ℹ️  Student {i} not registered: {response.json()}", file=sys.stderr)
+
+        def upload(photo: bytes) -> dict:
+            session_id = client.post("/api/attendance/sessions", headers=headers, json={
+                "subject_id": subject_id, "session_date": "2026-01-01T09:00:00", "class_type": "lecture"
+            }).json()["id"]
+            stages, db_totals = metrics.STAGE_SECONDS.totals(), metrics.DB_SECONDS.totals()
+            qdrant, faces_found = metrics.QDRANT_SECONDS.totals(), metrics.FACES_PER_IMAGE.totals()
+            start = time.perf_counter()
+            response = client.post(f"/api/attendance/sessions/{session_id}/upload-image", headers=headers,
+                                   files={"image": ("class.jpg", photo, "image/jpeg")})
+            posted = time.perf_counter() - start
+            job_id = response.json()["job_id"]
+            while True:
+                job = client.get(f"/api/attendance/jobs/{job_id}", headers=headers).json()
+                if job["status"] in ("done", "error"):
+                    break
+                time.sleep(0.002)
+            elapsed = time.perf_counter() - start
+            if job["status"] == "error":
+                raise SystemExit(f"Upload failed: {job['error']}")
+            statements, sql = _delta(metrics.DB_SECONDS.totals(), db_totals, UPLOAD_ENDPOINT, "sql")["sql"]
+            return {
+                "endpoint": elapsed,
+                "post": posted,
+                "stages": {k: v[1] for k, v in _delta(metrics.STAGE_SECONDS.totals(), stages, UPLOAD_ENDPOINT).items()},
+                "sql": sql,
+                "sql_statements": statements,
+                "qdrant": _delta(metrics.QDRANT_SECONDS.totals(), qdrant, UPLOAD_ENDPOINT, "qdrant").get("qdrant", (0, 0.0))[1],
+                "faces_detected": int(metrics.FACES_PER_IMAGE.totals()[(UPLOAD_ENDPOINT,)][1]
+                                      - faces_found.get((UPLOAD_ENDPOINT,), (0, 0.0))[1]),
+                "present": job["result"]["total_detected"],
+            }
+
+        upload(classroom_photo(range(min(5, students_needed)), 640, 480, seed=1000, faces=faces))  # warm-up
+        scenarios = []
+        for width, height in config["sizes"]:
+            for count in config["face_counts"]:
+                runs = []
+                for repeat in range(config["repeats"]):
+                    photo = classroom_photo(range(count), width, height, seed=repeat, faces=faces)
+                    runs.append(upload(photo))
+                scenario = {
+                    "name": f"{width}x{height}-{count}",
+                    "width": width,
+                    "height": height,
+                    "faces": count,
+                    "faces_detected": runs[-1]["faces_detected"],
+                    "present": runs[-1]["present"],
+                    "endpoint_ms": _median_ms([r["endpoint"] for r in runs]),
+                    "endpoint_min_ms": round(min(r["endpoint"] for r in runs) * 1000, 2),
+                    "post_ms": _median_ms([r["post"] for r in runs]),
+                    "stages_ms": {
+                        stage: _median_ms([r["stages"].get(stage, 0.0) for r in runs])
+                        for stage in STAGES if any(stage in r["stages"] for r in runs)
+                    },
+                    "sql_ms": _median_ms([r["sql"] for r in runs]),
+                    "sql_statements": int(np.median([r["sql_statements"] for r in runs])),
+                    "qdrant_ms": _median_ms([r["qdrant"] for r in runs]),
+                }
+                scenarios.append(scenario)
+                print(f"ℹ️  {scenario['name']}: {scenario['endpoint_ms']} ms", file=sys.stderr)
+
+    return {
+        "model_load_s": round(model_load, 2),
+        "register_ms": _median_ms(register),
+        "scenarios": scenarios,
+    }
+
+
+def run(config: dict) -> dict:
+    """Run the suite in a fresh interpreter with a throw-away database"""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            QDRANT_URL=":memory:",
+            MODEL_WARMUP="0",
+            RESULT_CACHE_MAX_MB="0",
+            METRICS_ENABLED="1",
+        )
+        env.setdefault("FACENET_PRETRAINED", "")
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", json.dumps(config)],
+            cwd=workdir, env=env, stdout=subprocess.PIPE, text=True, check=True
+        ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+# --------------------------
+# Report and comparison
+# --------------------------
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=MODEL_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "settings": {name: os.environ[name] for name in PERF_ENV if name in os.environ},
+    }
+
+
+def figures(scenario: dict) -> dict:
+    """Every timing of a scenario in milliseconds, by name"""
+    values = {"endpoint": scenario["endpoint_ms"], "post": scenario["post_ms"],
+              "sql": scenario["sql_ms"], "qdrant": scenario["qdrant_ms"]}
+    values.update({f"stage.{k}": v for k, v in scenario["stages_ms"].items()})
+    return {k: v for k, v in values.items() if v is not None}
+
+
+def print_results(results: dict) -> None:
+    print(f"Model load {results['model_load_s']}s, face registration {results['register_ms']} ms median")
+    stages = [s for s in STAGES if any(s in r["stages_ms"] for r in results["scenarios"])]
+    print(f"{'scenario':<18}{'found':>6}{'present':>8}{'endpoint':>10}{'post':>7}"
+          + "".join(f"{s:>8}" for s in stages) + f"{'sql':>7}{'stmts':>6}{'qdrant':>7}")
+    for r in results["scenarios"]:
+        print(f"{r['name']:<18}{r['faces_detected']:>6}{r['present']:>8}{r['endpoint_ms']:>10.1f}{r['post_ms']:>7.1f}"
+              + "".join(f"{r['stages_ms'].get(s, 0.0):>8.1f}" for s in stages)
+              + f"{r['sql_ms']:>7.1f}{r['sql_statements']:>6}{r['qdrant_ms']:>7.1f}")
+    print("(milliseconds, median per upload)")
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_ms: float) -> list:
+    """Print every figure next to the baseline; returns the regressions"""
+    if baseline.get("config") != results.get("config"):
+        print("ℹ️  The baseline was run with different options; only matching scenarios are compared")
+    settings = (baseline.get("environment", {}).get("settings"), results["environment"]["settings"])
+    if settings[0] != settings[1]:
+        print(f"ℹ️  Settings differ: baseline {settings[0]}, now {settings[1]}")
+
+    previous = {s["name"]: s for s in baseline["scenarios"]}
+    regressions = []
+    print(f"{'scenario':<18}{'figure':<16}{'baseline':>10}{'now':>10}{'change':>9}")
+    for scenario in results["scenarios"]:
+        if scenario["name"] not in previous:
+            continue
+        before = figures(previous[scenario["name"]])
+        for name, now in figures(scenario).items():
+            if name not in before:
+                continue
+            then = before[name]
+            change = (now - then) / then if then else 0.0
+            flag = ""
+            if now - then > min_ms and change > tolerance:
+                flag = "  REGRESSION"
+                regressions.append((scenario["name"], name, then, now))
+            elif then - now > min_ms and -change > tolerance:
+                flag = "  faster"
+            print(f"{scenario['name']:<18}{name:<16}{then:>10.1f}{now:>10.1f}{change:>+9.1%}{flag}")
+        stmts = (previous[scenario["name"]].get("sql_statements"), scenario["sql_statements"])
+        if stmts[0] is not None and stmts[1] > stmts[0]:
+            print(f"{scenario['name']:<18}{'sql statements':<16}{stmts[0]:>10}{stmts[1]:>10}  MORE QUERIES")
+            regressions.append((scenario["name"], "sql_statements", stmts[0], stmts[1]))
+    return regressions
+
+
+def _size(text: str):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1280x720,1920x1080,4032x3024", help="Photo resolutions, WxH,...")
+    parser.add_argument("--face-counts", default="10,40", help="Faces per photo, comma separated")
+    parser.add_argument("--repeats", type=int, default=3, help="Uploads per scenario")
+    parser.add_argument("--faces-dir", help="Face photos to composite instead of drawn faces, one per student")
+    parser.add_argument("--json", help="Write the results to this file (e.g. a baseline)")
+    parser.add_argument("--compare", help="Baseline results to flag regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative slowdown flagged as a regression")
+    parser.add_argument("--min-ms", type=float, default=5.0, help="Ignore differences smaller than this")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_suite(json.loads(args.child))))
+        return
+
+    config = {
+        "sizes": [_size(s) for s in args.sizes.split(",")],
+        "face_counts": [int(n) for n in args.face_counts.split(",")],
+        "repeats": args.repeats,
+        "faces_dir": os.path.abspath(args.faces_dir) if args.faces_dir else None,
+    }
+    results = {"config": config, "environment": environment(), **run(config)}
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_ms)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) against {args.compare}")
+            sys.exit(1)
+        print(f"✅ No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
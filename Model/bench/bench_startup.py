@@ -0,0 +1,94 @@
+"""
+API cold-start benchmark.
+
+Each measurement runs in a fresh interpreter against a throw-away SQLite
+database and an in-memory Qdrant:
+
+* import: `import main`, and which heavy libraries that pulled in;
+* crud: import plus application startup until the first CRUD-style request
+  (the liveness endpoint) is answered, with the background warm-up off;
+* ready (--with-models): import until /api/health/ready reports the face
+  models loaded by the background warm-up.
+
+Usage: python bench/bench_startup.py [--repeats 5] [--with-models]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("torch", "onnxruntime", "facenet_pytorch", "scipy", "qdrant_client")
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+result = {"import": imported}
+if sys.argv[1] != "import":
+    from fastapi.testclient import TestClient
+    with TestClient(main.app) as client:
+        assert client.get("/").status_code == 200
+        result["crud"] = time.perf_counter() - start
+        if sys.argv[1] == "ready":
+            while client.get("/api/health/ready").status_code != 200:
+                if main.vision.state == "error":
+                    raise SystemExit(main.vision.error)
+                time.sleep(0.05)
+            result["ready"] = time.perf_counter() - start
+result["heavy_modules"] = [m for m in %r if m in sys.modules]
+print(json.dumps(result))
+""" % (HEAVY_MODULES,)
+
+
+def run(phase: str, workdir: str) -> dict:
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+        QDRANT_URL=":memory:",
+        MODEL_WARMUP="1" if phase == "ready" else "0",
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, phase],
+        cwd=MODEL_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--with-models", action="store_true", help="Also time until the face models are ready")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    phases = ["import", "crud"] + (["ready"] if args.with_models else [])
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        # One untimed run so every phase sees a warm filesystem cache
+        run("import", workdir)
+        for phase in phases:
+            runs = [run(phase, workdir) for _ in range(args.repeats)]
+            seconds = np.array([r[phase] for r in runs])
+            results[phase] = {
+                "median_s": round(float(np.median(seconds)), 3),
+                "min_s": round(float(seconds.min()), 3),
+                "max_s": round(float(seconds.max()), 3),
+                "heavy_modules": runs[-1]["heavy_modules"],
+            }
+
+    print(f"{'phase':<8}{'median s':>10}{'min s':>8}{'max s':>8}  heavy modules loaded")
+    for phase, r in results.items():
+        print(f"{phase:<8}{r['median_s']:>10.3f}{r['min_s']:>8.3f}{r['max_s']:>8.3f}  {', '.join(r['heavy_modules']) or '-'}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
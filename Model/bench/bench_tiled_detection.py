@@ -0,0 +1,99 @@
+"""
+Benchmark tiled crowd detection against a single full-frame MTCNN pass.
+
+Each mode runs in its own subprocess so peak RSS is measured separately.
+Pass real classroom photos with --image. Without one, a synthetic photo of
+--megapixels is built, with face crops from --faces-dir pasted at random
+back-row and front-row sizes when that directory is given.
+
+Usage: python bench/bench_tiled_detection.py [--image photo.jpg] [--megapixels 24] [--faces-dir crops/]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(MODEL_DIR)
+
+
+def synthetic_photo(path: str, megapixels: float, faces_dir: str, faces: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    canvas = Image.fromarray(rng.integers(60, 200, size=(height, width, 3), dtype=np.uint8))
+
+    if faces_dir:
+        crops = [os.path.join(faces_dir, f) for f in sorted(os.listdir(faces_dir))]
+        for i in range(faces):
+            face = Image.open(crops[i % len(crops)]).convert("RGB")
+            # Mostly small back-row faces, a few large front-row ones
+            size = int(rng.choice([rng.uniform(24, 60), rng.uniform(150, 400)], p=[0.8, 0.2]))
+            face = face.resize((size, size))
+            canvas.paste(face, (int(rng.integers(0, width - size)), int(rng.integers(0, height - size))))
+    canvas.save(path, "JPEG", quality=92)
+
+
+def run_mode(mode: str, image_path: str) -> dict:
+    """Executed in a child process: detect once to warm up, then time a second run"""
+    from facenet_pytorch import MTCNN
+    from tiled_detection import TiledDetector
+
+    mtcnn = MTCNN(keep_all=True, device="cpu")
+    detector = TiledDetector(mtcnn) if mode == "tiled" else mtcnn
+    img = Image.open(image_path).convert("RGB")
+
+    detector.detect(img.resize((640, 480)))
+    start = time.perf_counter()
+    boxes, _ = detector.detect(img)
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "seconds": round(elapsed, 3),
+        "faces": 0 if boxes is None else len(boxes),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", action="append", help="Photo to detect on (repeatable)")
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--faces-dir", help="Directory of face crops to paste into the synthetic photo")
+    parser.add_argument("--faces", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "IMAGE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(*args.child)))
+        return
+
+    images = args.image
+    if not images:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.jpg")
+        synthetic_photo(path, args.megapixels, args.faces_dir, args.faces, args.seed)
+        images = [path]
+
+    print(f"{'image':<28}{'mode':<8}{'seconds':>10}{'faces':>8}{'peak RSS MB':>14}")
+    for image in images:
+        size = Image.open(image).size
+        for mode in ("single", "tiled"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", mode, image],
+                capture_output=True, text=True, check=True, cwd=MODEL_DIR
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            label = f"{os.path.basename(image)} {size[0]}x{size[1]}"
+            print(f"{label:<28}{mode:<8}{result['seconds']:>10.2f}{result['faces']:>8}{result['peak_rss_mb']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Accuracy-regression check and latency benchmark for the FaceNet backends.
+
+Every backend (eager fp32, TorchScript, int8-dynamic, int8-static) embeds a
+local fixture set and is compared with eager fp32:
+
+* cosine similarity of each crop's embedding to its fp32 embedding;
+* top-1 identity agreement: the first crop of every identity is the gallery,
+  the remaining crops are probes, and each probe's best gallery match must
+  be the same identity fp32 picks.
+
+The fixture directory holds one sub-directory of aligned face crops per
+identity. The script exits non-zero when an int8 backend falls below the
+agreement bar, so it can gate switching production to int8.
+
+Usage: python bench/check_embedding_backends.py --fixtures faces/ [--min-agreement 0.99]
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_engine import EMBEDDING_BACKENDS, EMBED_CALIBRATION_DIR, build_embedding_model, load_face_crops
+from model_registry import FACENET_PRETRAINED
+
+INT8_MIN_AGREEMENT = float(os.getenv("INT8_MIN_AGREEMENT", "0.99"))
+
+
+def load_fixtures(directory: str):
+    crops, labels = [], []
+    for identity in sorted(os.listdir(directory)):
+        path = os.path.join(directory, identity)
+        if os.path.isdir(path):
+            faces = load_face_crops(path)
+            crops += faces
+            labels += [identity] * len(faces)
+    if not crops:
+        raise SystemExit(f"No face crops found under {directory}")
+    return torch.stack(crops), np.array(labels)
+
+
+def embed(model, crops: torch.Tensor, batch: int) -> np.ndarray:
+    with torch.no_grad():
+        out = [model(crops[i:i + batch]) for i in range(0, len(crops), batch)]
+    out = torch.cat(out).numpy()
+    return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+def top1_identities(embeddings: np.ndarray, labels: np.ndarray):
+    """Best gallery identity for every probe (gallery = first crop of each identity)"""
+    _, gallery_idx = np.unique(labels, return_index=True)
+    probe_mask = np.ones(len(labels), dtype=bool)
+    probe_mask[gallery_idx] = False
+    scores = embeddings[probe_mask] @ embeddings[gallery_idx].T
+    return labels[gallery_idx][scores.argmax(axis=1)], labels[probe_mask]
+
+
+def latency_ms(model, crops: torch.Tensor, batch: int, repeats: int) -> float:
+    sample = crops[:batch] if len(crops) >= batch else crops.repeat((batch // len(crops)) + 1, 1, 1, 1)[:batch]
+    timings = []
+    with torch.no_grad():
+        model(sample)
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(sample)
+            timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", required=True, help="Directory with one sub-directory of crops per identity")
+    parser.add_argument("--calibration", default=EMBED_CALIBRATION_DIR,
+                        help="Crops used to calibrate int8-static (defaults to the fixtures)")
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--min-agreement", type=float, default=INT8_MIN_AGREEMENT)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    from facenet_pytorch import InceptionResnetV1
+
+    crops, labels = load_fixtures(args.fixtures)
+    calibration = torch.stack(load_face_crops(args.calibration, 256)) if args.calibration else crops
+    print(f"{len(crops)} crops of {len(set(labels))} identities, weights: {FACENET_PRETRAINED}")
+
+    reference_model = InceptionResnetV1(pretrained=FACENET_PRETRAINED).eval()
+    reference = embed(reference_model, crops, args.batch)
+    reference_top1, truth = top1_identities(reference, labels)
+
+    print(f"{'backend':<14}{'mean cos':>10}{'min cos':>10}{'top-1 agree':>13}{'top-1 acc':>11}{'ms/batch':>10}")
+    failed = []
+    for backend in args.backends:
+        model = build_embedding_model(copy.deepcopy(reference_model), backend, calibration=calibration)
+        embeddings = embed(model, crops, args.batch)
+
+        cosine = np.sum(embeddings * reference, axis=1)
+        top1, _ = top1_identities(embeddings, labels)
+        agreement = float(np.mean(top1 == reference_top1)) if len(top1) else 1.0
+        accuracy = float(np.mean(top1 == truth)) if len(top1) else 1.0
+        latency = latency_ms(model, crops, args.batch, args.repeats)
+
+        print(f"{backend:<14}{cosine.mean():>10.4f}{cosine.min():>10.4f}{agreement:>13.3f}{accuracy:>11.3f}{latency:>10.1f}")
+        if backend.startswith("int8") and agreement < args.min_agreement:
+            failed.append(backend)
+
+    if failed:
+        print(f"❌ Below the {args.min_agreement:.3f} top-1 agreement bar: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✅ All int8 backends meet the {args.min_agreement:.3f} top-1 agreement bar")
+
+
+if __name__ == "__main__":
+    main()
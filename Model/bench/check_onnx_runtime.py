@@ -0,0 +1,132 @@
+"""
+Equivalence check and startup/latency comparison of the ONNX Runtime backend.
+
+The torch models are exported to a temporary directory (or --model-dir is
+used as is) and both runtimes process the same inputs:
+
+* embeddings of the fixture crops: cosine similarity to the torch embedding
+  and the largest absolute difference;
+* detection on the given photos: number of faces, largest crop difference and
+  cosine similarity of the resulting crowd-photo embeddings.
+
+Each runtime is also started in a fresh interpreter to measure how long
+loading all models takes and the peak memory of that process. The script
+exits non-zero when any embedding falls below the cosine tolerance or
+the runtimes find a different number of faces.
+
+Usage: python bench/check_onnx_runtime.py --fixtures faces/ [--photos photos/] [--min-cosine 0.9999]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from export_onnx import export_models
+from face_engine import IMAGE_EXTENSIONS, load_face_crops
+from face_inference import INFERENCE_RUNTIMES
+from model_registry import ModelRegistry
+from onnx_backend import OnnxInference
+
+ONNX_MIN_COSINE = float(os.getenv("ONNX_MIN_COSINE", "0.9999"))
+
+# VmHWM rather than ru_maxrss: the latter carries over the parent's peak across fork+exec
+_STARTUP_SNIPPET = (
+    "import sys, time; start = time.perf_counter(); "
+    "from face_inference import create_inference; create_inference(sys.argv[1]); "
+    "hwm = [l for l in open('/proc/self/status') if l.startswith('VmHWM')][0].split()[1]; "
+    "print(time.perf_counter() - start, hwm)"
+)
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def startup(runtime: str, model_dir: str):
+    """Seconds to load every model and peak RSS (MB) in a fresh interpreter"""
+    env = dict(os.environ, ONNX_MODEL_DIR=model_dir)
+    out = subprocess.run(
+        [sys.executable, "-c", _STARTUP_SNIPPET, runtime],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env, capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(out[-2]), int(out[-1]) / 1024
+
+
+def latency_ms(fn, repeats: int) -> float:
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", required=True, help="Directory tree of aligned face crops")
+    parser.add_argument("--photos", help="Directory of photos to compare detection on")
+    parser.add_argument("--model-dir", help="Check these exported graphs instead of exporting afresh")
+    parser.add_argument("--min-cosine", type=float, default=ONNX_MIN_COSINE)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    torch_backend = ModelRegistry(detection_mode="single", embed_backend="eager")
+    torch_backend.load_all()
+    model_dir = args.model_dir or tempfile.mkdtemp(prefix="onnx-check-")
+    if not args.model_dir:
+        export_models(model_dir, mtcnn=torch_backend.mtcnn_single, resnet=torch_backend.resnet)
+    onnx_backend = OnnxInference(model_dir, detection_mode="single")
+    onnx_backend.load_all()
+
+    crops = torch.stack(load_face_crops(args.fixtures))
+    reference = torch_backend.embed(crops)
+    embeddings = onnx_backend.embed(crops.numpy())
+    cosine = np.sum(normalize(reference) * normalize(embeddings), axis=1)
+    print(f"{len(crops)} crops: mean cos {cosine.mean():.6f}, min cos {cosine.min():.6f}, "
+          f"max |diff| {np.abs(reference - embeddings).max():.2e}")
+    failed = cosine.min() < args.min_cosine
+
+    if args.photos:
+        for name in sorted(os.listdir(args.photos)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            with open(os.path.join(args.photos, name), "rb") as f:
+                img_bytes = f.read()
+            t_faces, _ = torch_backend.detect_faces(img_bytes)
+            o_faces, _ = onnx_backend.detect_faces(img_bytes)
+            t_count = 0 if t_faces is None else len(t_faces)
+            o_count = 0 if o_faces is None else len(o_faces)
+            line = f"{name}: torch {t_count} faces, onnx {o_count} faces"
+            if t_count and t_count == o_count:
+                photo_cos = np.sum(normalize(torch_backend.embed(t_faces)) * normalize(onnx_backend.embed(o_faces)), axis=1)
+                line += f", max crop |diff| {np.abs(t_faces.numpy() - o_faces).max():.2e}, min cos {photo_cos.min():.6f}"
+                failed |= photo_cos.min() < args.min_cosine
+            else:
+                failed |= t_count != o_count
+            print(line)
+
+    sample = crops[:args.batch]
+    print(f"{'runtime':<8}{'load s':>9}{'peak MB':>10}{'ms/batch':>10}")
+    for runtime, backend in zip(INFERENCE_RUNTIMES, (torch_backend, onnx_backend)):
+        seconds, peak_mb = startup(runtime, model_dir)
+        batch = sample if runtime == "torch" else sample.numpy()
+        latency = latency_ms(lambda: backend.embed(batch), args.repeats)
+        print(f"{runtime:<8}{seconds:>9.2f}{peak_mb:>10.0f}{latency:>10.1f}")
+
+    if failed:
+        print(f"❌ ONNX Runtime output differs from torch beyond cos {args.min_cosine}")
+        sys.exit(1)
+    print(f"✅ ONNX Runtime matches torch within cos {args.min_cosine}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Register the faces of a whole cohort at once.
+
+Takes a ZIP file or a directory of photos named by PRN, either
+`<PRN>.jpg` or `<PRN>/<anything>.jpg` for several photos of one student.
+Photos are read and face-detected on a thread pool, the crops of many
+photos are embedded in one batch, and each batch is merged into the
+students' templates with one Qdrant read, upsert and delete (see
+face_templates) before `User.face_registered` is set with one UPDATE.
+
+Every finished photo is appended to a checkpoint file once its batch is
+committed, so an interrupted import resumes where it stopped. Faces are
+merged keyed by the SHA-256 of their photo, so a batch that reached Qdrant
+but not the checkpoint is not merged twice on resume. Photos that
+failed (no face, unknown PRN, unreadable) are skipped on resume unless
+--retry-failed is given.
+
+The models run in this process, on INFERENCE_WORKERS worker processes or
+on the inference service at INFERENCE_URL, as they do for the API. Every
+merged batch bumps the collection's version token, so running API
+processes reload their cached subject indexes on their next match.
+
+Usage: python bulk_import.py SOURCE [--checkpoint FILE] [--workers N] [--batch-size N] [--retry-failed]
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, User
+from face_inference import EMBED_MAX_BATCH_SIZE
+from face_templates import TEMPLATE_MAX_EXEMPLARS, add_faces_batch
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+
+class ImageSource:
+    """The photos of a ZIP file or a directory tree, by relative path"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._zip = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+        if self._zip is not None:
+            names = [i.filename for i in self._zip.infolist() if not i.is_dir()]
+        else:
+            names = [
+                os.path.relpath(os.path.join(root, name), path).replace(os.sep, "/")
+                for root, _, files in os.walk(path)
+                for name in files
+            ]
+        self.names = sorted(n for n in names if n.lower().endswith(IMAGE_EXTENSIONS))
+
+    def read(self, name: str) -> bytes:
+        # ZipFile reads are safe from several threads since Python 3.5
+        if self._zip is not None:
+            return self._zip.read(name)
+        with open(os.path.join(self.path, name), "rb") as f:
+            return f.read()
+
+    def close(self) -> None:
+        if self._zip is not None:
+            self._zip.close()
+
+
+def prn_candidates(name: str) -> List[str]:
+    """PRNs a photo may belong to: its file name, then its directory"""
+    parts = name.split("/")
+    candidates = [os.path.splitext(parts[-1])[0]]
+    if len(parts) > 1:
+        candidates.append(parts[-2])
+    return candidates
+
+
+class Checkpoint:
+    """Append-only JSON-lines log of finished photos"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of an interrupted run
+                    self.done[entry["entry"]] = entry["status"]
+
+    def pending(self, names: List[str], retry_failed: bool = False) -> List[str]:
+        return [
+            n for n in names
+            if n not in self.done or (retry_failed and self.done[n] != "registered")
+        ]
+
+    def record(self, results: List[dict]) -> None:
+        with open(self.path, "a") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        for result in results:
+            self.done[result["entry"]] = result["status"]
+
+
+def _create_inference():
+    """Models of this import: the inference service, a worker pool or this process"""
+    from face_inference import create_inference
+    from inference_client import INFERENCE_URL, create_inference_client
+    from inference_pool import INFERENCE_WORKERS, InferencePool
+
+    if INFERENCE_URL:
+        return create_inference_client(INFERENCE_URL)
+    if INFERENCE_WORKERS > 0:
+        pool = InferencePool()
+        pool.warm_up()
+        return pool
+    return create_inference()
+
+
+class BulkImporter:
+    """Streams photos through detect -> batched embed -> batched upsert -> bulk DB update"""
+
+    def __init__(
+        self,
+        inference,
+        client,
+        collection_name: str,
+        db: Session,
+        workers: int = IMPORT_WORKERS,
+        batch_size: int = EMBED_MAX_BATCH_SIZE,
+        max_exemplars: int = TEMPLATE_MAX_EXEMPLARS
+    ):
+        self.inference = inference
+        self.client = client
+        self.collection_name = collection_name
+        self.db = db
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_exemplars = max_exemplars
+        self.timings = Counter()  # stage -> seconds; "detect" is summed over the workers
+        self.statuses = Counter()
+        self.faces = 0
+        self._batch: List[tuple] = []  # (entry, student, crops, photo sha256) waiting to be embedded
+        self._failed: List[dict] = []
+        self._queued = 0
+
+    def _detect(self, source: ImageSource, name: str):
+        start = time.perf_counter()
+        sha256 = None
+        try:
+            img_bytes = source.read(name)
+            sha256 = hashlib.sha256(img_bytes).hexdigest()
+            faces, _ = self.inference.detect_faces(img_bytes, crowd=False)
+        except Exception as e:
+            return None, sha256, f"{type(e).__name__}: {e}", time.perf_counter() - start
+        faces = None if faces is None else np.asarray(faces, dtype=np.float32)
+        return faces, sha256, None, time.perf_counter() - start
+
+    def run(self, source: ImageSource, checkpoint: Checkpoint, retry_failed: bool = False) -> dict:
+        students = {
+            s.prn: s for s in
+            self.db.query(User.id, User.prn, User.name, User.email).filter(
+                User.role == "student", User.prn.isnot(None)
+            )
+        }
+        names = checkpoint.pending(source.names, retry_failed)
+        self.statuses["skipped"] = len(source.names) - len(names)
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="import") as executor:
+            in_flight = deque()
+            for name in names:
+                student = next((students[p] for p in prn_candidates(name) if p in students), None)
+                if student is None:
+                    self._failed.append({"entry": name, "status": "unknown_prn"})
+                    continue
+                in_flight.append((name, student, executor.submit(self._detect, source, name)))
+                # Keep a bounded number of photos in memory
+                while len(in_flight) >= self.workers * 2:
+                    self._collect(in_flight.popleft(), checkpoint)
+            while in_flight:
+                self._collect(in_flight.popleft(), checkpoint)
+        self._flush(checkpoint)
+
+        wall = time.perf_counter() - start
+        processed = sum(v for k, v in self.statuses.items() if k != "skipped")
+        return {
+            "photos": len(source.names),
+            **dict(self.statuses),
+            "faces_embedded": self.faces,
+            "seconds": round(wall, 2),
+            "photos_per_second": round(processed / wall, 1) if wall else None,
+            "stage_seconds": {k: round(v, 2) for k, v in self.timings.items()},
+        }
+
+    def _collect(self, item, checkpoint: Checkpoint) -> None:
+        name, student, future = item
+        crops, sha256, error, seconds = future.result()
+        self.timings["detect"] += seconds
+        if error is not None:
+            self._failed.append({"entry": name, "status": "unreadable", "error": error})
+        elif crops is None:
+            self._failed.append({"entry": name, "status": "no_face", "prn": student.prn})
+        else:
+            self._batch.append((name, student, crops, sha256))
+            self._queued += len(crops)
+            if self._queued >= self.batch_size:
+                self._flush(checkpoint)
+
+    def _flush(self, checkpoint: Checkpoint) -> None:
+        """Embed, store and commit the waiting photos, then checkpoint them"""
+        batch = self._batch
+        results = list(self._failed)
+        if batch:
+            start = time.perf_counter()
+            embeddings = self.inference.embed(np.concatenate([crops for _, _, crops, _ in batch]))
+            self.timings["embed"] += time.perf_counter() - start
+            self.faces += len(embeddings)
+
+            start = time.perf_counter()
+            faces: Dict[int, tuple] = {}
+            offset = 0
+            registered_at = datetime.utcnow().isoformat()
+            for name, student, crops, sha256 in batch:
+                student_embeddings = embeddings[offset:offset + len(crops)]
+                offset += len(crops)
+                # Every face row names its photo, so add_faces_batch merges a photo only once
+                sources = [sha256] * len(crops)
+                if student.id in faces:
+                    previous_embeddings, _, previous_sources = faces[student.id]
+                    if sha256 in previous_sources:  # the same photo twice in this batch
+                        student_embeddings, sources = previous_embeddings, previous_sources
+                    else:
+                        student_embeddings = np.concatenate([previous_embeddings, student_embeddings])
+                        sources = previous_sources + sources
+                faces[student.id] = (student_embeddings, {
+                    "user_id": student.id,
+                    "prn": student.prn,
+                    "name": student.name,
+                    "email": student.email,
+                    "registered_at": registered_at
+                }, sources)
+                results.append({"entry": name, "status": "registered", "prn": student.prn})
+            add_faces_batch(self.client, self.collection_name, faces, self.max_exemplars)
+            self.timings["upsert"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            self.db.query(User).filter(User.id.in_(faces)).update(
+                {User.face_registered: True}, synchronize_session=False
+            )
+            self.db.commit()
+            self.timings["database"] += time.perf_counter() - start
+
+        if results:
+            checkpoint.record(results)
+            self.statuses.update(r["status"] for r in results)
+        self._batch, self._failed, self._queued = [], [], 0
+
+
+def run_import(
+    source_path: str,
+    checkpoint_path: Optional[str] = None,
+    workers: int = IMPORT_WORKERS,
+    batch_size: int = EMBED_MAX_BATCH_SIZE,
+    max_exemplars: int = TEMPLATE_MAX_EXEMPLARS,
+    retry_failed: bool = False
+) -> dict:
+    from qdrant_client import QdrantClient
+
+    from face_inference import EMBEDDING_SIZE
+    from vision_stack import COLLECTION_NAME, QDRANT_URL, create_collection
+
+    source = ImageSource(source_path)
+    checkpoint = Checkpoint(checkpoint_path or source_path.rstrip("/\\") + ".checkpoint.jsonl")
+    client = QdrantClient(QDRANT_URL)
+    create_collection(client, COLLECTION_NAME, EMBEDDING_SIZE)
+
+    start = time.perf_counter()
+    inference = _create_inference()
+    load_seconds = time.perf_counter() - start
+
+    db = SessionLocal()
+    try:
+        importer = BulkImporter(inference, client, COLLECTION_NAME, db, workers, batch_size, max_exemplars)
+        report = importer.run(source, checkpoint, retry_failed)
+    finally:
+        db.close()
+        source.close()
+        if hasattr(inference, "shutdown"):
+            inference.shutdown()
+        elif hasattr(inference, "close"):
+            inference.close()
+    report["stage_seconds"]["model_load"] = round(load_seconds, 2)
+    report["checkpoint"] = checkpoint.path
+    return report
+
+
+def print_report(report: dict) -> None:
+    print("=" * 60)
+    print(f"✅ {report.get('registered', 0)} of {report['photos']} photos registered "
+          f"in {report['seconds']}s ({report['photos_per_second']} photos/s, "
+          f"{report['faces_embedded']} faces embedded)")
+    for status in ("skipped", "no_face", "unknown_prn", "unreadable"):
+        if report.get(status):
+            print(f"ℹ️  {status}: {report[status]}")
+    print("Stage seconds (detect summed over workers): " +
+          ", ".join(f"{k} {v}" for k, v in report["stage_seconds"].items()))
+    print(f"Checkpoint: {report['checkpoint']}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="ZIP file or directory of photos named by PRN")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: SOURCE.checkpoint.jsonl)")
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS, help="Photos read and detected in parallel")
+    parser.add_argument("--batch-size", type=int, default=EMBED_MAX_BATCH_SIZE, help="Faces per embedding batch")
+    parser.add_argument("--max-exemplars", type=int, default=TEMPLATE_MAX_EXEMPLARS)
+    parser.add_argument("--retry-failed", action="store_true", help="Process photos that failed in earlier runs again")
+    args = parser.parse_args()
+    print_report(run_import(
+        args.source, args.checkpoint, args.workers, args.batch_size, args.max_exemplars, args.retry_failed
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Rewrite a face collection into per-student templates.
+
+Collections written before face_templates hold one point with a random id
+per registration. This groups every point by student and replaces them
+with the student's centroid plus up to --max-exemplars exemplars under
+deterministic ids. Students that already have a template are only cut
+down to the exemplar limit. Safe to run again; running API processes
+pick up the rewritten templates through the collection's version token.
+
+Usage: python compact_templates.py [--qdrant-url URL] [--collection NAME] [--max-exemplars K] [--dry-run]
+"""
+import argparse
+import time
+from collections import defaultdict
+
+from qdrant_client import QdrantClient
+
+from face_templates import TEMPLATE_MAX_EXEMPLARS, compact_template, merged_sources, save_template
+from vision_stack import COLLECTION_NAME, QDRANT_URL
+
+# Payload keys that belong to the template rather than to the student
+_TEMPLATE_KEYS = ("kind", "sample_count", "mean_norm", "sources")
+
+
+def compact_collection(
+    client: QdrantClient,
+    collection_name: str,
+    max_exemplars: int = TEMPLATE_MAX_EXEMPLARS,
+    dry_run: bool = False,
+    id_field: str = "user_id"
+) -> dict:
+    """Compact every student of a collection; returns point counts before and after"""
+    students = defaultdict(list)
+    skipped = 0
+    offset = None
+    while True:
+        batch, offset = client.scroll(
+            collection_name=collection_name,
+            offset=offset,
+            limit=512,
+            with_payload=True,
+            with_vectors=True
+        )
+        for point in batch:
+            if point.payload and point.payload.get(id_field) is not None:
+                students[point.payload[id_field]].append(point)
+            else:
+                skipped += 1
+        if offset is None:
+            break
+
+    before = sum(len(points) for points in students.values())
+    after = 0
+    for user_id, points in students.items():
+        template = compact_template(points, max_exemplars)
+        latest = max(points, key=lambda p: p.payload.get("registered_at") or "")
+        payload = {k: v for k, v in latest.payload.items() if k not in _TEMPLATE_KEYS}
+        if dry_run:
+            after += 1 + len(template.exemplars)
+        else:
+            after += save_template(client, collection_name, user_id, template, payload, points, merged_sources(points))
+    return {"students": len(students), "points_before": before, "points_after": after, "skipped": skipped}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qdrant-url", default=QDRANT_URL)
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--max-exemplars", type=int, default=TEMPLATE_MAX_EXEMPLARS)
+    parser.add_argument("--dry-run", action="store_true", help="Report the new point count without writing")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = compact_collection(QdrantClient(args.qdrant_url), args.collection, args.max_exemplars, args.dry_run)
+    verb = "Would compact" if args.dry_run else "Compacted"
+    print(f"✅ {verb} {stats['students']} students: {stats['points_before']} -> {stats['points_after']} points "
+          f"in {time.perf_counter() - start:.1f}s")
+    if stats["skipped"]:
+        print(f"ℹ️  Skipped {stats['skipped']} points without a user id")
+
+
+if __name__ == "__main__":
+    main()
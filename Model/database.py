@@ -1,12 +1,18 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text
+from sqlalchemy import create_engine, event, insert, select, update as sql_update, bindparam, func, Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text, LargeBinary, Index
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn, CreateIndex
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from contextlib import contextmanager
 from datetime import datetime
 import os
 
+import metrics
+
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./attendance_system.db")
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
+metrics.instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -71,7 +77,7 @@ class AttendanceSession(Base):
     image_path = Column(String, nullable=True)
     total_students = Column(Integer, default=0)
     present_students = Column(Integer, default=0)
-    status = Column(String, default="pending")  # pending, processing, completed
+    status = Column(String, default="pending")  # pending, queued, detecting, embedding, matching, streaming, completed, error
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -80,6 +86,8 @@ class AttendanceSession(Base):
     subject = relationship("Subject", back_populates="attendance_sessions")
     teacher = relationship("User", back_populates="created_sessions", foreign_keys=[teacher_id])
     attendance_records = relationship("AttendanceRecord", back_populates="session")
+    images = relationship("SessionImage", back_populates="session")
+    evidence = relationship("AttendanceEvidence", back_populates="session")
 
 class AttendanceRecord(Base):
     __tablename__ = "attendance_records"
@@ -97,9 +105,154 @@ class AttendanceRecord(Base):
     session = relationship("AttendanceSession", back_populates="attendance_records")
     student = relationship("User", back_populates="attendance_records")
 
+    # One record per student and session, so records can be upserted
+    __table_args__ = (Index("uq_attendance_records_session_student", "session_id", "student_id", unique=True),)
+
+class SessionImage(Base):
+    __tablename__ = "session_images"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("attendance_sessions.id"), nullable=False, index=True)
+    sha256 = Column(String(64), nullable=False, index=True)
+    phash = Column(String(16), nullable=False)  # 64-bit difference hash, hex
+    image_path = Column(String, nullable=True)
+    face_count = Column(Integer, default=0)
+    embeddings = Column(LargeBinary, nullable=True)  # face_count x 512 float32
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    session = relationship("AttendanceSession", back_populates="images")
+
+class AttendanceEvidence(Base):
+    __tablename__ = "attendance_evidence"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("attendance_sessions.id"), nullable=False, index=True)
+    student_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    source = Column(String, nullable=False, default="photo", server_default="photo")  # photo, stream
+    best_score = Column(Float, nullable=False)
+    score_sum = Column(Float, default=0.0)
+    match_count = Column(Integer, default=0)  # photos (or streams) the student was matched in
+    track_id = Column(Integer, nullable=True)  # live-stream track of the student's latest stream match
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    session = relationship("AttendanceSession", back_populates="evidence")
+
+    # Photo evidence is rebuilt on re-scoring, stream evidence is kept: one row per source
+    __table_args__ = (
+        Index("uq_attendance_evidence_session_student_source", "session_id", "student_id", "source", unique=True),
+    )
+
+class MigrationRequired(RuntimeError):
+    """Raised by init_db when the database needs `python migrate_db.py` before the API can start"""
+
+# Tables whose rows are upserted on a unique key
+UPSERTED_TABLES = ("attendance_records", "attendance_evidence")
+
+def obsolete_unique_indexes(table, bind=None) -> list:
+    """Unique indexes the model no longer declares (their key changed); they would reject valid rows"""
+    declared = {index.name for index in table.indexes}
+    return [
+        index for index in inspect(bind if bind is not None else engine).get_indexes(table.name)
+        if index["name"].startswith("uq_") and index["name"] not in declared
+    ]
+
+def duplicate_keys(conn, table, keys: list) -> list:
+    """Values of `keys` shared by more than one row of `table`"""
+    key_columns = [table.c[name] for name in keys]
+    return conn.execute(select(*key_columns).group_by(*key_columns).having(func.count() > 1)).all()
+
 # Create all tables
 def init_db():
+    """Create missing tables, columns and unique indexes; never deletes rows or drops indexes.
+
+    Raises MigrationRequired, naming what blocks it, when a unique index
+    cannot be created over duplicate rows or an obsolete one is in place.
+    """
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist: add the columns and unique indexes added since
+    add_missing_columns()
+    problems = []
+    for name in UPSERTED_TABLES:
+        table = Base.metadata.tables[name]
+        for index in obsolete_unique_indexes(table):
+            problems.append(f"{table.name} still has the unique index {index['name']} on {', '.join(index['column_names'])}")
+        existing = {index["name"] for index in inspect(engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if not index.unique or index.name in existing:
+                continue
+            keys = [column.name for column in index.columns]
+            with engine.begin() as conn:
+                duplicates = duplicate_keys(conn, table, keys)
+                if not duplicates:
+                    # Replicas starting together may race to create it
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+            if duplicates:
+                problems.append(f"{len(duplicates)} keys ({', '.join(keys)}) of {table.name} repeat, blocking {index.name}")
+    if problems:
+        raise MigrationRequired(
+            "The database needs a one-off migration: " + "; ".join(problems)
+            + ". Stop the API and run `python migrate_db.py` (it saves the rows it removes)."
+        )
+
+def add_missing_columns():
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+
+def upsert(db, model, rows: list, keys: tuple, update: tuple, where=None) -> None:
+    """Write `rows` (dicts with the same keys) in one executemany INSERT; rows whose
+    `keys` already exist get their `update` columns set instead, if `where` holds.
+
+    Needs a unique index on `keys`. Dialects without ON CONFLICT look the
+    keys up first, then run one executemany UPDATE and one INSERT.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        _update_or_insert(db, table, rows, keys, update, where)
+        return
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={column: stmt.excluded[column] for column in update},
+        where=where
+    )
+    db.execute(stmt, rows)
+
+def _update_or_insert(db, table, rows: list, keys: tuple, update: tuple, where=None) -> None:
+    """upsert() for dialects without ON CONFLICT; concurrent inserts of a key still fail on the index"""
+    key_columns = [table.c[name] for name in keys]
+    # Narrow by the first key in SQL (e.g. one session), match whole keys here
+    found = db.execute(
+        select(*key_columns).where(key_columns[0].in_({row[keys[0]] for row in rows}))
+    ).all()
+    existing = {tuple(key) for key in found}
+    updates = [row for row in rows if tuple(row[name] for name in keys) in existing]
+    inserts = [row for row in rows if tuple(row[name] for name in keys) not in existing]
+    if updates:
+        stmt = sql_update(table).where(*(column == bindparam(f"key_{column.name}") for column in key_columns))
+        if where is not None:
+            stmt = stmt.where(where)
+        stmt = stmt.values({name: bindparam(f"new_{name}") for name in update})
+        db.execute(stmt, [
+            {**{f"key_{name}": row[name] for name in keys}, **{f"new_{name}": row[name] for name in update}}
+            for row in updates
+        ])
+    if inserts:
+        db.execute(insert(table), inserts)
 
 # Dependency to get DB session
 def get_db():
@@ -109,3 +262,36 @@ def get_db():
     finally:
         db.close()
 
+# Query counting, to catch N+1 regressions in tests
+class QueryCounter:
+    """SQL statements executed while counting"""
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def selects(self) -> list:
+        return [s for s in self.statements if s.lstrip().upper().startswith("SELECT")]
+
+@contextmanager
+def count_queries(bind=None):
+    """Record every SQL statement run on `bind` (default: the app's engine) inside the block:
+
+        with count_queries() as queries:
+            ...
+        assert queries.count <= 5, queries.statements
+    """
+    bind = bind if bind is not None else engine
+    counter = QueryCounter()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", record)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute", record)
@@ -0,0 +1,181 @@
+"""
+Dynamic micro-batching of embedding requests.
+
+Concurrent uploads each hand their face crops to one background thread that
+waits a short window for other requests, then runs a single forward pass
+over everything collected and routes each slice of the result back to the
+future of the request it came from. Up to `max_in_flight` batches run at
+once, one per inference worker process, so batching never serializes a pool.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, List
+
+import numpy as np
+
+import metrics
+from face_inference import EMBED_MAX_BATCH_SIZE, EMBEDDING_SIZE
+
+# 0 disables micro-batching and embeds each request on its own
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "10"))
+# Number of recent batches kept for the batch-size / queueing-delay metrics
+_METRIC_SAMPLES = 1024
+
+
+class _PendingRequest:
+    __slots__ = ("faces", "future", "enqueued_at")
+
+    def __init__(self, faces: np.ndarray):
+        self.faces = faces
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatchEmbedder:
+    """Coalesces `embed` calls from concurrent requests into shared forward passes.
+
+    A batch is dispatched when `window_ms` has passed since its oldest request
+    arrived or when it holds at least `max_batch_size` faces, whichever comes
+    first, and a slot is free: while all `max_in_flight` batches are running,
+    requests keep collecting into the next one. Detection calls are passed
+    straight through to the wrapped backend.
+    """
+
+    def __init__(
+        self,
+        backend,
+        window_ms: float = EMBED_BATCH_WINDOW_MS,
+        max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+        max_in_flight: int = 1
+    ):
+        self.backend = backend
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self._slots = threading.Semaphore(max_in_flight)
+        self._runner = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embedding-batch")
+        self._pending: Deque[_PendingRequest] = deque()
+        self._pending_faces = 0
+        self._cond = threading.Condition()
+        self._batch_sizes: Deque[int] = deque(maxlen=_METRIC_SAMPLES)
+        self._queue_delays_ms: Deque[float] = deque(maxlen=_METRIC_SAMPLES)
+        self._batches = 0
+        self._faces = 0
+        self._thread = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def detect(self, img_bytes: bytes, crowd: bool = True):
+        return self.backend.detect(img_bytes, crowd)
+
+    def detect_faces(self, img_bytes: bytes, crowd: bool = True):
+        return self.backend.detect_faces(img_bytes, crowd)
+
+    def detect_boxes(self, img_bytes: bytes, crowd: bool = True):
+        return self.backend.detect_boxes(img_bytes, crowd)
+
+    def submit(self, faces) -> Future:
+        """Queue face crops (Nx3x160x160) and return a future of their N x 512 embeddings"""
+        faces = np.asarray(faces, dtype=np.float32)
+        if faces.ndim == 3:
+            faces = faces[None]
+
+        request = _PendingRequest(faces)
+        if not len(faces):
+            request.future.set_result(np.empty((0, EMBEDDING_SIZE), dtype=np.float32))
+            return request.future
+
+        with self._cond:
+            self._pending.append(request)
+            self._pending_faces += len(faces)
+            self._cond.notify()
+        return request.future
+
+    def embed(self, faces) -> np.ndarray:
+        return self.submit(faces).result()
+
+    def _next_batch(self) -> List[_PendingRequest]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            deadline = self._pending[0].enqueued_at + self.window
+            while self._pending_faces < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # A single oversized request still goes out whole; the backend chunks it
+            batch = [self._pending.popleft()]
+            size = len(batch[0].faces)
+            while self._pending and size + len(self._pending[0].faces) <= self.max_batch_size:
+                request = self._pending.popleft()
+                batch.append(request)
+                size += len(request.faces)
+            self._pending_faces -= size
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            self._slots.acquire()
+            self._runner.submit(self._run_batch, self._next_batch())
+
+    def _run_batch(self, batch: List[_PendingRequest]) -> None:
+        try:
+            self._embed_batch(batch)
+        finally:
+            self._slots.release()
+
+    def _embed_batch(self, batch: List[_PendingRequest]) -> None:
+        started = time.perf_counter()
+        try:
+            faces = np.concatenate([r.faces for r in batch]) if len(batch) > 1 else batch[0].faces
+            embeddings = self.backend.embed(faces)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        offset = 0
+        for request in batch:
+            n = len(request.faces)
+            request.future.set_result(embeddings[offset:offset + n])
+            offset += n
+
+        metrics.EMBED_BATCH_SIZE.observe(offset, "micro_batch")
+        with self._cond:
+            self._batches += 1
+            self._faces += offset
+            self._batch_sizes.append(offset)
+            self._queue_delays_ms.extend((started - r.enqueued_at) * 1000 for r in batch)
+
+    def stats(self) -> dict:
+        """Batch-size and queueing-delay figures over the most recent batches"""
+        with self._cond:
+            sizes = np.asarray(self._batch_sizes, dtype=np.float64)
+            delays = np.asarray(self._queue_delays_ms, dtype=np.float64)
+            stats = {
+                "window_ms": self.window * 1000,
+                "max_batch_size": self.max_batch_size,
+                "max_in_flight": self.max_in_flight,
+                "batches": self._batches,
+                "faces": self._faces,
+                "queued_requests": len(self._pending),
+            }
+        if len(sizes):
+            stats["batch_size"] = {
+                "mean": round(float(sizes.mean()), 2),
+                "p50": float(np.percentile(sizes, 50)),
+                "p95": float(np.percentile(sizes, 95)),
+                "max": int(sizes.max()),
+            }
+        if len(delays):
+            stats["queue_delay_ms"] = {
+                "mean": round(float(delays.mean()), 3),
+                "p50": round(float(np.percentile(delays, 50)), 3),
+                "p95": round(float(np.percentile(delays, 95)), 3),
+            }
+        return stats
@@ -0,0 +1,80 @@
+"""
+Export MTCNN (P-Net, R-Net, O-Net) and InceptionResnetV1 to ONNX.
+
+Writes the graphs the ONNX Runtime backend loads (INFERENCE_RUNTIME=onnx).
+P-Net takes images of any size, the other networks any batch size. Run it
+offline wherever torch is installed; the inference workers then only need
+onnxruntime.
+
+Usage: python export_onnx.py [--output onnx_models/] [--pretrained vggface2]
+"""
+import argparse
+import os
+from typing import Optional
+
+import torch
+from facenet_pytorch import MTCNN, InceptionResnetV1
+
+from model_registry import FACENET_PRETRAINED
+from onnx_backend import ONNX_MODEL_DIR, ONNX_MODEL_FILES
+
+ONNX_OPSET = 17
+
+
+def _export(model: torch.nn.Module, sample: torch.Tensor, path: str, output_names, dynamic_axes, opset: int) -> None:
+    torch.onnx.export(
+        model.eval(),
+        (sample,),
+        path,
+        input_names=["input"],
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+        dynamo=False
+    )
+    print(f"✅ Exported {os.path.basename(path)} ({os.path.getsize(path) / (1024 * 1024):.2f} MB)")
+
+
+def export_models(
+    output_dir: str,
+    pretrained=FACENET_PRETRAINED,
+    opset: int = ONNX_OPSET,
+    mtcnn: Optional[MTCNN] = None,
+    resnet: Optional[InceptionResnetV1] = None
+) -> None:
+    """Write pnet/rnet/onet/resnet .onnx files into output_dir.
+
+    Already-loaded `mtcnn` / `resnet` instances are exported as they are;
+    otherwise fresh ones are built with the given weights.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    path = lambda name: os.path.join(output_dir, ONNX_MODEL_FILES[name])
+    batch = {0: "batch"}
+
+    mtcnn = mtcnn or MTCNN()
+    resnet = resnet or InceptionResnetV1(pretrained=pretrained)
+    with torch.no_grad():
+        _export(mtcnn.pnet, torch.zeros(1, 3, 120, 160), path("pnet"), ["reg", "prob"],
+                {"input": {0: "batch", 2: "height", 3: "width"},
+                 "reg": {0: "batch", 2: "map_height", 3: "map_width"},
+                 "prob": {0: "batch", 2: "map_height", 3: "map_width"}}, opset)
+        _export(mtcnn.rnet, torch.zeros(2, 3, 24, 24), path("rnet"), ["reg", "prob"],
+                {"input": batch, "reg": batch, "prob": batch}, opset)
+        _export(mtcnn.onet, torch.zeros(2, 3, 48, 48), path("onet"), ["reg", "landmarks", "prob"],
+                {"input": batch, "reg": batch, "landmarks": batch, "prob": batch}, opset)
+        _export(resnet, torch.zeros(2, 3, 160, 160), path("resnet"), ["embedding"],
+                {"input": batch, "embedding": batch}, opset)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=ONNX_MODEL_DIR, help="Directory for the .onnx files")
+    parser.add_argument("--pretrained", default=FACENET_PRETRAINED or "",
+                        help="FaceNet weights: vggface2 or casia-webface; empty for untrained")
+    parser.add_argument("--opset", type=int, default=ONNX_OPSET)
+    args = parser.parse_args()
+    export_models(args.output, args.pretrained or None, args.opset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+One-to-one assignment of detected faces to students.
+
+Given the faces x students similarity matrix of a photo, every student is
+given to at most one face and every face to at most one student, keeping
+only pairs at or above the match threshold.
+"""
+import functools
+import os
+from typing import List, NamedTuple
+
+import numpy as np
+
+ASSIGNMENT_POLICY = os.getenv("ASSIGNMENT_POLICY", "hungarian")
+
+
+class Assignment(NamedTuple):
+    face_index: int
+    column: int
+    score: float
+
+
+@functools.lru_cache(maxsize=None)
+def hungarian_solver():
+    """scipy's linear_sum_assignment, imported on first use since scipy is slow to import"""
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:  # scipy is optional, greedy matching needs only numpy
+        return None
+    return linear_sum_assignment
+
+
+def _candidates(similarity: np.ndarray, threshold: float):
+    """Restrict the problem to faces and students with at least one valid pair"""
+    valid = similarity >= threshold
+    rows = np.flatnonzero(valid.any(axis=1))
+    cols = np.flatnonzero(valid.any(axis=0))
+    return rows, cols, similarity[np.ix_(rows, cols)], valid[np.ix_(rows, cols)]
+
+
+def assign_hungarian(similarity: np.ndarray, threshold: float) -> List[Assignment]:
+    """Maximum total similarity matching over pairs above the threshold"""
+    rows, cols, sub, valid = _candidates(similarity, threshold)
+    if not len(rows):
+        return []
+
+    # Pairs below the threshold get zero weight so they never displace a valid one
+    weights = np.where(valid, sub, 0.0)
+    r, c = hungarian_solver()(weights, maximize=True)
+    keep = valid[r, c]
+    return [
+        Assignment(int(rows[i]), int(cols[j]), float(sub[i, j]))
+        for i, j in zip(r[keep], c[keep])
+    ]
+
+
+def assign_greedy(similarity: np.ndarray, threshold: float) -> List[Assignment]:
+    """Repeatedly take the highest remaining pair above the threshold"""
+    rows, cols, sub, valid = _candidates(similarity, threshold)
+    if not len(rows):
+        return []
+
+    flat = np.flatnonzero(valid)
+    order = flat[np.argsort(-sub.ravel()[flat], kind="stable")]
+    face_used = np.zeros(len(rows), dtype=bool)
+    student_used = np.zeros(len(cols), dtype=bool)
+
+    assignments = []
+    limit = min(len(rows), len(cols))
+    for i, j in zip(*np.unravel_index(order, sub.shape)):
+        if face_used[i] or student_used[j]:
+            continue
+        face_used[i] = student_used[j] = True
+        assignments.append(Assignment(int(rows[i]), int(cols[j]), float(sub[i, j])))
+        if len(assignments) == limit:
+            break
+    return assignments
+
+
+def assign_faces(similarity: np.ndarray, threshold: float, policy: str = ASSIGNMENT_POLICY) -> List[Assignment]:
+    """Assign faces to students one-to-one, ordered by face index"""
+    if similarity.size == 0:
+        return []
+    if policy == "hungarian" and hungarian_solver() is not None:
+        assignments = assign_hungarian(similarity, threshold)
+    elif policy in ("hungarian", "greedy"):
+        assignments = assign_greedy(similarity, threshold)
+    else:
+        raise ValueError(f"Unknown assignment policy '{policy}'")
+    return sorted(assignments, key=lambda a: a.face_index)
@@ -0,0 +1,123 @@
+"""
+Batched FaceNet embedding engine.
+
+All face crops from a photo are stacked and pushed through InceptionResnetV1
+in as few forward passes as possible instead of one pass per face. The
+network itself can run eager in fp32, as a frozen TorchScript graph, or
+int8-quantized (dynamic: linear layers only; static: whole network,
+calibrated on sample face crops).
+"""
+import os
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+import torch
+from PIL import Image
+
+from face_inference import EMBED_MAX_BATCH_SIZE, EMBEDDING_SIZE
+
+EMBEDDING_BACKENDS = ("eager", "torchscript", "int8-dynamic", "int8-static")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "eager")
+# Directory of face crops used to calibrate the int8-static backend
+EMBED_CALIBRATION_DIR = os.getenv("EMBED_CALIBRATION_DIR", "")
+EMBED_CALIBRATION_SAMPLES = int(os.getenv("EMBED_CALIBRATION_SAMPLES", "256"))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+FaceBatch = Union[torch.Tensor, np.ndarray, Sequence[torch.Tensor]]
+
+
+class EmbeddingEngine:
+    """Embeds face crops with a FaceNet model in bounded-size batches"""
+
+    def __init__(self, model: torch.nn.Module, max_batch_size: int = EMBED_MAX_BATCH_SIZE):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.model = model
+        self.max_batch_size = max_batch_size
+
+    @staticmethod
+    def _as_batch(faces: FaceBatch) -> torch.Tensor:
+        if isinstance(faces, np.ndarray):
+            faces = torch.from_numpy(np.ascontiguousarray(faces, dtype=np.float32))
+        if isinstance(faces, torch.Tensor):
+            # A single 3x160x160 crop is treated as a batch of one
+            return faces.unsqueeze(0) if faces.dim() == 3 else faces
+        faces = list(faces)
+        if not faces:
+            return torch.empty((0, 3, 160, 160))
+        return torch.stack(faces)
+
+    def embed(self, faces: FaceBatch) -> np.ndarray:
+        """Embed N face crops (Nx3x160x160) and return an N x 512 float32 array"""
+        batch = self._as_batch(faces)
+        n = batch.shape[0]
+        embeddings = np.empty((n, EMBEDDING_SIZE), dtype=np.float32)
+
+        with torch.no_grad():
+            for start in range(0, n, self.max_batch_size):
+                chunk = batch[start:start + self.max_batch_size]
+                embeddings[start:start + chunk.shape[0]] = self.model(chunk).cpu().numpy()
+
+        return embeddings
+
+    def embed_one(self, face: torch.Tensor) -> np.ndarray:
+        """Embed a single 3x160x160 crop and return a 512-d vector"""
+        return self.embed(face)[0]
+
+
+def load_face_crops(directory: str, limit: Optional[int] = None) -> List[torch.Tensor]:
+    """Load aligned face images from a directory tree as standardized 3x160x160 tensors"""
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(directory)
+        for name in files
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    crops = []
+    for path in paths[:limit]:
+        img = Image.open(path).convert("RGB").resize((160, 160), Image.BILINEAR)
+        pixels = torch.from_numpy(np.asarray(img, dtype=np.float32)).permute(2, 0, 1)
+        # Same standardization MTCNN applies to the crops it returns
+        crops.append((pixels - 127.5) / 128.0)
+    return crops
+
+
+def build_embedding_model(
+    model: torch.nn.Module,
+    backend: str = EMBED_BACKEND,
+    calibration: Optional[torch.Tensor] = None
+) -> torch.nn.Module:
+    """Convert an eval-mode InceptionResnetV1 into the requested inference backend"""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+    model = model.eval()
+    example = torch.zeros(1, 3, 160, 160)
+
+    if backend == "eager":
+        return model
+
+    if backend == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    if backend == "int8-dynamic":
+        from torch.ao.quantization import quantize_dynamic
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    # int8-static: observe activation ranges on real crops, then convert every layer
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    if calibration is None and EMBED_CALIBRATION_DIR:
+        crops = load_face_crops(EMBED_CALIBRATION_DIR, EMBED_CALIBRATION_SAMPLES)
+        calibration = torch.stack(crops) if crops else None
+    if calibration is None or not len(calibration):
+        raise ValueError("The int8-static backend needs calibration crops (set EMBED_CALIBRATION_DIR)")
+
+    engine = torch.backends.quantized.engine
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), (example,))
+    with torch.no_grad():
+        for start in range(0, len(calibration), EMBED_MAX_BATCH_SIZE):
+            prepared(calibration[start:start + EMBED_MAX_BATCH_SIZE])
+    return convert_fx(prepared)
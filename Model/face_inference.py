@@ -0,0 +1,211 @@
+"""
+Common entry point for the face inference backends.
+
+Every backend offers the same calls, so the attendance pipeline, the
+inference workers and the API handlers never touch a model directly:
+
+* `detect(img_bytes, crowd=True)` -> (Nx4 boxes, Nx3x160x160 crops, probabilities,
+  Nx5x2 landmarks), all None without faces
+* `detect_faces(img_bytes, crowd=True)` -> (crops or None, probabilities)
+* `embed(faces)` -> N x 512 float32 embeddings
+* `detect_boxes(img_bytes, crowd=True)` -> (Nx4 boxes or None, probabilities),
+  for callers that crop faces themselves with `crop_faces`
+
+The inference service client can also detect and embed in one round trip;
+callers use `detect_and_embed` to take advantage of that. It also drops
+faces below MIN_FACE_QUALITY (see face_quality) before they are embedded.
+
+INFERENCE_RUNTIME picks the implementation: "torch" runs facenet-pytorch
+through the model registry, "onnx" runs exported graphs on ONNX Runtime and
+never imports torch. This module itself stays torch-free.
+"""
+import io
+import os
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+
+import metrics
+from face_quality import FACE_MIN_SIDE, MIN_FACE_QUALITY, face_quality
+
+EMBEDDING_SIZE = 512
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "64"))
+
+INFERENCE_RUNTIMES = ("torch", "onnx")
+INFERENCE_RUNTIME = os.getenv("INFERENCE_RUNTIME", "torch")
+# Longest side huge JPEGs are decoded at: the 1/2, 1/4 or 1/8 scale (draft mode)
+# that comes nearest to it instead of full size; 0 always decodes at full size
+DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", "4096"))
+# "tiled" splits large crowd photos into a coarse pass plus full-resolution tiles,
+# "single" runs one MTCNN pass over the whole frame
+DETECTION_MODE = os.getenv("DETECTION_MODE", "tiled")
+# Identifies the models behind cached detections and embeddings. Derived from the
+# local model settings and the quality bar by default; set it explicitly (and
+# bump it when weights change) when inference runs on a separate service.
+MODEL_VERSION = os.getenv("MODEL_VERSION", "") or ":".join([
+    INFERENCE_RUNTIME,
+    DETECTION_MODE,
+    os.getenv("FACENET_PRETRAINED", "vggface2") or "untrained",
+    os.getenv("EMBED_BACKEND", "eager"),
+    f"q{MIN_FACE_QUALITY:g}s{FACE_MIN_SIDE:g}",
+])
+
+
+class FaceDetections(NamedTuple):
+    """The faces found in one image, largest first"""
+    boxes: np.ndarray  # N x 4 (x1, y1, x2, y2) in image pixels
+    probs: np.ndarray  # N detection probabilities
+    embeddings: np.ndarray  # N x 512
+    quality: np.ndarray  # N face quality scores in [0, 1]
+
+
+def decode_image(img_bytes: bytes, max_side: int = DECODE_MAX_SIDE):
+    """Decode an image to RGB once; returns it with its scale relative to the encoded size.
+
+    Huge JPEGs are decoded at a reduced size straight from the DCT
+    coefficients (draft mode), which saves most of the decode time and
+    memory; other formats always decode at full size. A 48 MP photo
+    (8000 px) comes out at 4000 px for the default max_side.
+    """
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(img_bytes))
+    width, height = img.size
+    scale = 1.0
+    reduce = 1
+    # Halve while the result stays nearer to max_side than the previous size
+    while max_side and reduce < 8 and max(width, height) / (2 * reduce) >= max_side / 2 ** 0.5:
+        reduce *= 2
+    if reduce > 1:
+        img.draft("RGB", (width // reduce, height // reduce))
+        scale = img.width / width
+    if img.mode != "RGB":
+        img = img.convert("RGB")  # decodes
+    else:
+        img.load()
+    return img, scale
+
+
+@lru_cache(maxsize=512)
+def _bilinear_weights(length: int, size: int) -> np.ndarray:
+    """size x length matrix of PIL's bilinear filter resampling `length` pixels to `size`"""
+    step = length / size
+    centers = (np.arange(size) + 0.5) * step
+    weights = np.clip(1.0 - np.abs(np.arange(length) + 0.5 - centers[:, None]) / max(step, 1.0), 0.0, None)
+    return (weights / weights.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def crop_faces(img, boxes, image_size: int = 160, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Standardized Nx3xSxS crops of the boxes in a PIL image, as MTCNN.extract makes them.
+
+    Each face is resampled once, straight into its slot of the batch (`out`
+    when given), and the whole batch is standardized in place. Faces no
+    larger than S, nearly all of a crowd, are upsampled by two small matrix
+    products; they match MTCNN.extract to within one grey level, as it
+    rounds between its two passes. Bigger faces go through PIL's resize.
+    """
+    from PIL import Image
+
+    if out is None:
+        out = np.empty((len(boxes), 3, image_size, image_size), dtype=np.float32)
+    for i, box in enumerate(boxes):
+        box = (
+            int(max(box[0], 0)),
+            int(max(box[1], 0)),
+            int(min(box[2], img.width)),
+            int(min(box[3], img.height)),
+        )
+        # Crop first: resize(box=...) also samples just outside the box
+        face = img.crop(box)
+        if face.width <= image_size and face.height <= image_size:
+            pixels = np.asarray(face, dtype=np.float32).transpose(2, 0, 1)
+            rows = _bilinear_weights(face.height, image_size)
+            columns = _bilinear_weights(face.width, image_size)
+            np.matmul(rows, pixels @ columns.T, out=out[i])
+        else:
+            out[i] = np.asarray(face.resize((image_size, image_size), Image.BILINEAR)).transpose(2, 0, 1)
+    out -= np.float32(127.5)
+    out /= np.float32(128.0)
+    return out
+
+
+def create_inference(runtime: str = INFERENCE_RUNTIME, threads: Optional[int] = None):
+    """Load every model of the given runtime in this process and return the backend"""
+    if runtime == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        from model_registry import registry
+        inference = registry
+    elif runtime == "onnx":
+        from onnx_backend import OnnxInference
+        inference = OnnxInference(threads=threads)
+    else:
+        raise ValueError(f"Unknown inference runtime '{runtime}', expected one of {INFERENCE_RUNTIMES}")
+    inference.load_all()
+    return inference
+
+
+def build_inference():
+    """Detection/embedding backend of a serving process: models loaded here or on
+    INFERENCE_WORKERS worker processes, behind the embedding micro-batcher when enabled.
+
+    In front of the pool the batcher keeps one batch in flight per worker;
+    in-process models already use every core for one batch.
+    """
+    from embedding_batcher import MicroBatchEmbedder, EMBED_BATCH_WINDOW_MS
+    from inference_pool import InferencePool, INFERENCE_WORKERS
+
+    if INFERENCE_WORKERS > 0:
+        inference = InferencePool()
+        inference.warm_up()
+    else:
+        inference = create_inference()
+
+    # Coalesce embedding work from concurrent requests into shared forward passes
+    if EMBED_BATCH_WINDOW_MS > 0:
+        inference = MicroBatchEmbedder(inference, max_in_flight=max(1, INFERENCE_WORKERS))
+    return inference
+
+
+def detect_and_embed(
+    inference,
+    img_bytes: bytes,
+    crowd: bool = True,
+    on_embed: Optional[Callable[[], None]] = None,
+    min_quality: float = MIN_FACE_QUALITY
+) -> Optional[FaceDetections]:
+    """Boxes, detection probabilities, embeddings and quality of the faces in an image.
+
+    Faces below `min_quality` are not embedded; None when no face is left.
+    Backends that do both in one call (the inference service client) are
+    used that way, so face crops never leave the inference node; otherwise
+    detection and embedding run back to back with `on_embed` called between.
+    """
+    endpoint = metrics.current_endpoint()
+    if hasattr(inference, "detect_and_embed"):
+        with metrics.STAGE_SECONDS.time(endpoint, "detect_embed"):
+            detections = inference.detect_and_embed(img_bytes, crowd, min_quality)
+        metrics.FACES_PER_IMAGE.observe(0 if detections is None else len(detections.embeddings), endpoint)
+        return detections
+    with metrics.STAGE_SECONDS.time(endpoint, "detect"):
+        boxes, faces, probs, landmarks = inference.detect(img_bytes, crowd)
+    metrics.FACES_PER_IMAGE.observe(0 if boxes is None else len(boxes), endpoint)
+    if boxes is None:
+        return None
+    with metrics.STAGE_SECONDS.time(endpoint, "quality"):
+        quality = face_quality(boxes, probs, faces, landmarks)
+    keep = np.flatnonzero(quality >= min_quality)
+    if len(keep) < len(quality):
+        metrics.FACES_REJECTED.inc(endpoint, amount=len(quality) - len(keep))
+    if not len(keep):
+        return None
+    if len(keep) < len(quality):
+        boxes, faces, probs, quality = boxes[keep], faces[keep], probs[keep], quality[keep]
+    if on_embed:
+        on_embed()
+    metrics.EMBED_BATCH_SIZE.observe(len(faces), "request")
+    with metrics.STAGE_SECONDS.time(endpoint, "embed"):
+        embeddings = inference.embed(faces)
+    return FaceDetections(boxes, probs, embeddings, quality)
@@ -0,0 +1,303 @@
+"""
+Face matchers: map a batch of face embeddings to registered students.
+"""
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+from face_templates import TEMPLATE_MAX_EXEMPLARS, read_version
+
+
+class FaceMatch(NamedTuple):
+    student_id: Any
+    score: float
+    payload: Dict[str, Any]
+
+
+class SimilarityMatrix(NamedTuple):
+    """Faces x students scores plus the student behind each column"""
+    scores: np.ndarray
+    student_ids: List[Any]
+    payloads: List[Dict[str, Any]]
+
+
+def _student_filter(id_field: str, student_ids: Iterable[Any]) -> models.Filter:
+    return models.Filter(must=[
+        models.FieldCondition(key=id_field, match=models.MatchAny(any=sorted(student_ids)))
+    ])
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Column indices of the `top_k` best scores of every row, best first"""
+    top_k = min(top_k, scores.shape[1])
+    if top_k < scores.shape[1]:
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class QdrantMatcher:
+    """Matches all faces of a photo with a single batched Qdrant query.
+
+    A student has up to `points_per_student` points (face_templates: the
+    centroid plus exemplars), so every search asks for that many hits per
+    wanted student and keeps each student's best one.
+    """
+
+    def __init__(
+        self,
+        client: QdrantClient,
+        collection_name: str,
+        id_field: Optional[str] = "user_id",
+        points_per_student: int = 1 + TEMPLATE_MAX_EXEMPLARS
+    ):
+        self.client = client
+        self.collection_name = collection_name
+        self.id_field = id_field
+        # Without an id field every point is its own student
+        self.points_per_student = points_per_student if id_field else 1
+
+    def search(
+        self,
+        embeddings: np.ndarray,
+        top_k: int = 1,
+        enrolled_ids: Optional[Iterable[Any]] = None,
+        subject_id: Any = None
+    ) -> List[List[FaceMatch]]:
+        """Return up to `top_k` matches per face, best first, in one round-trip.
+
+        When `enrolled_ids` is given the search is restricted to those students.
+        """
+        if len(embeddings) == 0:
+            return []
+
+        query_filter = None
+        if enrolled_ids is not None:
+            query_filter = _student_filter(self.id_field, enrolled_ids)
+
+        requests = [
+            models.QueryRequest(query=embedding.tolist(), filter=query_filter, limit=top_k, with_payload=True)
+            for embedding in embeddings
+        ]
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=requests
+        )
+
+        results = []
+        for response in responses:
+            face_matches = []
+            for point in response.points:
+                payload = point.payload or {}
+                student_id = payload.get(self.id_field) if self.id_field else point.id
+                face_matches.append(FaceMatch(student_id, float(point.score), payload))
+            results.append(face_matches)
+        return results
+
+    def similarity(
+        self,
+        embeddings: np.ndarray,
+        enrolled_ids: Optional[Iterable[Any]] = None,
+        subject_id: Any = None,
+        top_k: int = 5
+    ) -> SimilarityMatrix:
+        """Sparse faces x students matrix built from each face's `top_k` best students.
+
+        The runner-up students matter to the one-to-one assignment, so the
+        search covers every point of `top_k` students, even if the best
+        hits all belong to one. Pairs Qdrant did not return score -1,
+        below any usable threshold.
+        """
+        matches = self.search(
+            embeddings,
+            top_k=top_k * self.points_per_student,
+            enrolled_ids=enrolled_ids,
+            subject_id=subject_id
+        )
+        columns: Dict[Any, int] = {}
+        payloads = []
+        for face_matches in matches:
+            for match in face_matches:
+                if match.student_id not in columns:
+                    columns[match.student_id] = len(columns)
+                    payloads.append(match.payload)
+
+        scores = np.full((len(embeddings), len(columns)), -1.0, dtype=np.float32)
+        for row, face_matches in enumerate(matches):
+            for match in face_matches:
+                col = columns[match.student_id]
+                scores[row, col] = max(scores[row, col], match.score)
+        return SimilarityMatrix(scores, list(columns), payloads)
+
+
+class EnrolledIndex:
+    """Embeddings of one subject's enrolled students as a contiguous float32 matrix.
+
+    Rows are grouped by student so per-student scores are the max over that
+    student's registered faces.
+    """
+
+    def __init__(self, enrolled_ids: frozenset, points: list, id_field: str):
+        self.enrolled_ids = enrolled_ids
+        points = sorted(points, key=lambda p: p.payload[id_field])
+
+        self.student_ids: List[Any] = []
+        self.payloads: List[Dict[str, Any]] = []
+        offsets = []
+        for row, point in enumerate(points):
+            student_id = point.payload[id_field]
+            if not self.student_ids or self.student_ids[-1] != student_id:
+                self.student_ids.append(student_id)
+                self.payloads.append(point.payload)
+                offsets.append(row)
+
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        if points:
+            self.vectors = _normalize(np.asarray([p.vector for p in points]))
+        else:
+            self.vectors = np.empty((0, 0), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.student_ids)
+
+    def similarity(self, embeddings: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every face to every enrolled student (faces x students)"""
+        if not len(self) or len(embeddings) == 0:
+            return np.zeros((len(embeddings), len(self)), dtype=np.float32)
+        scores = _normalize(embeddings) @ self.vectors.T
+        return np.maximum.reduceat(scores, self.offsets, axis=1)
+
+
+class EnrolledMatcher:
+    """Matches faces in-process against only the students enrolled in a subject.
+
+    The enrolled students' embeddings are fetched once per subject and cached.
+    The cache entry is rebuilt when the enrolled set changes or when it is
+    invalidated after an enrollment or face registration. Loads run outside
+    the lock; each subject has a generation, bumped on invalidation, and a
+    load is only cached if its subject's generation did not move meanwhile.
+
+    Invalidation only reaches this process. With `track_version`, every
+    lookup also reads the collection's version token (see face_templates),
+    one small Qdrant read, and drops the whole cache when another process
+    (a replica, bulk_import, compact_templates) has written templates since.
+    """
+
+    def __init__(
+        self, client: QdrantClient, collection_name: str, id_field: str = "user_id", track_version: bool = False
+    ):
+        self.client = client
+        self.collection_name = collection_name
+        self.id_field = id_field
+        self.track_version = track_version
+        self._version: Optional[str] = None
+        self._cache: Dict[Any, EnrolledIndex] = {}
+        self._generations: Dict[Any, int] = {}
+        self._loading: Dict[Any, List[frozenset]] = {}  # enrolled ids of the loads in flight
+        self._lock = threading.Lock()
+
+    def _load(self, enrolled_ids: frozenset) -> EnrolledIndex:
+        points = []
+        if enrolled_ids:
+            scroll_filter = _student_filter(self.id_field, enrolled_ids)
+            offset = None
+            while True:
+                batch, offset = self.client.scroll(
+                    collection_name=self.collection_name,
+                    scroll_filter=scroll_filter,
+                    offset=offset,
+                    limit=256,
+                    with_payload=True,
+                    with_vectors=True
+                )
+                points.extend(batch)
+                if offset is None:
+                    break
+        return EnrolledIndex(enrolled_ids, points, self.id_field)
+
+    def index_for(self, subject_id: Any, enrolled_ids: Iterable[Any]) -> EnrolledIndex:
+        enrolled_ids = frozenset(enrolled_ids)
+        version = read_version(self.client, self.collection_name) if self.track_version else None
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                for cached in {*self._cache, *self._loading}:
+                    self._invalidate(cached)
+            index = self._cache.get(subject_id)
+            if index is not None and index.enrolled_ids == enrolled_ids:
+                return index
+            generation = self._generations.get(subject_id, 0)
+            self._loading.setdefault(subject_id, []).append(enrolled_ids)
+        try:
+            index = self._load(enrolled_ids)
+        finally:
+            with self._lock:
+                loading = self._loading[subject_id]
+                loading.remove(enrolled_ids)
+                if not loading:
+                    del self._loading[subject_id]
+        with self._lock:
+            # Invalidated while loading: serve this request, but let the next one reload
+            if self._generations.get(subject_id, 0) == generation:
+                self._cache[subject_id] = index
+        return index
+
+    def _invalidate(self, subject_id: Any) -> None:
+        self._generations[subject_id] = self._generations.get(subject_id, 0) + 1
+        self._cache.pop(subject_id, None)
+
+    def invalidate_subject(self, subject_id: Any) -> None:
+        with self._lock:
+            self._invalidate(subject_id)
+
+    def invalidate_student(self, student_id: Any) -> None:
+        """Drop every subject the student is enrolled in, cached or being loaded"""
+        with self._lock:
+            subjects = {k for k, v in self._cache.items() if student_id in v.enrolled_ids}
+            subjects.update(k for k, loads in self._loading.items() if any(student_id in ids for ids in loads))
+            for subject_id in subjects:
+                self._invalidate(subject_id)
+
+    def similarity(
+        self,
+        embeddings: np.ndarray,
+        enrolled_ids: Optional[Iterable[Any]] = None,
+        subject_id: Any = None
+    ) -> SimilarityMatrix:
+        """Dense faces x enrolled students cosine similarity matrix"""
+        if enrolled_ids is None:
+            raise ValueError("EnrolledMatcher needs the enrolled student ids")
+        index = self.index_for(subject_id, enrolled_ids)
+        return SimilarityMatrix(index.similarity(embeddings), index.student_ids, index.payloads)
+
+    def search(
+        self,
+        embeddings: np.ndarray,
+        top_k: int = 1,
+        enrolled_ids: Optional[Iterable[Any]] = None,
+        subject_id: Any = None
+    ) -> List[List[FaceMatch]]:
+        """Return up to `top_k` enrolled students per face, best first"""
+        if len(embeddings) == 0:
+            return []
+
+        scores, student_ids, payloads = self.similarity(embeddings, enrolled_ids, subject_id)
+        if not student_ids:
+            return [[] for _ in range(len(embeddings))]
+
+        best = _top_k(scores, top_k)
+        return [
+            [FaceMatch(student_ids[col], float(scores[row, col]), payloads[col]) for col in cols]
+            for row, cols in enumerate(best)
+        ]
@@ -0,0 +1,279 @@
+"""
+Per-student face templates in Qdrant.
+
+A student is stored as at most 1 + TEMPLATE_MAX_EXEMPLARS points: the
+normalized centroid of every face registered for them, plus exemplars that
+keep the spread of their appearance (glasses, lighting, angle), chosen by
+farthest-point selection. Point ids are derived from the user id, so
+registering again rewrites the same points and the collection stays
+bounded at about K vectors per student however often faces are added.
+
+Faces can name the photo they come from; the centroid then remembers the
+photos merged into it (payload "sources") and a photo is never merged
+twice, so a batch written again after a crash leaves the template as it is.
+
+Every write also replaces the collection's version token, kept in the
+one-point collection "<collection>_version", so processes caching
+templates (EnrolledMatcher) see writes made by any other process: the
+API's replicas, bulk_import and compact_templates.
+"""
+import os
+import uuid
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+# Exemplars kept per student next to the centroid
+TEMPLATE_MAX_EXEMPLARS = int(os.getenv("TEMPLATE_MAX_EXEMPLARS", "4"))
+
+# Namespace of the deterministic point ids (uuid5 of "<user_id>:<kind>:<slot>")
+_POINT_NAMESPACE = uuid.UUID("3f0c5d1e-8d0a-4a4b-9a57-5b3f4c0b9e21")
+
+
+class StudentTemplate(NamedTuple):
+    centroid: np.ndarray  # unit vector
+    mean_norm: float  # norm of the mean before normalization, to keep averaging exactly
+    sample_count: int  # faces averaged into the centroid
+    exemplars: np.ndarray  # k x 512 unit vectors
+
+
+def point_id(user_id: Any, kind: str, slot: int = 0) -> str:
+    return str(uuid.uuid5(_POINT_NAMESPACE, f"{user_id}:{kind}:{slot}"))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def farthest_point_selection(vectors: np.ndarray, k: int, anchor: np.ndarray) -> List[int]:
+    """Indices of k unit vectors: the one nearest `anchor`, then each time the one farthest from all chosen"""
+    if len(vectors) <= k:
+        return list(range(len(vectors)))
+    chosen = [int(np.argmax(vectors @ anchor))]
+    # Cosine distance of every candidate to its nearest chosen vector
+    distance = 1.0 - vectors @ vectors[chosen[0]]
+    while len(chosen) < k:
+        index = int(np.argmax(distance))
+        chosen.append(index)
+        distance = np.minimum(distance, 1.0 - vectors @ vectors[index])
+    return chosen
+
+
+def build_template(
+    embeddings: np.ndarray,
+    max_exemplars: int = TEMPLATE_MAX_EXEMPLARS,
+    previous: Optional[StudentTemplate] = None
+) -> StudentTemplate:
+    """Template of new face embeddings, merged into `previous` when given"""
+    vectors = _normalize(embeddings).reshape(-1, embeddings.shape[-1])
+    total = vectors.sum(axis=0)
+    count = len(vectors)
+    if previous is not None:
+        total = total + previous.centroid * previous.mean_norm * previous.sample_count
+        count += previous.sample_count
+        vectors = np.concatenate([previous.exemplars.reshape(-1, vectors.shape[1]), vectors])
+
+    mean = total / count
+    mean_norm = float(np.linalg.norm(mean))
+    centroid = mean / max(mean_norm, 1e-12)
+    chosen = farthest_point_selection(vectors, max_exemplars, centroid)
+    return StudentTemplate(centroid.astype(np.float32), mean_norm, count, vectors[chosen])
+
+
+def template_points(
+    user_id: Any,
+    template: StudentTemplate,
+    payload: Dict[str, Any],
+    sources: Iterable[str] = ()
+) -> List[models.PointStruct]:
+    centroid_payload = {
+        **payload,
+        "kind": "centroid",
+        "sample_count": template.sample_count,
+        "mean_norm": template.mean_norm
+    }
+    if sources:
+        centroid_payload["sources"] = sorted(sources)
+    points = [models.PointStruct(
+        id=point_id(user_id, "centroid"),
+        vector=template.centroid.tolist(),
+        payload=centroid_payload
+    )]
+    for slot, exemplar in enumerate(template.exemplars):
+        points.append(models.PointStruct(
+            id=point_id(user_id, "exemplar", slot),
+            vector=exemplar.tolist(),
+            payload={**payload, "kind": "exemplar"}
+        ))
+    return points
+
+
+def stored_points(
+    client: QdrantClient,
+    collection_name: str,
+    user_ids: Iterable[Any],
+    id_field: str = "user_id"
+) -> Dict[Any, list]:
+    """Every stored point of the given students, with vectors, by user id"""
+    points = {user_id: [] for user_id in user_ids}
+    scroll_filter = models.Filter(must=[
+        models.FieldCondition(key=id_field, match=models.MatchAny(any=sorted(points)))
+    ])
+    offset = None
+    while True:
+        batch, offset = client.scroll(
+            collection_name=collection_name,
+            scroll_filter=scroll_filter,
+            offset=offset,
+            limit=256,
+            with_payload=True,
+            with_vectors=True
+        )
+        for point in batch:
+            points[point.payload[id_field]].append(point)
+        if offset is None:
+            return points
+
+
+def template_from_points(points: list) -> Optional[StudentTemplate]:
+    """The stored template of a student; legacy points without a centroid count as single faces"""
+    centroid = next((p for p in points if p.payload.get("kind") == "centroid"), None)
+    others = [p for p in points if p is not centroid]
+    if centroid is None:
+        if not others:
+            return None
+        return build_template(np.asarray([p.vector for p in others]), max_exemplars=len(others))
+
+    exemplars = _normalize(np.asarray([p.vector for p in others])) if others else np.empty((0, len(centroid.vector)))
+    return StudentTemplate(
+        np.asarray(centroid.vector, dtype=np.float32),
+        float(centroid.payload.get("mean_norm", 1.0)),
+        int(centroid.payload.get("sample_count", max(len(others), 1))),
+        exemplars.astype(np.float32)
+    )
+
+
+def compact_template(points: list, max_exemplars: int = TEMPLATE_MAX_EXEMPLARS) -> Optional[StudentTemplate]:
+    """A student's template cut down to `max_exemplars`, from their stored points"""
+    template = template_from_points(points)
+    if template is None:
+        return None
+    chosen = farthest_point_selection(template.exemplars, max_exemplars, template.centroid)
+    return template._replace(exemplars=template.exemplars[chosen])
+
+
+def _stale_ids(existing: list, points: List[models.PointStruct]) -> list:
+    keep = {p.id for p in points}
+    return [p.id for p in existing if str(p.id) not in keep]
+
+
+def _write(client: QdrantClient, collection_name: str, points: List[models.PointStruct], stale: list) -> None:
+    client.upsert(collection_name=collection_name, points=points)
+    if stale:
+        client.delete(collection_name=collection_name, points_selector=models.PointIdsList(points=stale))
+    bump_version(client, collection_name)
+
+
+# --------------------------
+# Version token
+# --------------------------
+def version_collection(collection_name: str) -> str:
+    return f"{collection_name}_version"
+
+
+def create_version_collection(client: QdrantClient, collection_name: str) -> None:
+    name = version_collection(collection_name)
+    if not client.collection_exists(name):
+        client.create_collection(
+            collection_name=name,
+            vectors_config=models.VectorParams(size=1, distance=models.Distance.DOT)
+        )
+
+
+def bump_version(client: QdrantClient, collection_name: str) -> None:
+    """Mark the collection's templates as changed, for every process caching them"""
+    create_version_collection(client, collection_name)
+    client.upsert(
+        collection_name=version_collection(collection_name),
+        points=[models.PointStruct(id=0, vector=[1.0], payload={"version": uuid.uuid4().hex})]
+    )
+
+
+def read_version(client: QdrantClient, collection_name: str) -> Optional[str]:
+    """The collection's version token; None before its templates were first written"""
+    points = client.retrieve(collection_name=version_collection(collection_name), ids=[0], with_payload=True)
+    return points[0].payload["version"] if points else None
+
+
+def save_template(
+    client: QdrantClient,
+    collection_name: str,
+    user_id: Any,
+    template: StudentTemplate,
+    payload: Dict[str, Any],
+    existing: list = (),
+    sources: Iterable[str] = ()
+) -> int:
+    """Write a student's template points and delete their other points; returns the point count"""
+    points = template_points(user_id, template, payload, sources)
+    _write(client, collection_name, points, _stale_ids(existing, points))
+    return len(points)
+
+
+def merged_sources(points: list) -> set:
+    """The photos (source keys) already merged into a student's stored template"""
+    centroid = next((p for p in points if p.payload.get("kind") == "centroid"), None)
+    return set(centroid.payload.get("sources", ())) if centroid is not None else set()
+
+
+def add_faces_batch(
+    client: QdrantClient,
+    collection_name: str,
+    faces: Dict[Any, Tuple],
+    max_exemplars: int = TEMPLATE_MAX_EXEMPLARS,
+    id_field: str = "user_id"
+) -> Dict[Any, StudentTemplate]:
+    """Merge newly registered faces into the templates of many students.
+
+    `faces` maps each user id to (embeddings, payload) or to (embeddings,
+    payload, sources), `sources` naming the photo of every embedding row
+    (its content hash, say). Rows of photos already in the template are
+    dropped, and students left without new faces are not written. The
+    students' points are read with one scroll and written with one upsert
+    and one delete.
+    """
+    existing = stored_points(client, collection_name, faces, id_field)
+    templates, points, stale = {}, [], []
+    for user_id, (embeddings, payload, *sources) in faces.items():
+        merged = merged_sources(existing[user_id])
+        if sources:
+            fresh = np.array([source not in merged for source in sources[0]], dtype=bool)
+            if not fresh.any():
+                continue
+            embeddings = embeddings[fresh]
+            merged |= {source for source, new in zip(sources[0], fresh) if new}
+        template = build_template(embeddings, max_exemplars, previous=template_from_points(existing[user_id]))
+        student_points = template_points(user_id, template, payload, merged)
+        templates[user_id] = template
+        points.extend(student_points)
+        stale.extend(_stale_ids(existing[user_id], student_points))
+    if points:
+        _write(client, collection_name, points, stale)
+    return templates
+
+
+def add_faces(
+    client: QdrantClient,
+    collection_name: str,
+    user_id: Any,
+    embeddings: np.ndarray,
+    payload: Dict[str, Any],
+    max_exemplars: int = TEMPLATE_MAX_EXEMPLARS,
+    id_field: str = "user_id"
+) -> StudentTemplate:
+    """Merge newly registered faces into a student's template"""
+    templates = add_faces_batch(client, collection_name, {user_id: (embeddings, payload)}, max_exemplars, id_field)
+    return templates[user_id]
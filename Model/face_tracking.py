@@ -0,0 +1,143 @@
+"""
+Cheap face tracking between detections on a video stream.
+
+Each track runs a constant-velocity Kalman filter over its box centre and
+size (in the spirit of SORT). Detections are associated with the predicted
+track boxes one-to-one by IoU, using the same assignment as faces to
+students, so a face keeps its track id while it moves across the frame.
+"""
+import itertools
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from face_assignment import assign_faces
+
+# Minimum IoU between a predicted track box and a detection to continue the track
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))
+# Detection rounds a track survives without being matched
+TRACK_MAX_AGE = int(os.getenv("TRACK_MAX_AGE", "3"))
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of two sets of (x1, y1, x2, y2) boxes"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0).astype(np.float32)
+
+
+class KalmanBoxFilter:
+    """Constant-velocity Kalman filter over (cx, cy, w, h), velocities in pixels per frame"""
+
+    # Measurement noise of detected boxes and process noise of face motion, in pixels
+    _MEASUREMENT_STD = 4.0
+    _PROCESS_STD = 2.0
+
+    def __init__(self, box: np.ndarray):
+        self.x = np.zeros(8)
+        self.x[:4] = self._measurement(box)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 100.0, 100.0, 100.0, 100.0])
+        self.H = np.eye(4, 8)
+        self.R = np.eye(4) * self._MEASUREMENT_STD ** 2
+
+    @staticmethod
+    def _measurement(box: np.ndarray) -> np.ndarray:
+        x1, y1, x2, y2 = box[:4]
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+
+    @property
+    def box(self) -> np.ndarray:
+        cx, cy, w, h = self.x[:4]
+        w, h = max(w, 1.0), max(h, 1.0)
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], dtype=np.float32)
+
+    def predict(self, frames: int = 1) -> np.ndarray:
+        """Advance the state by `frames` frames and return the predicted box"""
+        F = np.eye(8)
+        F[:4, 4:] = np.eye(4) * frames
+        Q = np.eye(8) * (self._PROCESS_STD * frames) ** 2
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q
+        return self.box
+
+    def update(self, box: np.ndarray) -> None:
+        y = self._measurement(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(8) - K @ self.H) @ self.P
+
+
+class Track:
+    """One face followed across frames"""
+
+    def __init__(self, track_id: int, box: np.ndarray, prob: float, frame: int):
+        self.id = track_id
+        self.filter = KalmanBoxFilter(box)
+        self.box = np.asarray(box[:4], dtype=np.float32)
+        self.prob = float(prob)
+        self.first_frame = self.last_frame = frame
+        self._filter_frame = frame
+        self.hits = 1
+        self.misses = 0
+
+        # Identity state, filled in by the caller
+        self.best_quality: Optional[float] = None
+        self.scores: dict = {}
+
+    def predict(self, frame: int) -> np.ndarray:
+        """Box expected at `frame`; the filter is advanced from wherever it was left"""
+        if frame > self._filter_frame:
+            self.filter.predict(frame - self._filter_frame)
+            self._filter_frame = frame
+        return self.filter.box
+
+    def update(self, box: np.ndarray, prob: float, frame: int) -> None:
+        self.filter.update(box)
+        self.box = np.asarray(box[:4], dtype=np.float32)
+        self.prob = float(prob)
+        self.last_frame = frame
+        self.hits += 1
+        self.misses = 0
+
+
+class FaceTracker:
+    """Associates each round of detections with the live tracks"""
+
+    def __init__(self, iou_threshold: float = TRACK_IOU_THRESHOLD, max_age: int = TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks: List[Track] = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes: Optional[np.ndarray], probs: Optional[np.ndarray], frame: int) -> List[Track]:
+        """Feed the detections of `frame`; returns the tracks seen in it, new ones included"""
+        if boxes is None:
+            boxes, probs = np.empty((0, 4), np.float32), np.empty(0, np.float32)
+
+        predicted = np.array([track.predict(frame) for track in self.tracks]).reshape(-1, 4)
+        matched_tracks, matched_boxes = set(), set()
+        for a in assign_faces(iou_matrix(predicted, boxes), self.iou_threshold):
+            self.tracks[a.face_index].update(boxes[a.column], probs[a.column], frame)
+            matched_tracks.add(a.face_index)
+            matched_boxes.add(a.column)
+
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_age]
+
+        for j in range(len(boxes)):
+            if j not in matched_boxes:
+                self.tracks.append(Track(next(self._ids), boxes[j], probs[j], frame))
+
+        return [track for track in self.tracks if track.last_frame == frame]
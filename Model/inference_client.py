@@ -0,0 +1,217 @@
+"""
+Client for the standalone inference service.
+
+`InferenceClient` talks to inference_service over pooled keep-alive HTTP
+connections with connect/read timeouts and retries on connection failures.
+`LocalInferenceClient` is its in-process stand-in for tests and single-node
+setups: the same calls and the same wire format, without a network hop.
+
+Both offer the backend interface of face_inference (`detect_faces`,
+`embed`) plus `detect_and_embed`, which runs detection and embedding in one
+round trip so face crops never leave the inference node.
+"""
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from face_inference import FaceDetections
+from face_quality import MIN_FACE_QUALITY
+from inference_protocol import CONTENT_TYPE, decode_arrays, encode_arrays
+
+# Base URL of the inference service; "local" runs the models in-process behind
+# the same protocol, empty keeps the in-process backend without the protocol
+INFERENCE_URL = os.getenv("INFERENCE_URL", "")
+INFERENCE_CONNECT_TIMEOUT = float(os.getenv("INFERENCE_CONNECT_TIMEOUT", "2"))
+# Crowd photos can take several seconds to detect on a busy node
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "60"))
+INFERENCE_POOL_SIZE = int(os.getenv("INFERENCE_POOL_SIZE", "16"))
+INFERENCE_RETRIES = int(os.getenv("INFERENCE_RETRIES", "2"))
+
+
+class InferenceServiceError(Exception):
+    """Raised when the inference service is unreachable or rejects a request"""
+
+
+def _detections(arrays: List[np.ndarray]) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    values, probs = arrays
+    if not len(values):
+        return None, None
+    return values, probs
+
+
+def _face_detections(arrays: List[np.ndarray]) -> Optional[FaceDetections]:
+    embeddings, probs, boxes = arrays[:3]
+    if not len(embeddings):
+        return None
+    # Services older than face quality scoring send no quality
+    quality = arrays[3] if len(arrays) > 3 else np.ones(len(embeddings), np.float32)
+    return FaceDetections(boxes, probs, embeddings, quality)
+
+
+class _ClientStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def record(self, seconds: float, failed: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += failed
+            self.seconds += seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            mean = self.seconds / self.requests * 1000 if self.requests else None
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "mean_latency_ms": round(mean, 2) if mean is not None else None,
+            }
+
+
+class InferenceClient:
+    """HTTP client of the inference service; safe to share between threads"""
+
+    def __init__(
+        self,
+        base_url: str = INFERENCE_URL,
+        timeout: float = INFERENCE_TIMEOUT,
+        connect_timeout: float = INFERENCE_CONNECT_TIMEOUT,
+        pool_size: int = INFERENCE_POOL_SIZE,
+        retries: int = INFERENCE_RETRIES
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, timeout)
+        self._requests = requests
+        self._session = requests.Session()
+        # Only failed connections are retried: a read timeout means the node is busy
+        # with the request already, and sending it again would double the load
+        retry = Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                      backoff_factor=0.2, allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._stats = _ClientStats()
+
+    def _post(self, path: str, body: bytes, crowd: Optional[bool] = None, **params) -> List[np.ndarray]:
+        if crowd is not None:
+            params["crowd"] = str(crowd).lower()
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = self._session.post(
+                f"{self.base_url}{path}",
+                data=body,
+                params=params,
+                headers={"Content-Type": CONTENT_TYPE},
+                timeout=self.timeout
+            )
+            if response.status_code != 200:
+                try:
+                    message = response.json().get("error", response.text)
+                except ValueError:
+                    message = response.text
+                raise InferenceServiceError(f"Inference service returned {response.status_code}: {message}")
+            arrays = decode_arrays(response.content)
+            failed = False
+            return arrays
+        except self._requests.RequestException as e:
+            raise InferenceServiceError(f"Inference service unavailable: {e}") from e
+        finally:
+            self._stats.record(time.perf_counter() - start, failed)
+
+    def detect_faces(self, img_bytes: bytes, crowd: bool = True):
+        return _detections(self._post("/v1/detect", img_bytes, crowd))
+
+    def detect_boxes(self, img_bytes: bytes, crowd: bool = True):
+        return _detections(self._post("/v1/detect-boxes", img_bytes, crowd))
+
+    def embed(self, faces) -> np.ndarray:
+        return self._post("/v1/embed", encode_arrays(faces))[0]
+
+    def detect_and_embed(self, img_bytes: bytes, crowd: bool = True, min_quality: float = MIN_FACE_QUALITY):
+        return _face_detections(self._post("/v1/detect-embed", img_bytes, crowd, min_quality=min_quality))
+
+    def ready(self) -> bool:
+        try:
+            return self._session.get(f"{self.base_url}/ready", timeout=self.timeout).status_code == 200
+        except self._requests.RequestException:
+            return False
+
+    def stats(self) -> dict:
+        return {"url": self.base_url, **self._stats.as_dict()}
+
+    def close(self) -> None:
+        self._session.close()
+
+
+class LocalInferenceClient:
+    """In-process stand-in for InferenceClient, speaking the same wire format.
+
+    Wraps any detect_faces / embed backend (built on first use when none is
+    given), so tests can exercise the remote code path without a server.
+    """
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._service = None
+        self._lock = threading.Lock()
+        self._stats = _ClientStats()
+
+    @property
+    def service(self):
+        if self._service is None:
+            from face_inference import build_inference
+            from inference_service import InferenceService
+
+            with self._lock:
+                if self._service is None:
+                    self._service = InferenceService(self._backend or build_inference())
+        return self._service
+
+    def _call(self, handler: str, *args) -> List[np.ndarray]:
+        start = time.perf_counter()
+        failed = True
+        try:
+            arrays = decode_arrays(getattr(self.service, handler)(*args))
+            failed = False
+            return arrays
+        finally:
+            self._stats.record(time.perf_counter() - start, failed)
+
+    def detect_faces(self, img_bytes: bytes, crowd: bool = True):
+        return _detections(self._call("detect", img_bytes, crowd))
+
+    def detect_boxes(self, img_bytes: bytes, crowd: bool = True):
+        return _detections(self._call("detect_boxes", img_bytes, crowd))
+
+    def embed(self, faces) -> np.ndarray:
+        return self._call("embed", encode_arrays(faces))[0]
+
+    def detect_and_embed(self, img_bytes: bytes, crowd: bool = True, min_quality: float = MIN_FACE_QUALITY):
+        return _face_detections(self._call("detect_embed", img_bytes, crowd, min_quality))
+
+    def ready(self) -> bool:
+        return True
+
+    def stats(self) -> dict:
+        return {"url": "local", **self._stats.as_dict()}
+
+    def close(self) -> None:
+        pass
+
+
+def create_inference_client(url: str = INFERENCE_URL):
+    """Client for INFERENCE_URL: the in-process stand-in for "local", HTTP otherwise"""
+    if url == "local":
+        return LocalInferenceClient()
+    return InferenceClient(url)
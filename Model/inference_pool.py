@@ -0,0 +1,185 @@
+"""
+Pool of inference worker processes.
+
+Each worker loads MTCNN and InceptionResnetV1 once, on the configured
+inference runtime, and runs with its own bounded number of torch / ONNX
+Runtime threads, so detection and embedding use every core without
+competing with the API process for the GIL. Face crops and embeddings cross
+the process boundary as shared-memory buffers; only their names and shapes
+are pickled. Nothing here imports torch, so ONNX workers never load it.
+A worker that dies (killed for memory, a native crash) breaks the whole
+executor; the pool then starts a new one and retries the call once.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Tuple
+
+import numpy as np
+
+from face_inference import EMBEDDING_SIZE, INFERENCE_RUNTIME, create_inference
+
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+TORCH_THREADS_PER_WORKER = int(os.getenv("TORCH_THREADS_PER_WORKER", "1"))
+
+
+def _shared_array(shm: SharedMemory, shape: Tuple[int, ...]) -> np.ndarray:
+    return np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+
+
+# --------------------------
+# Worker process side
+# --------------------------
+_inference = None
+
+
+def _init_worker(runtime: str, threads: int) -> None:
+    global _inference
+    _inference = create_inference(runtime, threads)
+
+
+def _detect_in_worker(img_bytes: bytes, crowd: bool):
+    boxes, faces, probs, landmarks = _inference.detect(img_bytes, crowd)
+    if faces is None:
+        return None, None, None, None, None
+
+    faces = np.ascontiguousarray(faces, dtype=np.float32)
+    shm = SharedMemory(create=True, size=faces.nbytes)
+    _shared_array(shm, faces.shape)[:] = faces
+    shm.close()
+    # The parent copies the crops out and unlinks the block
+    return shm.name, faces.shape, boxes, probs, landmarks
+
+
+def _detect_boxes_in_worker(img_bytes: bytes, crowd: bool):
+    return _inference.detect_boxes(img_bytes, crowd)
+
+
+def _embed_in_worker(faces_name: str, shape: Tuple[int, ...], out_name: str) -> None:
+    faces_shm = SharedMemory(name=faces_name)
+    out_shm = SharedMemory(name=out_name)
+    try:
+        faces = _shared_array(faces_shm, shape)
+        _shared_array(out_shm, (shape[0], EMBEDDING_SIZE))[:] = _inference.embed(faces)
+        del faces
+    finally:
+        faces_shm.close()
+        out_shm.close()
+
+
+# --------------------------
+# API process side
+# --------------------------
+class InferencePool:
+    """Runs detection and embedding on a pool of model-holding worker processes.
+
+    Offers the same `detect_faces` / `embed` interface as the in-process
+    model registry, so the attendance pipeline can use either.
+    """
+
+    def __init__(
+        self,
+        workers: int = INFERENCE_WORKERS,
+        torch_threads: int = TORCH_THREADS_PER_WORKER,
+        runtime: str = INFERENCE_RUNTIME
+    ):
+        self.workers = max(1, workers)
+        self.torch_threads = torch_threads
+        self.runtime = runtime
+        self.restarts = 0
+        self._restart_lock = threading.Lock()
+        self._executor = self._start_executor()
+
+    def _start_executor(self) -> ProcessPoolExecutor:
+        # spawn, not fork: forking after torch has started its thread pool can deadlock
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.runtime, self.torch_threads)
+        )
+
+    def _replace_executor(self, broken: ProcessPoolExecutor) -> None:
+        with self._restart_lock:
+            # Concurrent calls failing on the same executor replace it once
+            if self._executor is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._start_executor()
+            self.restarts += 1
+        print(f"⚠️  An inference worker died; restarted the pool ({self.restarts} restarts)")
+
+    def _run(self, call):
+        """`call(executor)`, retried once on a new executor if a worker died"""
+        executor = self._executor
+        try:
+            return call(executor)
+        except BrokenProcessPool:
+            self._replace_executor(executor)
+            return call(self._executor)
+
+    def _submit(self, fn, *args):
+        return self._run(lambda executor: executor.submit(fn, *args).result())
+
+    def detect(self, img_bytes: bytes, crowd: bool = True):
+        name, shape, boxes, probs, landmarks = self._submit(_detect_in_worker, img_bytes, crowd)
+        if name is None:
+            return None, None, None, None
+
+        shm = SharedMemory(name=name)
+        try:
+            faces = _shared_array(shm, shape).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        return boxes, faces, probs, landmarks
+
+    def detect_faces(self, img_bytes: bytes, crowd: bool = True) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        _, faces, probs, _ = self.detect(img_bytes, crowd)
+        return faces, probs
+
+    def detect_boxes(self, img_bytes: bytes, crowd: bool = True) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        # Boxes are tiny, so they come back pickled rather than through shared memory
+        return self._submit(_detect_boxes_in_worker, img_bytes, crowd)
+
+    def embed(self, faces) -> np.ndarray:
+        faces = np.ascontiguousarray(faces, dtype=np.float32)
+        if faces.ndim == 3:
+            faces = faces[None]
+        if not len(faces):
+            return np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+        # Fresh buffers for the retry: the dead worker may have left them half written
+        return self._run(lambda executor: self._embed_on(executor, faces))
+
+    @staticmethod
+    def _embed_on(executor: ProcessPoolExecutor, faces: np.ndarray) -> np.ndarray:
+        faces_shm = SharedMemory(create=True, size=faces.nbytes)
+        out_shm = SharedMemory(create=True, size=len(faces) * EMBEDDING_SIZE * 4)
+        try:
+            _shared_array(faces_shm, faces.shape)[:] = faces
+            executor.submit(_embed_in_worker, faces_shm.name, faces.shape, out_shm.name).result()
+            return _shared_array(out_shm, (len(faces), EMBEDDING_SIZE)).copy()
+        finally:
+            for shm in (faces_shm, out_shm):
+                shm.close()
+                shm.unlink()
+
+    def warm_up(self) -> None:
+        """Start every worker now instead of on the first photo"""
+        def start(executor: ProcessPoolExecutor) -> list:
+            futures = [executor.submit(os.getpid) for _ in range(self.workers)]
+            return [future.result() for future in futures]
+
+        self._run(start)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers, "runtime": self.runtime, "torch_threads_per_worker": self.torch_threads,
+            "restarts": self.restarts
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
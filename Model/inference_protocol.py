@@ -0,0 +1,63 @@
+"""
+Binary wire format between the API and the inference service.
+
+Images travel as their raw encoded bytes. Face crops, embeddings and
+detection probabilities travel as a frame of float32 arrays:
+
+    b"FCE1" | uint32 array count | per array: uint32 ndim, ndim x uint32 shape, float32 data
+
+All integers and floats are little-endian. Decoding does not copy: the
+arrays are read-only views into the received buffer.
+"""
+import struct
+from typing import List
+
+import numpy as np
+
+MAGIC = b"FCE1"
+CONTENT_TYPE = "application/octet-stream"
+
+_HEADER = struct.Struct("<4sI")
+_UINT32 = struct.Struct("<I")
+_DTYPE = np.dtype("<f4")
+
+
+class ProtocolError(ValueError):
+    """Raised when a frame is truncated or not in this format"""
+
+
+def encode_arrays(*arrays) -> bytes:
+    """Pack float32 arrays into one frame"""
+    parts = [_HEADER.pack(MAGIC, len(arrays))]
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=_DTYPE)
+        parts.append(struct.pack(f"<I{array.ndim}I", array.ndim, *array.shape))
+        parts.append(array.tobytes())
+    return b"".join(parts)
+
+
+def decode_arrays(data: bytes) -> List[np.ndarray]:
+    """Unpack every array of a frame"""
+    if len(data) < _HEADER.size:
+        raise ProtocolError("Frame is shorter than its header")
+    magic, count = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ProtocolError(f"Unknown frame magic {magic!r}")
+
+    arrays = []
+    offset = _HEADER.size
+    try:
+        for _ in range(count):
+            (ndim,) = _UINT32.unpack_from(data, offset)
+            shape = struct.unpack_from(f"<{ndim}I", data, offset + _UINT32.size)
+            offset += _UINT32.size * (ndim + 1)
+            size = int(np.prod(shape, dtype=np.int64))
+            if offset + size * _DTYPE.itemsize > len(data):
+                raise ProtocolError("Frame is truncated")
+            arrays.append(np.frombuffer(data, dtype=_DTYPE, count=size, offset=offset).reshape(shape))
+            offset += size * _DTYPE.itemsize
+    except struct.error as e:
+        raise ProtocolError(f"Frame is truncated: {e}")
+    if offset != len(data):
+        raise ProtocolError("Frame has trailing bytes")
+    return arrays
@@ -0,0 +1,187 @@
+"""
+Standalone face inference service.
+
+Runs detection and embedding for the API replicas so CPU-heavy inference
+nodes can be scaled separately from the CRUD API. Matching stays in the API,
+next to the enrollment data and its caches. Requests and responses use the
+binary format of inference_protocol:
+
+* POST /v1/detect-embed?crowd=true&min_quality=0.3
+                                     image bytes -> [embeddings Nx512, probs N, boxes Nx4, quality N]
+* POST /v1/detect?crowd=true         image bytes -> [crops Nx3x160x160, probs N]
+* POST /v1/detect-boxes?crowd=true   image bytes -> [boxes Nx4, probs N]
+* POST /v1/embed                     [crops Nx3x160x160] -> [embeddings Nx512]
+* GET  /health, /ready, /stats, /metrics (Prometheus)
+
+Models load in the background after startup; /ready answers 503 until then.
+
+Run: uvicorn inference_service:app --host 0.0.0.0 --port 8001
+"""
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from PIL import UnidentifiedImageError
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from face_inference import EMBEDDING_SIZE, INFERENCE_RUNTIME, build_inference, detect_and_embed
+from face_quality import MIN_FACE_QUALITY
+from inference_protocol import CONTENT_TYPE, ProtocolError, decode_arrays, encode_arrays
+
+
+class InferenceService:
+    """Protocol-level request handlers around a detect_faces / embed backend.
+
+    Shared by the HTTP app and the in-process stand-in client, so both speak
+    exactly the same bytes.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def detect(self, img_bytes: bytes, crowd: bool = True) -> bytes:
+        faces, probs = self.backend.detect_faces(img_bytes, crowd)
+        if faces is None:
+            return encode_arrays(np.empty((0, 3, 160, 160), np.float32), np.empty(0, np.float32))
+        return encode_arrays(faces, probs)
+
+    def detect_boxes(self, img_bytes: bytes, crowd: bool = True) -> bytes:
+        boxes, probs = self.backend.detect_boxes(img_bytes, crowd)
+        if boxes is None:
+            return encode_arrays(np.empty((0, 4), np.float32), np.empty(0, np.float32))
+        return encode_arrays(boxes, probs)
+
+    def embed(self, body: bytes) -> bytes:
+        (faces,) = decode_arrays(body)
+        if not len(faces):
+            return encode_arrays(np.empty((0, EMBEDDING_SIZE), np.float32))
+        return encode_arrays(self.backend.embed(faces))
+
+    def detect_embed(self, img_bytes: bytes, crowd: bool = True, min_quality: float = MIN_FACE_QUALITY) -> bytes:
+        detections = detect_and_embed(self.backend, img_bytes, crowd, min_quality=min_quality)
+        if detections is None:
+            return encode_arrays(
+                np.empty((0, EMBEDDING_SIZE), np.float32), np.empty(0, np.float32),
+                np.empty((0, 4), np.float32), np.empty(0, np.float32)
+            )
+        return encode_arrays(detections.embeddings, detections.probs, detections.boxes, detections.quality)
+
+
+# --------------------------
+# HTTP app
+# --------------------------
+_state = {"service": None, "error": None, "load_seconds": None}
+
+
+def _load() -> None:
+    start = time.perf_counter()
+    try:
+        _state["service"] = InferenceService(build_inference())
+        _state["load_seconds"] = round(time.perf_counter() - start, 3)
+        print(f"✅ Inference service ready in {_state['load_seconds']}s")
+    except Exception as e:
+        _state["error"] = str(e)
+        print(f"❌ Failed to load the inference models: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    threading.Thread(target=_load, name="inference-warmup", daemon=True).start()
+    yield
+    backend = getattr(_state["service"], "backend", None)
+    backend = getattr(backend, "backend", backend)  # unwrap the micro-batcher
+    if hasattr(backend, "shutdown"):
+        backend.shutdown()
+
+
+app = FastAPI(title="Face Inference Service", version="1.0.0", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+async def _handle(handler, *args) -> Response:
+    service = _state["service"]
+    if service is None:
+        return JSONResponse(status_code=503, content={"error": _state["error"] or "Models are still loading"})
+    try:
+        body = await run_in_threadpool(getattr(service, handler), *args)
+    except (ProtocolError, UnidentifiedImageError) as e:
+        return JSONResponse(status_code=400, content={"error": str(e) or "Unreadable request body"})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    return Response(content=body, media_type=CONTENT_TYPE)
+
+
+@app.post("/v1/detect-embed")
+async def detect_embed(request: Request, crowd: bool = True, min_quality: float = MIN_FACE_QUALITY):
+    """Detect every face in an image and return the embeddings of those good enough to match"""
+    return await _handle("detect_embed", await request.body(), crowd, min_quality)
+
+
+@app.post("/v1/detect")
+async def detect(request: Request, crowd: bool = True):
+    """Detect every face in an image and return the aligned crops"""
+    return await _handle("detect", await request.body(), crowd)
+
+
+@app.post("/v1/detect-boxes")
+async def detect_boxes(request: Request, crowd: bool = True):
+    """Detect every face in an image and return the boxes only"""
+    return await _handle("detect_boxes", await request.body(), crowd)
+
+
+@app.post("/v1/embed")
+async def embed(request: Request):
+    """Embed a batch of aligned face crops"""
+    return await _handle("embed", await request.body())
+
+
+@app.get("/health")
+async def health():
+    return {"status": "healthy", "service": "face-inference"}
+
+
+@app.get("/ready")
+async def ready():
+    status = {"ready": _state["service"] is not None, "load_seconds": _state["load_seconds"]}
+    if _state["error"]:
+        status["error"] = _state["error"]
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/stats")
+async def stats():
+    status = {"runtime": INFERENCE_RUNTIME, "ready": _state["service"] is not None}
+    backend = getattr(_state["service"], "backend", None)
+    while backend is not None:
+        status[type(backend).__name__] = backend.stats()
+        backend = getattr(backend, "backend", None)
+    return status
+
+
+def _collect_model_metrics() -> None:
+    metrics.VISION_READY.set(1 if _state["service"] is not None else 0)
+    if _state["load_seconds"] is not None:
+        metrics.VISION_LOAD_SECONDS.set(_state["load_seconds"])
+    backend = getattr(_state["service"], "backend", None)
+    while backend is not None:
+        stats = backend.stats()
+        if all(isinstance(values, dict) for values in stats.values()):
+            metrics.record_model_stats(stats)  # the model registry: load time and memory per model
+        backend = getattr(backend, "backend", None)
+
+
+metrics.REGISTRY.add_collector(_collect_model_metrics)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8001)
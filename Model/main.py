@@ -1,19 +1,19 @@
-from fastapi import FastAPI, Form, UploadFile, File, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Form, UploadFile, File, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from facenet_pytorch import InceptionResnetV1, MTCNN
-from PIL import Image
-import io
-from qdrant_client import models, QdrantClient
-import torch
-import uuid
+from starlette.concurrency import run_in_threadpool
 import os
+from contextlib import asynccontextmanager
 from typing import List, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from datetime import datetime
 
 # Import local modules
+import metrics
+from face_inference import INFERENCE_RUNTIME, detect_and_embed
+from vision_stack import VisionStack, MODEL_WARMUP
 from database import get_db, init_db, User, Subject, Enrollment, AttendanceSession, AttendanceRecord
 from auth import (
     get_password_hash, 
@@ -28,34 +28,33 @@ from schemas import (
     AttendanceSessionCreate, AttendanceSessionResponse,
     AttendanceRecordCreate, AttendanceRecordResponse,
     LoginRequest, LoginResponse,
-    ImageProcessingResponse, DetectedStudent,
+    AttendanceJobResponse, RescoreRequest, RescoreResponse,
     EnrollmentCreate, StudentAttendanceStats, StudentAttendanceResponse
 )
 
 # --------------------------
-# Qdrant Setup
+# Face Recognition Stack
 # --------------------------
-client = QdrantClient("http://localhost:6333")
-COLLECTION_NAME = "Student_Faces"
-
-def create_collection(size: int) -> None:
+# Qdrant, the face models and the attendance queue are built on first use
+# (or by the background warm-up), never at import time
+vision = VisionStack()
+
+async def get_vision() -> VisionStack:
+    """The loaded vision stack; the first caller loads it off the event loop"""
+    if vision.ready:
+        return vision
     try:
-        collections = client.get_collections()
-        existing = [c.name for c in collections.collections]
-        
-        if COLLECTION_NAME not in existing:
-            client.create_collection(
-                collection_name=COLLECTION_NAME,
-                vectors_config=models.VectorParams(size=size, distance=models.Distance.COSINE)
-            )
-            print(f"✅ Collection '{COLLECTION_NAME}' created.")
-        else:
-            print(f"ℹ️  Collection '{COLLECTION_NAME}' already exists.")
+        return await run_in_threadpool(vision.load)
     except Exception as e:
-        print(f"❌ Error creating collection: {e}")
+        raise HTTPException(status_code=503, detail=f"Face recognition is unavailable: {e}")
 
-# Initialize collection
-create_collection(512)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    if MODEL_WARMUP:
+        vision.warm_up_in_background()
+    yield
+    vision.shutdown()
 
 # --------------------------
 # FastAPI Setup
@@ -63,7 +62,8 @@ create_collection(512)
 app = FastAPI(
     title="Smart Attendance System with Face Recognition",
     description="AI-powered attendance system using CNN for face detection in group photos",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -75,16 +75,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Face models (global)
-mtcnn = MTCNN(keep_all=False, device='cpu')
-resnet = InceptionResnetV1(pretrained='vggface2').eval()
+# Request latency by route; also labels the pipeline, DB and Qdrant timings (see metrics)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Create uploads directory
 os.makedirs("uploads", exist_ok=True)
 
-# Initialize database
-init_db()
-
 # --------------------------
 # Authentication Routes
 # --------------------------
@@ -211,6 +207,7 @@ async def delete_user(
     
     db.delete(user)
     db.commit()
+    vision.invalidate_student(user_id)
     return {"message": "User deleted successfully"}
 
 # --------------------------
@@ -221,28 +218,25 @@ async def register_student_face(
     student_id: int,
     img: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    vision: VisionStack = Depends(get_vision)
 ):
     """Register a student's face for recognition"""
+    from face_templates import add_faces
+
     student = db.query(User).filter(User.id == student_id, User.role == "student").first()
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
     
     try:
         img_bytes = await img.read()
-        pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
         
-        # Detect and crop face
-        face_tensor = mtcnn(pil_img)
-        if face_tensor is None:
+        # Detect, crop and embed the face
+        detections = detect_and_embed(vision.inference, img_bytes, crowd=False, min_quality=0.0)
+        if detections is None:
             return JSONResponse(status_code=400, content={"error": "No face detected in the image."})
         
-        # Generate embedding
-        with torch.no_grad():
-            embedding = resnet(face_tensor.unsqueeze(0))
-        embedding = embedding.detach().cpu().numpy()[0]
-        
-        # Store in Qdrant
+        # Merge into the student's template in Qdrant
         metadata = {
             "user_id": student.id,
             "prn": student.prn,
@@ -251,20 +245,12 @@ async def register_student_face(
             "registered_at": datetime.utcnow().isoformat()
         }
         
-        client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=[
-                models.PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=embedding.tolist(),
-                    payload=metadata
-                )
-            ]
-        )
+        add_faces(vision.client, vision.collection_name, student.id, detections.embeddings[:1], metadata)
         
         # Update user record
         student.face_registered = True
         db.commit()
+        vision.invalidate_student(student.id)
         
         return {"status": "registered", "student": student.name, "message": "Face registered successfully"}
     
@@ -318,7 +304,9 @@ async def get_subject_students(
     current_user: User = Depends(get_current_user)
 ):
     """Get all students enrolled in a subject"""
-    enrollments = db.query(Enrollment).filter(Enrollment.subject_id == subject_id).all()
+    enrollments = db.query(Enrollment).options(joinedload(Enrollment.student)).filter(
+        Enrollment.subject_id == subject_id
+    ).all()
     students = []
     for enrollment in enrollments:
         student = enrollment.student
@@ -354,6 +342,7 @@ async def enroll_student(
     )
     db.add(enrollment)
     db.commit()
+    vision.invalidate_subject(subject_id)
     return {"message": "Student enrolled successfully"}
 
 @app.put("/api/subjects/{subject_id}", response_model=SubjectResponse, tags=["Subjects"])
@@ -389,6 +378,7 @@ async def delete_subject(
     
     db.delete(subject)
     db.commit()
+    vision.invalidate_subject(subject_id)
     return {"message": "Subject deleted successfully"}
 
 # --------------------------
@@ -419,128 +409,181 @@ async def create_attendance_session(
     db.refresh(session)
     return session
 
-@app.post("/api/attendance/sessions/{session_id}/upload-image", response_model=ImageProcessingResponse, tags=["Attendance"])
+@app.post(
+    "/api/attendance/sessions/{session_id}/upload-image",
+    response_model=AttendanceJobResponse,
+    status_code=202,
+    tags=["Attendance"]
+)
 async def upload_attendance_image(
     session_id: int,
     image: UploadFile = File(...),
     threshold: float = 0.6,
     db: Session = Depends(get_db),
-    current_user: User = Depends(require_role(["teacher"]))
+    current_user: User = Depends(require_role(["teacher"])),
+    vision: VisionStack = Depends(get_vision)
 ):
-    """Upload group photo and detect students"""
+    """Upload group photo and queue it for student detection"""
+    from attendance_jobs import JobQueueFull
     session = db.query(AttendanceSession).filter(AttendanceSession.id == session_id).first()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
+    # Save image
+    img_bytes = await image.read()
+    img_path = f"uploads/session_{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+    with open(img_path, "wb") as f:
+        f.write(img_bytes)
+    
+    previous_status = session.status
+    session.image_path = img_path
+    session.status = "queued"
+    db.commit()
+    
     try:
-        # Save image
-        img_bytes = await image.read()
-        img_path = f"uploads/session_{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        with open(img_path, "wb") as f:
-            f.write(img_bytes)
-        
-        session.image_path = img_path
-        session.status = "processing"
-        db.commit()
-        
-        # Process image for face detection
-        pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        
-        # Detect faces with keep_all=True
-        mtcnn_crowd = MTCNN(keep_all=True, device='cpu')
-        face_tensors, probs = mtcnn_crowd(pil_img, return_prob=True)
-        
-        if face_tensors is None:
-            session.status = "completed"
-            db.commit()
-            return JSONResponse(status_code=400, content={"error": "No faces detected in the image."})
-        
-        # Get all enrolled students
-        enrollments = db.query(Enrollment).filter(
-            Enrollment.subject_id == session.subject_id
-        ).all()
-        enrolled_student_ids = {e.student_id for e in enrollments}
-        
-        detected_students = []
-        detected_ids = set()
-        
-        # Process each detected face
-        for idx, face_tensor in enumerate(face_tensors):
-            with torch.no_grad():
-                embedding = resnet(face_tensor.unsqueeze(0))
-            embedding = embedding.detach().cpu().numpy()[0]
-            
-            # Search in Qdrant
-            search_result = client.search(
-                collection_name=COLLECTION_NAME,
-                query_vector=embedding.tolist(),
-                limit=1
-            )
-            
-            if search_result and search_result[0].score >= threshold:
-                student_data = search_result[0].payload
-                student_id = student_data["user_id"]
-                
-                # Only mark if enrolled in this subject
-                if student_id in enrolled_student_ids and student_id not in detected_ids:
-                    detected_ids.add(student_id)
-                    
-                    # Create attendance record
-                    record = AttendanceRecord(
-                        session_id=session_id,
-                        student_id=student_id,
-                        status="present",
-                        confidence_score=float(search_result[0].score),
-                        manual_override=False
-                    )
-                    db.add(record)
-                    
-                    student = db.query(User).filter(User.id == student_id).first()
-                    detected_students.append(DetectedStudent(
-                        student_id=student_id,
-                        name=student.name,
-                        email=student.email,
-                        prn=student.prn,
-                        detected=True,
-                        confidence=float(search_result[0].score),
-                        face_index=idx
-                    ))
-        
-        # Mark absent students
-        for enrollment in enrollments:
-            if enrollment.student_id not in detected_ids:
-                student = enrollment.student
-                record = AttendanceRecord(
-                    session_id=session_id,
-                    student_id=enrollment.student_id,
-                    status="absent",
-                    manual_override=False
-                )
-                db.add(record)
-                
-                detected_students.append(DetectedStudent(
-                    student_id=student.id,
-                    name=student.name,
-                    email=student.email,
-                    prn=student.prn,
-                    detected=False
-                ))
-        
-        session.present_students = len(detected_ids)
-        session.status = "completed"
+        job = vision.attendance_jobs.submit(session_id, img_bytes, threshold, user_id=current_user.id)
+    except JobQueueFull as e:
+        session.status = previous_status
         db.commit()
-        
-        return ImageProcessingResponse(
-            session_id=session_id,
-            detected_students=detected_students,
-            total_detected=len(detected_ids),
-            processing_status="completed"
+        raise HTTPException(
+            status_code=503,
+            detail=f"Attendance processing is busy ({e}). Please retry shortly.",
+            headers={"Retry-After": "5"}
         )
     
+    return _job_response(job)
+
+@app.get("/api/attendance/jobs/{job_id}", response_model=AttendanceJobResponse, tags=["Attendance"])
+async def get_attendance_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Poll the progress of an attendance photo upload"""
+    # No jobs exist before the stack is loaded, and polling should not load it
+    job = vision.attendance_jobs.get(job_id) if vision.attendance_jobs else None
+    # Other users' jobs are reported as missing, so job ids cannot be probed
+    if not job or (job.user_id != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
+
+@app.post(
+    "/api/attendance/sessions/{session_id}/rescore",
+    response_model=RescoreResponse,
+    tags=["Attendance"]
+)
+async def rescore_attendance_session(
+    session_id: int,
+    request: RescoreRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_role(["teacher"])),
+    vision: VisionStack = Depends(get_vision)
+):
+    """Re-match a session's stored face embeddings with a new threshold or assignment policy"""
+    from attendance_pipeline import NoStoredFaces
+    from face_assignment import ASSIGNMENT_POLICY
+
+    policy = request.policy or ASSIGNMENT_POLICY
+    if policy not in ("hungarian", "greedy"):
+        raise HTTPException(status_code=400, detail=f"Unknown assignment policy '{policy}'")
+    session = db.query(AttendanceSession).filter(AttendanceSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    try:
+        return await run_in_threadpool(
+            vision.attendance_jobs.pipeline.rescore, db, session, request.threshold, policy
+        )
+    except NoStoredFaces as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+def _job_response(job) -> AttendanceJobResponse:
+    return AttendanceJobResponse(
+        job_id=job.id,
+        session_id=job.session_id,
+        status=job.status,
+        error=job.error,
+        result=job.result,
+        created_at=job.created_at,
+        updated_at=job.updated_at
+    )
+
+@app.websocket("/api/attendance/sessions/{session_id}/stream")
+async def stream_attendance(
+    websocket: WebSocket,
+    session_id: int,
+    token: str = Query(...),
+    threshold: float = 0.6,
+    db: Session = Depends(get_db)
+):
+    """Take attendance from a classroom camera stream.
+
+    Send each frame as a binary JPEG message and the text "end" to finish.
+    Every detection frame is answered with a progress message; "end" writes
+    the attendance records and is answered with the final result. Closing
+    the socket without "end" discards the stream.
+    """
+    from attendance_pipeline import enrolled_students, record_attendance
+    from attendance_stream import AttendanceStream
+
+    # Browsers cannot set headers on a WebSocket, so the JWT comes as a query parameter
+    try:
+        current_user = await get_current_user(token=token, db=db)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+        return
+    if current_user.role != "teacher":
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Access forbidden. Required roles: teacher")
+        return
+    session = db.query(AttendanceSession).filter(AttendanceSession.id == session_id).first()
+    if not session:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Session not found")
+        return
+
+    await websocket.accept()
+    try:
+        vision = await get_vision()
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "error": e.detail})
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+
+    students = enrolled_students(db, session.subject_id)
+    stream = AttendanceStream(
+        vision.inference,
+        vision.matcher,
+        enrolled_ids=list(students),
+        subject_id=session.subject_id,
+        threshold=threshold
+    )
+    previous_status = session.status
+    session.status = "streaming"
+    db.commit()
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                progress = await run_in_threadpool(stream.process_frame, message["bytes"])
+                if progress:
+                    await websocket.send_json(progress)
+            elif message.get("text") == "end":
+                break
+    except WebSocketDisconnect:
+        session.status = previous_status
+        db.commit()
+        return
     except Exception as e:
-        session.status = "error"
+        session.status = previous_status
         db.commit()
-        return JSONResponse(status_code=500, content={"error": str(e)})
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+
+    result = record_attendance(db, session, students, stream.matches(), tracks=stream.track_ids())
+    await websocket.send_json({"type": "result", "result": jsonable_encoder(result), **stream.stats()})
+    await websocket.close()
 
 @app.get("/api/attendance/sessions", response_model=List[AttendanceSessionResponse], tags=["Attendance"])
 async def get_attendance_sessions(
@@ -681,6 +724,56 @@ async def health_check():
         "version": "1.0.1 - AUTH BYPASS"
     }
 
+@app.get("/api/health/ready", tags=["Health"])
+async def readiness_check():
+    """Readiness of the face models: 200 once loaded, 503 while cold, loading or failed"""
+    status = vision.status()
+    if not vision.ready:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/api/models/status", tags=["Health"])
+async def models_status():
+    """Load time and memory use of the shared face models"""
+    status = {
+        "vision": vision.status(),
+        "runtime": INFERENCE_RUNTIME,
+        "models": vision.local_inference.stats() if vision.local_inference else {}
+    }
+    if vision.inference_client:
+        status["inference_service"] = vision.inference_client.stats()
+    if vision.inference_pool:
+        status["inference_pool"] = vision.inference_pool.stats()
+    if vision.embedding_batcher:
+        status["embedding_batcher"] = vision.embedding_batcher.stats()
+    if vision.result_cache:
+        status["result_cache"] = vision.result_cache.stats()
+    return status
+
+def _collect_vision_metrics() -> None:
+    """Gauges read from the vision stack when /metrics is scraped"""
+    metrics.VISION_READY.set(1 if vision.ready else 0)
+    if vision.load_seconds is not None:
+        metrics.VISION_LOAD_SECONDS.set(vision.load_seconds)
+    if vision.local_inference:
+        metrics.record_model_stats(vision.local_inference.stats())
+    if vision.attendance_jobs:
+        metrics.JOBS_PENDING.set(vision.attendance_jobs.depth())
+    if vision.result_cache:
+        cache = vision.result_cache.stats()
+        metrics.RESULT_CACHE_ENTRIES.set(cache["entries"])
+        metrics.RESULT_CACHE_BYTES.set(cache["bytes"])
+        metrics.RESULT_CACHE_LOOKUPS.set_total(cache["hits"], "hit")
+        metrics.RESULT_CACHE_LOOKUPS.set_total(cache["misses"], "miss")
+
+metrics.REGISTRY.add_collector(_collect_vision_metrics)
+
+@app.get("/metrics", tags=["Health"])
+async def prometheus_metrics():
+    """Stage, database and Qdrant latency histograms, face and batch-size distributions
+    and model gauges in the Prometheus text format"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
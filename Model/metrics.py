@@ -0,0 +1,361 @@
+"""
+Latency and throughput metrics in the Prometheus text format.
+
+Every stage of the face pipeline, every SQL statement and every Qdrant
+call is timed into a histogram labelled with the endpoint it ran for (the
+route template of the request, e.g. `/api/attendance/sessions/{session_id}/upload-image`,
+also inside attendance jobs and thread pools), next to face-count and
+batch-size distributions and model-load gauges. `GET /metrics` renders
+them for Prometheus.
+
+Stages (attendance_stage_duration_seconds):
+
+* queue: waiting for an attendance job worker
+* hash: content and perceptual hash of the photo
+* detect: decode, detection and cropping, split by in-process backends into
+  decode, mtcnn and crop
+* detect_embed: one round trip to the inference service
+* quality, embed, match: face quality, ResNet embedding, similarity and assignment
+* record: merging the evidence and committing the session's records
+
+Built on prometheus_client and cheap on the hot path: an observation
+is a dict lookup and prometheus_client's observe, a few microseconds
+(see bench/bench_metrics.py). Metrics are kept per process; inference
+worker processes record into their own copy, which is not exported, so
+the API's detect and embed figures include the hop to them.
+METRICS_ENABLED=0 turns recording off.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import prometheus_client
+from prometheus_client.core import CounterMetricFamily
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# Endpoint label: set explicitly (CLIs, worker threads) or taken from the request being served
+_endpoint = contextvars.ContextVar("metrics_endpoint", default=None)
+_request_scope = contextvars.ContextVar("metrics_request_scope", default=None)
+
+
+class _Metric:
+    """A prometheus_client metric observed with positional label values.
+
+    The child of every label set is looked up once and kept, so the hot
+    path skips prometheus_client's locked `labels()` lookup. Subclasses
+    set `metric_type`.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), registry=None, **options):
+        self.name = name
+        self.label_names = tuple(labels)
+        self.metric = self.metric_type(name, documentation, self.label_names, registry=registry, **options)
+        self._children = {} if self.label_names else {(): self.metric}
+
+    def _child(self, labels: tuple):
+        child = self._children.get(labels)
+        if child is None:
+            child = self._children.setdefault(labels, self.metric.labels(*labels))
+        return child
+
+
+class Counter(_Metric):
+    metric_type = prometheus_client.Counter
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        if not METRICS_ENABLED:
+            return
+        self._child(labels).inc(amount)
+
+
+class Gauge(_Metric):
+    metric_type = prometheus_client.Gauge
+
+    def set(self, value: float, *labels) -> None:
+        self._child(labels).set(value)
+
+
+class MirroredCounter:
+    """Counter mirroring running totals kept elsewhere (e.g. the result cache's hit count)"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set_total(self, value: float, *labels) -> None:
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def collect(self):
+        family = CounterMetricFamily(self.name, self.documentation, labels=self.label_names)
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                family.add_metric([str(label) for label in labels], value)
+        yield family
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram(_Metric):
+    metric_type = prometheus_client.Histogram
+
+    def observe(self, value: float, *labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        self._child(labels).observe(value)
+
+    def time(self, *labels) -> _Timer:
+        """Context manager observing the seconds its block takes"""
+        return _Timer(self, labels)
+
+    def totals(self) -> Dict[tuple, Tuple[int, float]]:
+        """Observation count and sum of every label set"""
+        totals: Dict[tuple, Tuple[int, float]] = {}
+        for family in self.metric.collect():
+            for sample in family.samples:
+                labels = tuple(sample.labels[name] for name in self.label_names)
+                count, total = totals.get(labels, (0, 0.0))
+                if sample.name.endswith("_count"):
+                    totals[labels] = (int(sample.value), total)
+                elif sample.name.endswith("_sum"):
+                    totals[labels] = (count, sample.value)
+        return totals
+
+
+class MetricsRegistry:
+    """The metrics of this process, plus callbacks that refresh gauges before each scrape"""
+
+    def __init__(self):
+        self.registry = prometheus_client.CollectorRegistry()
+        self._collectors: List[Callable[[], None]] = []
+
+    def add_collector(self, collect: Callable[[], None]) -> None:
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"❌ Metrics collector failed: {e}")
+        return prometheus_client.generate_latest(self.registry).decode("utf-8")
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+    return Counter(name, documentation, labels, REGISTRY.registry)
+
+
+def mirrored_counter(name: str, documentation: str, labels: Sequence[str] = ()) -> MirroredCounter:
+    metric = MirroredCounter(name, documentation, labels)
+    REGISTRY.registry.register(metric)
+    return metric
+
+
+def gauge(name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+    return Gauge(name, documentation, labels, REGISTRY.registry)
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labels: Sequence[str] = (),
+    buckets: Sequence[float] = LATENCY_BUCKETS
+) -> Histogram:
+    return Histogram(name, documentation, labels, REGISTRY.registry, buckets=buckets)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# --------------------------
+# Metrics
+# --------------------------
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "endpoint", "status")
+)
+STAGE_SECONDS = histogram(
+    "attendance_stage_duration_seconds", "Duration of each face pipeline stage", ("endpoint", "stage")
+)
+DB_SECONDS = histogram(
+    "db_statement_duration_seconds", "SQL statement execution time", ("endpoint", "operation")
+)
+QDRANT_SECONDS = histogram(
+    "qdrant_request_duration_seconds", "Qdrant client call latency", ("endpoint", "operation")
+)
+FACES_PER_IMAGE = histogram(
+    "faces_per_image", "Faces detected per photo", ("endpoint",), COUNT_BUCKETS
+)
+FACES_REJECTED = counter(
+    "faces_rejected_total", "Detected faces dropped below the quality bar", ("endpoint",)
+)
+EMBED_BATCH_SIZE = histogram(
+    "embedding_batch_size", "Face crops per embedding call", ("source",), COUNT_BUCKETS
+)
+MODEL_LOAD_SECONDS = gauge("model_load_seconds", "Time taken to load each face model", ("model",))
+MODEL_MEMORY_BYTES = gauge("model_memory_bytes", "Weight memory of each face model", ("model",))
+VISION_READY = gauge("vision_stack_ready", "1 once the face models and Qdrant are loaded")
+VISION_LOAD_SECONDS = gauge("vision_stack_load_seconds", "Time taken to build the vision stack")
+JOBS_PENDING = gauge("attendance_jobs_pending", "Attendance photos queued or being processed")
+RESULT_CACHE_ENTRIES = gauge("result_cache_entries", "Photos in the detection result cache")
+RESULT_CACHE_BYTES = gauge("result_cache_bytes", "Size of the detection result cache")
+RESULT_CACHE_LOOKUPS = mirrored_counter("result_cache_lookups_total", "Result cache lookups", ("result",))
+
+
+# --------------------------
+# Endpoint label
+# --------------------------
+def current_endpoint() -> str:
+    """The explicitly set endpoint, else the route template of the request being served"""
+    name = _endpoint.get()
+    if name is not None:
+        return name
+    scope = _request_scope.get()
+    route = scope.get("route") if scope is not None else None
+    return route.path if route is not None else "none"
+
+
+@contextmanager
+def endpoint(name: str):
+    """Label the metrics recorded in this block (and the threads it hands context to) with `name`"""
+    token = _endpoint.set(name)
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+
+def stage(name: str) -> _Timer:
+    """Time a pipeline stage of the current endpoint: `with metrics.stage("embed"): ...`"""
+    return _Timer(STAGE_SECONDS, (current_endpoint(), name))
+
+
+def record_model_stats(stats: Dict[str, dict]) -> None:
+    """Model-load gauges from a model registry's stats()"""
+    for model, values in stats.items():
+        if values.get("load_seconds") is not None:
+            MODEL_LOAD_SECONDS.set(values["load_seconds"], model)
+        if values.get("memory_mb") is not None:
+            MODEL_MEMORY_BYTES.set(values["memory_mb"] * 1024 * 1024, model)
+
+
+# --------------------------
+# Instrumentation
+# --------------------------
+class MetricsMiddleware:
+    """ASGI middleware timing HTTP requests by route template and status.
+
+    The route is only known once the router has matched it, so it is read
+    from the request scope afterwards; pipeline metrics recorded while the
+    request runs read it the same way through `current_endpoint()`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not METRICS_ENABLED or scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        token = _request_scope.set(scope)
+        if scope["type"] == "websocket":
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _request_scope.reset(token)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                scope["method"], route.path if route is not None else "unmatched", str(status[0])
+            )
+            _request_scope.reset(token)
+
+
+def instrument_engine(engine) -> None:
+    """Time every SQL statement of a SQLAlchemy engine by endpoint and operation"""
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_start"] = time.perf_counter()
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("metrics_start", None)
+        if start is not None:
+            operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+            DB_SECONDS.observe(time.perf_counter() - start, current_endpoint(), operation)
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+
+
+class TimedClient:
+    """Proxy timing every method call of a client (e.g. QdrantClient) into `histogram`"""
+
+    def __init__(self, client, histogram: Histogram = QDRANT_SECONDS):
+        self._client = client
+        self._histogram = histogram
+        self._methods: Dict[str, Callable] = {}
+
+    def __getattr__(self, name: str):
+        method = self._methods.get(name)
+        if method is not None:
+            return method
+        attr = getattr(self._client, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        histogram = self._histogram
+
+        def timed(*args, **kwargs):
+            with histogram.time(current_endpoint(), name):
+                return attr(*args, **kwargs)
+
+        self._methods[name] = timed
+        return timed
+
+
+def instrument_client(client, histogram: Histogram = QDRANT_SECONDS):
+    """`client` with its calls timed, or as it is when metrics are off"""
+    return TimedClient(client, histogram) if METRICS_ENABLED else client
@@ -0,0 +1,99 @@
+"""
+One-off migration of databases written before attendance rows were upserted.
+
+init_db refuses to start while a unique index the models declare cannot
+be created over duplicate rows, or while a unique index they no longer
+declare is in place. Run this once, with the API stopped, to:
+
+* drop the obsolete unique (uq_*) indexes,
+* keep one row per key of each blocked index: the manually overridden
+  record if there is one, otherwise the newest. Every removed row is first
+  appended to --backup (JSON lines, with its table),
+* create the indexes.
+
+Safe to run again. --dry-run still adds missing tables and columns, as the
+API would, and reports the rest without doing it.
+
+Usage: python migrate_db.py [--backup FILE] [--dry-run]
+"""
+import argparse
+import json
+from datetime import datetime
+
+from sqlalchemy import Index, inspect, select
+
+from database import (
+    Base, UPSERTED_TABLES, engine, add_missing_columns, duplicate_keys, init_db, obsolete_unique_indexes
+)
+
+# Row kept of each group of duplicates: manual overrides first, then the newest
+_KEEP_FIRST = {"attendance_records": ("manual_override", "id")}
+
+
+def _duplicate_rows(conn, table, keys: list) -> list:
+    """Every row of `table` but the one kept for each repeated value of `keys`"""
+    key_columns = [table.c[name] for name in keys]
+    order = [table.c[name].desc() for name in _KEEP_FIRST.get(table.name, ("id",))]
+    rows = []
+    for group in duplicate_keys(conn, table, keys):
+        match = [column == value for column, value in zip(key_columns, group)]
+        rows.extend(conn.execute(select(table).where(*match).order_by(*order)).mappings().all()[1:])
+    return rows
+
+
+def migrate(backup_path: str, dry_run: bool = False) -> dict:
+    """Drop obsolete unique indexes, remove duplicate rows and create the declared indexes"""
+    stats = {"dropped_indexes": [], "removed_rows": 0, "created_indexes": []}
+    add_missing_columns()
+    with engine.begin() as conn:
+        for name in UPSERTED_TABLES:
+            table = Base.metadata.tables[name]
+            for index in obsolete_unique_indexes(table, conn):
+                stats["dropped_indexes"].append(index["name"])
+                if not dry_run:
+                    Index(index["name"], *(table.c[column] for column in index["column_names"])).drop(bind=conn)
+            existing = {index["name"] for index in inspect(conn).get_indexes(table.name)}
+            for index in table.indexes:
+                if not index.unique or index.name in existing:
+                    continue
+                rows = _duplicate_rows(conn, table, [column.name for column in index.columns])
+                stats["removed_rows"] += len(rows)
+                stats["created_indexes"].append(index.name)
+                if dry_run:
+                    continue
+                if rows:
+                    # Saved before they are deleted; the deletes commit with the indexes
+                    with open(backup_path, "a") as backup:
+                        for row in rows:
+                            backup.write(json.dumps({"table": table.name, **row}, default=str) + "\n")
+                    conn.execute(table.delete().where(table.c.id.in_([row["id"] for row in rows])))
+                index.create(bind=conn)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--backup", default=f"removed_rows_{datetime.now():%Y%m%d_%H%M%S}.jsonl",
+        help="JSON lines file the removed rows are appended to"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Report the changes without making them")
+    args = parser.parse_args()
+
+    # New tables first, as the API would add them
+    Base.metadata.create_all(bind=engine)
+    stats = migrate(args.backup, args.dry_run)
+    verb = "Would remove" if args.dry_run else "Removed"
+    print(f"✅ {verb} {stats['removed_rows']} duplicate rows"
+          + ("" if args.dry_run or not stats["removed_rows"] else f" (saved to {args.backup})"))
+    for name in stats["dropped_indexes"]:
+        print(f"ℹ️  {'Would drop' if args.dry_run else 'Dropped'} obsolete index {name}")
+    for name in stats["created_indexes"]:
+        print(f"ℹ️  {'Would create' if args.dry_run else 'Created'} index {name}")
+    if not args.dry_run:
+        init_db()
+        print("✅ The database is ready for the API")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Process-wide registry of the face models.
+
+MTCNN (single-face and crowd mode) and InceptionResnetV1 are built once and
+shared by every request instead of being rebuilt for each upload.
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+from facenet_pytorch import InceptionResnetV1, MTCNN
+
+import metrics
+from face_engine import EmbeddingEngine, EMBED_BACKEND, build_embedding_model
+from face_inference import DETECTION_MODE, crop_faces, decode_image
+from tiled_detection import TiledDetector
+
+# "vggface2" or "casia-webface"; empty loads untrained weights (offline benchmarks only)
+FACENET_PRETRAINED = os.getenv("FACENET_PRETRAINED", "vggface2") or None
+
+
+def _module_memory_bytes(module: torch.nn.Module) -> Optional[int]:
+    # state_dict also covers the packed weights of quantized layers
+    tensors = [t for t in module.state_dict().values() if isinstance(t, torch.Tensor)]
+    if not tensors:
+        return None  # frozen TorchScript keeps its weights as graph constants
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelRegistry:
+    """Loads the detectors and the embedding model once and hands out shared instances.
+
+    The models are put in eval mode with gradients disabled, so inference only
+    reads their weights and the same instance can serve concurrent requests.
+    Loading is guarded by a lock so racing requests never build a model twice.
+    """
+
+    def __init__(
+        self,
+        device: str = "cpu",
+        pretrained: Optional[str] = FACENET_PRETRAINED,
+        detection_mode: str = DETECTION_MODE,
+        embed_backend: str = EMBED_BACKEND
+    ):
+        self.device = device
+        self.pretrained = pretrained
+        self.detection_mode = detection_mode
+        self.embed_backend = embed_backend
+        self._lock = threading.Lock()
+        self._models: Dict[str, object] = {}
+        self._stats: Dict[str, dict] = {}
+
+    def _build(self, name: str):
+        if name == "mtcnn_single":
+            return MTCNN(keep_all=False, device=self.device)
+        if name == "mtcnn_crowd":
+            return MTCNN(keep_all=True, device=self.device)
+        if name == "resnet":
+            model = InceptionResnetV1(pretrained=self.pretrained, device=self.device).eval()
+            for param in model.parameters():
+                param.requires_grad_(False)
+            return build_embedding_model(model, self.embed_backend)
+        raise KeyError(f"Unknown model '{name}'")
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = self._build(name)
+                model.eval()
+                for param in model.parameters():
+                    param.requires_grad_(False)
+                memory = _module_memory_bytes(model)
+                self._stats[name] = {
+                    "load_seconds": round(time.perf_counter() - start, 3),
+                    "memory_mb": round(memory / (1024 * 1024), 2) if memory is not None else None,
+                }
+                if name == "resnet":
+                    self._stats[name]["backend"] = self.embed_backend
+                self._models[name] = model
+                print(f"✅ Loaded {name} in {self._stats[name]['load_seconds']}s "
+                      f"({self._stats[name]['memory_mb'] or '?'} MB)")
+        return model
+
+    def load_all(self) -> None:
+        for name in ("mtcnn_single", "mtcnn_crowd", "resnet"):
+            self.get(name)
+        _ = self.embedder
+
+    @property
+    def mtcnn_single(self) -> MTCNN:
+        return self.get("mtcnn_single")
+
+    @property
+    def mtcnn_crowd(self) -> MTCNN:
+        return self.get("mtcnn_crowd")
+
+    @property
+    def resnet(self) -> InceptionResnetV1:
+        return self.get("resnet")
+
+    @property
+    def crowd_detector(self):
+        """The crowd-mode MTCNN, wrapped for tiled detection when enabled"""
+        if self.detection_mode != "tiled":
+            return self.mtcnn_crowd
+        detector = self._models.get("tiled_detector")
+        if detector is None:
+            mtcnn_crowd = self.mtcnn_crowd
+            with self._lock:
+                detector = self._models.setdefault("tiled_detector", TiledDetector(mtcnn_crowd))
+        return detector
+
+    @property
+    def embedder(self) -> EmbeddingEngine:
+        engine = self._models.get("embedder")
+        if engine is None:
+            resnet = self.resnet
+            with self._lock:
+                engine = self._models.setdefault("embedder", EmbeddingEngine(resnet))
+        return engine
+
+    def _locate(self, pil_img: Image.Image, crowd: bool):
+        detector = self.crowd_detector if crowd else self.mtcnn_single
+        boxes, probs, landmarks = detector.detect(pil_img, landmarks=True)
+        if boxes is None:
+            return None, None, None
+        if not crowd:
+            boxes, probs, landmarks = boxes[:1], probs[:1], landmarks[:1]
+        return boxes.astype(np.float32), np.asarray(probs, dtype=np.float32), np.asarray(landmarks, dtype=np.float32)
+
+    def detect(self, img_bytes: bytes, crowd: bool = True):
+        """Decode an image once and return its face boxes (Nx4, largest first), crops
+        (Nx3x160x160), probabilities and landmarks (Nx5x2); coordinates are in image pixels"""
+        with metrics.stage("decode"):
+            pil_img, scale = decode_image(img_bytes)
+        with metrics.stage("mtcnn"):
+            boxes, probs, landmarks = self._locate(pil_img, crowd)
+        if boxes is None:
+            return None, None, None, None
+        with metrics.stage("crop"):
+            faces = crop_faces(pil_img, boxes)
+        if scale != 1.0:
+            boxes, landmarks = boxes / scale, landmarks / scale
+        return boxes, faces, probs, landmarks
+
+    def detect_faces(self, img_bytes: bytes, crowd: bool = True) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Decode an image and return its face crops (Nx3x160x160) and detection probabilities"""
+        _, faces, probs, _ = self.detect(img_bytes, crowd)
+        return faces, probs
+
+    def detect_boxes(self, img_bytes: bytes, crowd: bool = True) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Decode an image and return its face boxes (Nx4, largest first) and detection probabilities"""
+        with metrics.stage("decode"):
+            pil_img, scale = decode_image(img_bytes)
+        with metrics.stage("mtcnn"):
+            boxes, probs, _ = self._locate(pil_img, crowd)
+        if boxes is not None and scale != 1.0:
+            boxes = boxes / scale
+        return boxes, probs
+
+    def embed(self, faces) -> np.ndarray:
+        return self.embedder.embed(faces)
+
+    def stats(self) -> Dict[str, dict]:
+        """Load time and weight memory of every model loaded so far"""
+        return {name: dict(values) for name, values in self._stats.items()}
+
+
+registry = ModelRegistry()
@@ -1,12 +1,14 @@
 from fastapi import FastAPI, Form, UploadFile, File, Depends
 from fastapi.responses import JSONResponse
-from facenet_pytorch import InceptionResnetV1, MTCNN
-from PIL import Image
-import io
 from qdrant_client import models, QdrantClient
 from pydantic import BaseModel
-import torch
 import uuid
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_inference import create_inference
+from face_matcher import QdrantMatcher
 
 # --------------------------
 # Qdrant Setup
@@ -31,15 +33,15 @@ def create_collection(size: int) -> None:
         print(f"Error creating collection: {e}")
 
 create_collection(512)
+matcher = QdrantMatcher(client, COLLECTION_NAME, id_field="PRN")
 
 # --------------------------
 # FastAPI Setup
 # --------------------------
 app = FastAPI(title="Student Management System", version="0.0.1")
 
-# Face models
-mtcnn = MTCNN(keep_all=False, device='cpu')  # keep_all=False for single face registration
-resnet = InceptionResnetV1(pretrained='vggface2').eval()
+# Face models (loaded once, shared across requests; INFERENCE_RUNTIME picks torch or ONNX Runtime)
+inference = create_inference()
 
 # --------------------------
 # Pydantic Models
@@ -61,17 +63,14 @@ async def register_student(
 ):
     try:
         img_bytes = await img.read()
-        pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
 
-        # Detect and crop face
-        face_tensor = mtcnn(pil_img)
-        if face_tensor is None:
+        # Detect and crop face (single-face mode for registration)
+        face_tensors, _ = inference.detect_faces(img_bytes, crowd=False)
+        if face_tensors is None:
             return JSONResponse(status_code=400, content={"error": "No face detected in the image."})
 
         # Generate embedding
-        with torch.no_grad():
-            embedding = resnet(face_tensor.unsqueeze(0))
-        embedding = embedding.detach().cpu().numpy()[0]
+        embedding = inference.embed(face_tensors)[0]
 
         # Create metadata dict
         metadata = {
@@ -134,42 +133,35 @@ def get_all_students():
 async def identify_persons(img: UploadFile = File(...), threshold: float = 0.6):
     try:
         img_bytes = await img.read()
-        pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
 
-        # Detect faces in the crowd with keep_all=True
-        mtcnn_crowd = MTCNN(keep_all=True, device='cpu')
-        face_tensors, probs = mtcnn_crowd(pil_img, return_prob=True)
+        # Detect faces in the crowd with the shared keep_all=True detector
+        face_tensors, probs = inference.detect_faces(img_bytes, crowd=True)
 
         if face_tensors is None:
             return JSONResponse(status_code=400, content={"error": "No faces detected in the image."})
 
-        results = []
-        for idx, face_tensor in enumerate(face_tensors):
-            with torch.no_grad():
-                embedding = resnet(face_tensor.unsqueeze(0))
-            embedding = embedding.detach().cpu().numpy()[0]
+        # Embed all detected faces in one batched pass
+        embeddings = inference.embed(face_tensors)
 
-            # Search in Qdrant
-            search_result = client.search(
-                collection_name=COLLECTION_NAME,
-                query_vector=embedding.tolist(),
-                limit=1
-            )
+        # Match all faces against Qdrant in one batched request
+        matches = matcher.search(embeddings, top_k=1)
 
-            if search_result and search_result[0].score >= threshold:
+        results = []
+        for idx, face_matches in enumerate(matches):
+            if face_matches and face_matches[0].score >= threshold:
                 results.append({
                     "face_index": idx,
-                    "match_score": float(search_result[0].score),
-                    "student": search_result[0].payload,
+                    "match_score": face_matches[0].score,
+                    "student": face_matches[0].payload,
                     "detection_confidence": float(probs[idx]) if probs is not None else None
                 })
             else:
                 results.append({
                     "face_index": idx,
-                    "match_score": float(search_result[0].score) if search_result else None,
+                    "match_score": face_matches[0].score if face_matches else None,
                     "student": None,
                     "detection_confidence": float(probs[idx]) if probs is not None else None,
-                    "reason": "No match above threshold" if search_result else "No match found"
+                    "reason": "No match above threshold" if face_matches else "No match found"
                 })
 
         return {
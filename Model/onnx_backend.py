@@ -0,0 +1,415 @@
+"""
+ONNX Runtime backend for MTCNN and InceptionResnetV1.
+
+Runs the graphs written by export_onnx.py on CPU without importing torch.
+MTCNN's three-stage cascade (image pyramid, P-Net proposals, R-Net and
+O-Net refinement) is ported to numpy step for step from facenet-pytorch,
+including its area-average resampling, so boxes, crops and embeddings match
+the torch backend within floating-point tolerance.
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    import onnxruntime as ort
+except ImportError:  # onnxruntime is only needed for INFERENCE_RUNTIME=onnx
+    ort = None
+
+import metrics
+from face_inference import DETECTION_MODE, EMBED_MAX_BATCH_SIZE, EMBEDDING_SIZE, crop_faces, decode_image
+from tiled_detection import TiledDetector, nms
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_models"))
+ONNX_MODEL_FILES = {
+    "pnet": "pnet.onnx",
+    "rnet": "rnet.onnx",
+    "onet": "onet.onnx",
+    "resnet": "resnet.onnx",
+}
+
+# Largest number of candidate crops sent through R-Net / O-Net at once
+_REFINE_BATCH_SIZE = 512
+
+
+def create_session(path: str, threads: Optional[int] = None):
+    """CPU inference session for one exported graph"""
+    if ort is None:
+        raise RuntimeError("onnxruntime is not installed; pip install onnxruntime to use INFERENCE_RUNTIME=onnx")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run export_onnx.py to create it")
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+# --------------------------
+# MTCNN cascade in numpy
+# --------------------------
+def _area_axis(data: np.ndarray, axis: int, size: int) -> np.ndarray:
+    """Adaptive average pooling along one axis (torch interpolate mode="area")"""
+    length = data.shape[axis]
+    i = np.arange(size)
+    start = (i * length) // size
+    end = -((-(i + 1) * length) // size)
+    sums = np.cumsum(data, axis=axis, dtype=np.float64)
+    sums = np.insert(sums, 0, 0.0, axis=axis)
+    counts = (end - start).reshape([-1 if a == axis else 1 for a in range(data.ndim)])
+    return (np.take(sums, end, axis=axis) - np.take(sums, start, axis=axis)) / counts
+
+
+def imresample(img: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Area-resample a CxHxW float image to size (height, width)"""
+    out = _area_axis(img, 1, size[0])
+    return _area_axis(out, 2, size[1]).astype(np.float32)
+
+
+def _normalize(img: np.ndarray) -> np.ndarray:
+    return (img - 127.5) * 0.0078125
+
+
+def generate_bounding_boxes(reg: np.ndarray, probs: np.ndarray, scale: float, threshold: float) -> np.ndarray:
+    """P-Net output map -> candidate rows (x1, y1, x2, y2, score, 4 regression offsets)"""
+    stride, cellsize = 2, 12
+    ys, xs = np.nonzero(probs >= threshold)
+    score = probs[ys, xs]
+    offsets = reg[:, ys, xs].T
+    bb = np.stack([xs, ys], axis=1).astype(np.float32)
+    q1 = np.floor((stride * bb + 1) / scale)
+    q2 = np.floor((stride * bb + cellsize - 1 + 1) / scale)
+    return np.concatenate([q1, q2, score[:, None], offsets], axis=1).astype(np.float32)
+
+
+def bbreg(boxes: np.ndarray, reg: np.ndarray) -> np.ndarray:
+    w = boxes[:, 2] - boxes[:, 0] + 1
+    h = boxes[:, 3] - boxes[:, 1] + 1
+    boxes[:, 0] += reg[:, 0] * w
+    boxes[:, 1] += reg[:, 1] * h
+    boxes[:, 2] += reg[:, 2] * w
+    boxes[:, 3] += reg[:, 3] * h
+    return boxes
+
+
+def rerec(boxes: np.ndarray) -> np.ndarray:
+    """Grow boxes into squares around their centre"""
+    h = boxes[:, 3] - boxes[:, 1]
+    w = boxes[:, 2] - boxes[:, 0]
+    side = np.maximum(w, h)
+    boxes[:, 0] = boxes[:, 0] + w * 0.5 - side * 0.5
+    boxes[:, 1] = boxes[:, 1] + h * 0.5 - side * 0.5
+    boxes[:, 2:4] = boxes[:, :2] + side[:, None]
+    return boxes
+
+
+def pad(boxes: np.ndarray, w: int, h: int):
+    boxes = np.trunc(boxes[:, :4]).astype(np.int32)
+    x, y, ex, ey = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    x[x < 1] = 1
+    y[y < 1] = 1
+    ex[ex > w] = w
+    ey[ey > h] = h
+    return y, ey, x, ex
+
+
+class OnnxMTCNN:
+    """numpy/ONNX Runtime MTCNN with the interface of facenet_pytorch.MTCNN used here.
+
+    `detect` and `extract` behave like their facenet-pytorch counterparts, so
+    the detector also works under TiledDetector. Calling it returns the face
+    crops as a float32 numpy array instead of a torch tensor.
+    """
+
+    def __init__(
+        self,
+        pnet,
+        rnet,
+        onet,
+        keep_all: bool = False,
+        image_size: int = 160,
+        min_face_size: int = 20,
+        thresholds: Sequence[float] = (0.6, 0.7, 0.7),
+        factor: float = 0.709
+    ):
+        self.pnet = pnet
+        self.rnet = rnet
+        self.onet = onet
+        self.keep_all = keep_all
+        self.image_size = image_size
+        self.min_face_size = min_face_size
+        self.thresholds = thresholds
+        self.factor = factor
+
+    @staticmethod
+    def _run(session, batch: np.ndarray) -> List[np.ndarray]:
+        return session.run(None, {session.get_inputs()[0].name: batch})
+
+    def _refine(self, session, img: np.ndarray, boxes: np.ndarray, size: int):
+        """Crop candidate boxes out of the image and run them through R-Net or O-Net"""
+        height, width = img.shape[1:]
+        y, ey, x, ex = pad(boxes, width, height)
+        valid = (ey > y - 1) & (ex > x - 1)
+        if not valid.any():
+            return boxes[valid], [np.zeros((0, out.shape[1]), np.float32) for out in session.get_outputs()]
+        crops = np.stack([
+            imresample(img[:, y[k] - 1:ey[k], x[k] - 1:ex[k]], (size, size))
+            for k in np.flatnonzero(valid)
+        ])
+        crops = _normalize(crops)
+        outputs = [
+            self._run(session, crops[start:start + _REFINE_BATCH_SIZE])
+            for start in range(0, len(crops), _REFINE_BATCH_SIZE)
+        ]
+        return boxes[valid], [np.concatenate(parts) for parts in zip(*outputs)]
+
+    def _detect_face(self, pil_img: Image.Image) -> Tuple[np.ndarray, np.ndarray]:
+        img = np.asarray(pil_img, dtype=np.float32).transpose(2, 0, 1)
+        height, width = img.shape[1:]
+
+        # Scale pyramid
+        scale = 12.0 / self.min_face_size
+        min_side = min(height, width) * scale
+        scales = []
+        while min_side >= 12:
+            scales.append(scale)
+            scale *= self.factor
+            min_side *= self.factor
+
+        # First stage: P-Net proposals, NMS within each scale and then across scales
+        boxes = []
+        for scale in scales:
+            im_data = imresample(img, (int(height * scale + 1), int(width * scale + 1)))
+            reg, probs = self._run(self.pnet, _normalize(im_data)[None])
+            boxes_scale = generate_bounding_boxes(reg[0], probs[0, 1], scale, self.thresholds[0])
+            boxes.append(boxes_scale[nms(boxes_scale[:, :4], boxes_scale[:, 4], 0.5)])
+        boxes = np.concatenate(boxes) if boxes else np.zeros((0, 9), np.float32)
+        boxes = boxes[nms(boxes[:, :4], boxes[:, 4], 0.7)]
+
+        regw = boxes[:, 2] - boxes[:, 0]
+        regh = boxes[:, 3] - boxes[:, 1]
+        boxes = np.stack([
+            boxes[:, 0] + boxes[:, 5] * regw,
+            boxes[:, 1] + boxes[:, 6] * regh,
+            boxes[:, 2] + boxes[:, 7] * regw,
+            boxes[:, 3] + boxes[:, 8] * regh,
+            boxes[:, 4],
+        ], axis=1)
+        boxes = rerec(boxes)
+
+        # Second stage: R-Net
+        if len(boxes):
+            boxes, (reg, probs) = self._refine(self.rnet, img, boxes, 24)
+            score = probs[:, 1]
+            passed = score > self.thresholds[1]
+            boxes = np.concatenate([boxes[passed, :4], score[passed, None]], axis=1)
+            reg = reg[passed]
+            pick = nms(boxes[:, :4], boxes[:, 4], 0.7)
+            boxes = rerec(bbreg(boxes[pick], reg[pick]))
+
+        # Third stage: O-Net, landmarks and "Min" NMS
+        points = np.zeros((0, 5, 2), np.float32)
+        if len(boxes):
+            boxes, (reg, landmarks, probs) = self._refine(self.onet, img, boxes, 48)
+            score = probs[:, 1]
+            passed = score > self.thresholds[2]
+            boxes = np.concatenate([boxes[passed, :4], score[passed, None]], axis=1)
+            reg, landmarks = reg[passed], landmarks[passed]
+
+            w = boxes[:, 2:3] - boxes[:, 0:1] + 1
+            h = boxes[:, 3:4] - boxes[:, 1:2] + 1
+            points = np.stack([
+                w * landmarks[:, :5] + boxes[:, 0:1] - 1,
+                h * landmarks[:, 5:10] + boxes[:, 1:2] - 1,
+            ], axis=2)
+            boxes = bbreg(boxes, reg)
+            pick = nms(boxes[:, :4], boxes[:, 4], 0.7, method="min")
+            boxes, points = boxes[pick], points[pick]
+
+        return boxes.astype(np.float32), points.astype(np.float32)
+
+    def detect(self, img: Image.Image, landmarks: bool = False):
+        """Boxes (largest first), probabilities and optionally landmarks, like MTCNN.detect"""
+        boxes, points = self._detect_face(img)
+        if not len(boxes):
+            boxes = probs = points = None
+        else:
+            order = np.argsort((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))[::-1]
+            boxes, points = boxes[order], points[order]
+            boxes, probs = boxes[:, :4], boxes[:, 4]
+        if landmarks:
+            return boxes, probs, points
+        return boxes, probs
+
+    def extract(self, img: Image.Image, boxes: np.ndarray, save_path=None) -> np.ndarray:
+        """Standardized Nx3xSxS crops of the given boxes, like MTCNN.extract without margin"""
+        return crop_faces(img, boxes, self.image_size)
+
+    def __call__(self, img: Image.Image, return_prob: bool = False):
+        boxes, probs = self.detect(img)
+        faces = None
+        if boxes is not None:
+            if not self.keep_all:
+                boxes, probs = boxes[:1], probs[:1]
+            faces = self.extract(img, boxes)
+            if not self.keep_all:
+                faces, probs = faces[0], probs[0]
+        if return_prob:
+            return faces, probs
+        return faces
+
+
+class OnnxEmbedder:
+    """Embeds face crops with the exported InceptionResnetV1 in bounded-size batches"""
+
+    def __init__(self, session, max_batch_size: int = EMBED_MAX_BATCH_SIZE):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.max_batch_size = max_batch_size
+
+    def embed(self, faces) -> np.ndarray:
+        """Embed N face crops (Nx3x160x160) and return an N x 512 float32 array"""
+        batch = np.ascontiguousarray(np.asarray(faces, dtype=np.float32))
+        if batch.ndim == 3:
+            batch = batch[None]
+        n = batch.shape[0]
+        embeddings = np.empty((n, EMBEDDING_SIZE), dtype=np.float32)
+        for start in range(0, n, self.max_batch_size):
+            chunk = batch[start:start + self.max_batch_size]
+            embeddings[start:start + len(chunk)] = self.session.run(None, {self.input_name: chunk})[0]
+        return embeddings
+
+    def embed_one(self, face) -> np.ndarray:
+        """Embed a single 3x160x160 crop and return a 512-d vector"""
+        return self.embed(face)[0]
+
+
+class OnnxInference:
+    """ONNX Runtime counterpart of the model registry.
+
+    Sessions are created once and shared; ONNX Runtime sessions accept
+    concurrent `run` calls, so one instance serves every request thread.
+    """
+
+    def __init__(
+        self,
+        model_dir: str = ONNX_MODEL_DIR,
+        detection_mode: str = DETECTION_MODE,
+        threads: Optional[int] = None
+    ):
+        self.model_dir = model_dir
+        self.detection_mode = detection_mode
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, object] = {}
+        self._models: Dict[str, object] = {}
+        self._stats: Dict[str, dict] = {}
+
+    def session(self, name: str):
+        session = self._sessions.get(name)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is None:
+                path = os.path.join(self.model_dir, ONNX_MODEL_FILES[name])
+                start = time.perf_counter()
+                session = create_session(path, self.threads)
+                self._stats[name] = {
+                    "load_seconds": round(time.perf_counter() - start, 3),
+                    "memory_mb": round(os.path.getsize(path) / (1024 * 1024), 2),
+                    "backend": "onnx",
+                }
+                self._sessions[name] = session
+                print(f"✅ Loaded {name} (ONNX) in {self._stats[name]['load_seconds']}s "
+                      f"({self._stats[name]['memory_mb']} MB)")
+        return session
+
+    def _model(self, name: str, build):
+        model = self._models.get(name)
+        if model is None:
+            built = build()
+            with self._lock:
+                model = self._models.setdefault(name, built)
+        return model
+
+    def _mtcnn(self, keep_all: bool) -> OnnxMTCNN:
+        return OnnxMTCNN(self.session("pnet"), self.session("rnet"), self.session("onet"), keep_all=keep_all)
+
+    def load_all(self) -> None:
+        for name in ONNX_MODEL_FILES:
+            self.session(name)
+        _ = self.embedder
+
+    @property
+    def mtcnn_single(self) -> OnnxMTCNN:
+        return self._model("mtcnn_single", lambda: self._mtcnn(keep_all=False))
+
+    @property
+    def mtcnn_crowd(self) -> OnnxMTCNN:
+        return self._model("mtcnn_crowd", lambda: self._mtcnn(keep_all=True))
+
+    @property
+    def crowd_detector(self):
+        """The crowd-mode MTCNN, wrapped for tiled detection when enabled"""
+        if self.detection_mode != "tiled":
+            return self.mtcnn_crowd
+        return self._model("tiled_detector", lambda: TiledDetector(self.mtcnn_crowd))
+
+    @property
+    def embedder(self) -> OnnxEmbedder:
+        return self._model("embedder", lambda: OnnxEmbedder(self.session("resnet")))
+
+    def _locate(self, pil_img: Image.Image, crowd: bool):
+        detector = self.crowd_detector if crowd else self.mtcnn_single
+        boxes, probs, landmarks = detector.detect(pil_img, landmarks=True)
+        if boxes is None:
+            return None, None, None
+        if not crowd:
+            boxes, probs, landmarks = boxes[:1], probs[:1], landmarks[:1]
+        return boxes.astype(np.float32), np.asarray(probs, dtype=np.float32), np.asarray(landmarks, dtype=np.float32)
+
+    def detect(self, img_bytes: bytes, crowd: bool = True):
+        """Decode an image once and return its face boxes (Nx4, largest first), crops
+        (Nx3x160x160), probabilities and landmarks (Nx5x2); coordinates are in image pixels"""
+        with metrics.stage("decode"):
+            pil_img, scale = decode_image(img_bytes)
+        with metrics.stage("mtcnn"):
+            boxes, probs, landmarks = self._locate(pil_img, crowd)
+        if boxes is None:
+            return None, None, None, None
+        with metrics.stage("crop"):
+            faces = crop_faces(pil_img, boxes)
+        if scale != 1.0:
+            boxes, landmarks = boxes / scale, landmarks / scale
+        return boxes, faces, probs, landmarks
+
+    def detect_faces(self, img_bytes: bytes, crowd: bool = True) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Decode an image and return its face crops (Nx3x160x160) and detection probabilities"""
+        _, faces, probs, _ = self.detect(img_bytes, crowd)
+        return faces, probs
+
+    def detect_boxes(self, img_bytes: bytes, crowd: bool = True) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Decode an image and return its face boxes (Nx4, largest first) and detection probabilities"""
+        with metrics.stage("decode"):
+            pil_img, scale = decode_image(img_bytes)
+        with metrics.stage("mtcnn"):
+            boxes, probs, _ = self._locate(pil_img, crowd)
+        if boxes is not None and scale != 1.0:
+            boxes = boxes / scale
+        return boxes, probs
+
+    def embed(self, faces) -> np.ndarray:
+        return self.embedder.embed(faces)
+
+    def stats(self) -> Dict[str, dict]:
+        """Load time and on-disk size of every graph loaded so far"""
+        return {name: dict(values) for name, values in self._stats.items()}
@@ -0,0 +1,151 @@
+"""
+Content-addressed cache of detection and embedding results.
+
+Entries are keyed by the SHA-256 of the image bytes, the detection mode
+(crowd or single) and MODEL_VERSION, so a retried upload, or the same
+photo scored again with another threshold or enrollment list, skips
+MTCNN and the embedding network entirely. Each entry is one small .npz
+file holding the boxes, detection probabilities, face quality and
+N x 512 float32 embeddings. Files are written atomically, and the least recently used
+entries are evicted once the directory grows past RESULT_CACHE_MAX_MB.
+A file's mtime is its last use, so the LRU order survives restarts.
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from face_inference import MODEL_VERSION, FaceDetections
+
+RESULT_CACHE_DIR = os.getenv(
+    "RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "result_cache")
+)
+# 0 disables the cache
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "256"))
+
+_EMPTY = "empty"  # marker array for images without faces
+
+
+class ResultCache:
+    """On-disk LRU cache of FaceDetections; safe to share between threads"""
+
+    def __init__(
+        self,
+        directory: str = RESULT_CACHE_DIR,
+        max_bytes: int = int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+        model_version: str = MODEL_VERSION
+    ):
+        # Results of other model versions live in sibling directories and age out on their own
+        self.directory = os.path.join(directory, hashlib.sha256(model_version.encode()).hexdigest()[:12])
+        self.max_bytes = max_bytes
+        self.model_version = model_version
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        """Rebuild the LRU order from the files left by earlier runs"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+            elif entry.name.endswith(".tmp"):
+                os.remove(entry.path)  # interrupted write
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self._bytes += size
+        self._evict()
+
+    def _path(self, sha256: str, crowd: bool) -> str:
+        return os.path.join(self.directory, f"{sha256}-{'crowd' if crowd else 'single'}.npz")
+
+    def get(self, sha256: str, crowd: bool = True):
+        """(True, detections or None without faces) on a hit, (False, None) on a miss"""
+        path = self._path(sha256, crowd)
+        try:
+            with np.load(path) as data:
+                if _EMPTY in data:
+                    detections = None
+                else:
+                    detections = FaceDetections(data["boxes"], data["probs"], data["embeddings"], data["quality"])
+        except (OSError, KeyError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return False, None
+
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        return True, detections
+
+    def put(self, sha256: str, detections: Optional[FaceDetections], crowd: bool = True) -> None:
+        buffer = io.BytesIO()
+        if detections is None:
+            np.savez(buffer, **{_EMPTY: np.zeros(0, np.float32)})
+        else:
+            np.savez(
+                buffer,
+                boxes=np.asarray(detections.boxes, dtype=np.float32),
+                probs=np.asarray(detections.probs, dtype=np.float32),
+                embeddings=np.asarray(detections.embeddings, dtype=np.float32),
+                quality=np.asarray(detections.quality, dtype=np.float32)
+            )
+        data = buffer.getvalue()
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(sha256, crowd)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(path, 0)
+            self._entries[path] = len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model_version": self.model_version,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+def create_result_cache() -> Optional[ResultCache]:
+    """The cache configured by RESULT_CACHE_DIR / RESULT_CACHE_MAX_MB, None when disabled"""
+    if RESULT_CACHE_MAX_MB <= 0:
+        return None
+    return ResultCache()
@@ -105,8 +105,12 @@ class DetectedStudent(BaseModel):
     email: str
     prn: Optional[str] = None
     detected: bool
-    confidence: Optional[float] = None
-    face_index: Optional[int] = None
+    confidence: Optional[float] = None  # best score over the session's photos
+    average_confidence: Optional[float] = None
+    matched_photos: Optional[int] = None
+    face_index: Optional[int] = None  # face in the latest photo, if matched there
+    track_id: Optional[int] = None  # track in the live stream, if matched there
+    quality: Optional[float] = None  # quality of that face (face_quality), 0 to 1
 
 class ImageProcessingResponse(BaseModel):
     session_id: int
@@ -114,6 +118,36 @@ class ImageProcessingResponse(BaseModel):
     total_detected: int
     processing_status: str
 
+class RescoreRequest(BaseModel):
+    threshold: float = 0.6
+    policy: Optional[str] = None  # hungarian, greedy; defaults to ASSIGNMENT_POLICY
+
+class AttendanceChange(BaseModel):
+    student_id: int
+    name: str
+    prn: Optional[str] = None
+    previous_status: Optional[str] = None
+    status: str
+    previous_confidence: Optional[float] = None
+    confidence: Optional[float] = None
+
+class RescoreResponse(BaseModel):
+    session_id: int
+    threshold: float
+    policy: str
+    photos: int
+    total_detected: int
+    changes: List[AttendanceChange]
+
+class AttendanceJobResponse(BaseModel):
+    job_id: str
+    session_id: int
+    status: str  # queued, detecting, embedding, matching, done, error
+    error: Optional[str] = None
+    result: Optional[ImageProcessingResponse] = None
+    created_at: datetime
+    updated_at: datetime
+
 # Auth Schemas
 class LoginRequest(BaseModel):
     email: EmailStr
@@ -0,0 +1,67 @@
+"""
+Fusion of several photos into one attendance session.
+
+Teachers often need 2-4 photos to cover a room. Every photo of a session
+is remembered by its SHA-256 and a 64-bit difference hash (dHash), so a
+re-upload of the same photo, or of a re-encoded / slightly resized copy,
+is recognized before any face detection runs. Per-student evidence (best
+score, score sum and match count) accumulates in AttendanceEvidence, and
+the session's records are updated in place from it.
+"""
+import hashlib
+import io
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+from sqlalchemy.orm import Session
+
+from database import SessionImage
+
+# Largest Hamming distance between two dHashes still treated as the same photo
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "4"))
+
+# Striped locks serializing the evidence updates of each session
+_SESSION_LOCKS = [threading.RLock() for _ in range(64)]
+
+
+def session_lock(session_id: int) -> threading.RLock:
+    return _SESSION_LOCKS[session_id % len(_SESSION_LOCKS)]
+
+
+def content_hash(img_bytes: bytes) -> str:
+    return hashlib.sha256(img_bytes).hexdigest()
+
+
+def perceptual_hash(img_bytes: bytes, size: int = 8) -> str:
+    """64-bit difference hash: sign of the horizontal gradient of a 9x8 grayscale thumbnail"""
+    img = Image.open(io.BytesIO(img_bytes))
+    # JPEGs decode at 1/8 scale or less in draft mode, which is all a thumbnail needs
+    img.draft("L", (size * 8, size * 8))
+    pixels = np.asarray(img.convert("L").resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return f"{int(''.join('1' if b else '0' for b in bits), 2):0{size * size // 4}x}"
+
+
+def hamming_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def find_duplicate(
+    db: Session,
+    session_id: int,
+    sha256: str,
+    phash: str,
+    max_distance: int = PHASH_MAX_DISTANCE
+) -> Optional[SessionImage]:
+    """An earlier photo of the session that is identical or nearly identical to this one"""
+    # Compare hashes only; the stored embeddings are loaded for the duplicate alone
+    hashes = db.query(SessionImage.id, SessionImage.sha256, SessionImage.phash).filter(
+        SessionImage.session_id == session_id
+    ).all()
+    match = next((row for row in hashes if row.sha256 == sha256), None)
+    if match is None:
+        match = next((row for row in hashes if hamming_distance(row.phash, phash) <= max_distance), None)
+    return db.get(SessionImage, match.id) if match is not None else None
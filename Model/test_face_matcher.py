@@ -0,0 +1,90 @@
+"""Cache checks: EnrolledMatcher never keeps an index loaded across an invalidation.
+
+The Qdrant scroll of a subject's students runs outside the lock; a face
+registration invalidating the subject meanwhile must make that load
+uncached, or the new face would never be matched. Qdrant is replaced by a
+client whose scroll waits until the test lets it finish. Templates written
+by another process (bulk_import, another replica) are seen through the
+collection's version token, checked against an in-memory Qdrant.
+
+Run: python test_face_matcher.py   (or: pytest test_face_matcher.py)
+"""
+import threading
+
+import numpy as np
+from qdrant_client import QdrantClient
+
+from face_matcher import EnrolledMatcher
+from face_templates import build_template, save_template
+from vision_stack import create_collection
+
+SUBJECT_ID = 1
+STUDENTS = (10, 11, 12)
+
+
+class BlockingClient:
+    """Stands in for Qdrant: every scroll blocks until `release` is set"""
+
+    def __init__(self):
+        self.scrolls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def scroll(self, **kwargs):
+        self.scrolls += 1
+        self.started.set()
+        assert self.release.wait(10)
+        return [], None
+
+
+def load_while(invalidate) -> BlockingClient:
+    """Load the subject's index with `invalidate(matcher)` run mid-scroll, then load it again"""
+    client = BlockingClient()
+    matcher = EnrolledMatcher(client, "faces")
+    loader = threading.Thread(target=matcher.index_for, args=(SUBJECT_ID, STUDENTS))
+    loader.start()
+    assert client.started.wait(10)
+    invalidate(matcher)
+    client.release.set()
+    loader.join()
+    matcher.index_for(SUBJECT_ID, STUDENTS)
+    return client
+
+
+def test_index_is_cached():
+    assert load_while(lambda matcher: None).scrolls == 1
+
+
+def test_subject_invalidated_while_loading_is_reloaded():
+    assert load_while(lambda matcher: matcher.invalidate_subject(SUBJECT_ID)).scrolls == 2
+
+
+def test_student_invalidated_while_loading_is_reloaded():
+    assert load_while(lambda matcher: matcher.invalidate_student(STUDENTS[1])).scrolls == 2
+
+
+def test_other_student_keeps_the_load():
+    assert load_while(lambda matcher: matcher.invalidate_student(99)).scrolls == 1
+
+
+def test_templates_written_elsewhere_are_seen():
+    client = QdrantClient(":memory:")
+    create_collection(client, "faces", 8)
+    rng = np.random.default_rng(0)
+
+    def register(student_id: int) -> None:
+        save_template(client, "faces", student_id, build_template(rng.standard_normal((1, 8))), {"user_id": student_id})
+
+    register(STUDENTS[0])
+    matcher = EnrolledMatcher(client, "faces", track_version=True)
+    assert matcher.index_for(SUBJECT_ID, STUDENTS).student_ids == [STUDENTS[0]]
+    # Written by another process: this matcher's invalidate_* is never called
+    register(STUDENTS[1])
+    assert matcher.index_for(SUBJECT_ID, STUDENTS).student_ids == list(STUDENTS[:2])
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
@@ -0,0 +1,67 @@
+"""Quality-filter checks: back-row faces found by the tiled detector are kept.
+
+A classroom photo is mostly wall; the face is a 12 pixel patch, the size
+the tile pass recovers, cropped the way the detector crops it. Sharp and
+frontal, it must pass the default MIN_FACE_QUALITY; blurred, in profile or
+under FACE_MIN_SIDE it must not, or the filter saves no ResNet passes.
+
+Run: python test_face_quality.py   (or: pytest test_face_quality.py)
+"""
+import numpy as np
+from PIL import Image, ImageFilter
+
+from face_inference import crop_faces, detect_and_embed
+from face_quality import FACE_MIN_SIDE, MIN_FACE_QUALITY
+
+FACE_SIDE = 12
+FRONTAL = np.array([[0.3, 0.35], [0.7, 0.35], [0.5, 0.55], [0.35, 0.75], [0.65, 0.75]], np.float32)
+# Nose next to the right eye: turned about 90 degrees
+PROFILE = np.array([[0.3, 0.35], [0.7, 0.35], [0.7, 0.55], [0.35, 0.75], [0.65, 0.75]], np.float32)
+
+
+class BackRowFace:
+    """Stands in for the face models: one small face with a confident detection"""
+
+    def __init__(self, side: int = FACE_SIDE, blur: float = 0.0, landmarks: np.ndarray = FRONTAL):
+        rng = np.random.default_rng(0)
+        photo = np.full((1200, 1600, 3), 128, np.uint8)
+        photo[300:300 + side, 800:800 + side] = rng.integers(0, 256, (side, side, 3))
+        self.photo = Image.fromarray(photo).filter(ImageFilter.GaussianBlur(blur)) if blur else Image.fromarray(photo)
+        self.boxes = np.array([[800, 300, 800 + side, 300 + side]], np.float32)
+        self.landmarks = self.boxes[:, None, :2] + landmarks[None] * side
+
+    def detect(self, img_bytes: bytes, crowd: bool = True):
+        faces = crop_faces(self.photo, self.boxes)
+        return self.boxes, faces, np.array([0.99], np.float32), self.landmarks
+
+    def embed(self, faces) -> np.ndarray:
+        return np.ones((len(faces), 512), np.float32)
+
+
+def test_default_filters():
+    assert MIN_FACE_QUALITY > 0 and FACE_SIDE >= FACE_MIN_SIDE
+
+
+def test_small_sharp_face_survives_default():
+    detections = detect_and_embed(BackRowFace(), b"photo")
+    assert detections is not None and len(detections.embeddings) == 1
+    assert detections.quality[0] >= MIN_FACE_QUALITY
+
+
+def test_blurred_face_is_dropped():
+    assert detect_and_embed(BackRowFace(blur=2.0), b"photo") is None
+
+
+def test_profile_face_is_dropped():
+    assert detect_and_embed(BackRowFace(landmarks=PROFILE), b"photo") is None
+
+
+def test_face_under_min_side_is_dropped():
+    assert detect_and_embed(BackRowFace(side=int(FACE_MIN_SIDE) - 2), b"photo") is None
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
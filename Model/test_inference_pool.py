@@ -0,0 +1,55 @@
+"""Recovery checks: InferencePool survives a worker process dying.
+
+A killed worker leaves a ProcessPoolExecutor broken for good; the pool must
+start a new one and retry the call once, so the next photo is embedded as
+usual. A call that kills its worker every time must still fail rather than
+restart forever. The face models are built without pretrained weights.
+
+Run: python test_inference_pool.py   (or: pytest test_inference_pool.py)
+"""
+import os
+import signal
+from concurrent.futures.process import BrokenProcessPool
+
+os.environ.setdefault("FACENET_PRETRAINED", "")
+
+import numpy as np
+
+from face_inference import EMBEDDING_SIZE
+from inference_pool import InferencePool
+
+FACES = np.random.default_rng(0).standard_normal((3, 3, 160, 160)).astype(np.float32)
+
+
+def test_killed_worker_is_replaced():
+    pool = InferencePool(workers=1)
+    try:
+        pool.warm_up()
+        for pid in list(pool._executor._processes):
+            os.kill(pid, signal.SIGKILL)
+        assert pool.embed(FACES).shape == (len(FACES), EMBEDDING_SIZE)
+        assert pool.restarts == 1
+        assert pool.embed(FACES).shape == (len(FACES), EMBEDDING_SIZE)
+        assert pool.restarts == 1
+    finally:
+        pool.shutdown()
+
+
+def test_call_is_retried_once():
+    pool = InferencePool(workers=1)
+    try:
+        try:
+            pool._submit(os._exit, 1)
+            raise AssertionError("a call killing every worker succeeded")
+        except BrokenProcessPool:
+            pass
+        assert pool.restarts == 1
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
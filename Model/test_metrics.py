@@ -0,0 +1,84 @@
+"""Exposition checks: GET /metrics must parse as the Prometheus text format.
+
+Observations are recorded through the metrics module, then the app's
+endpoint is scraped and read back with prometheus_client's parser: stage
+histograms, the quality counter and the mirrored result-cache counter must
+come out with the values and labels that went in. The vision stack is not
+loaded; the app is served without its startup.
+
+Run: python test_metrics.py   (or: pytest test_metrics.py)
+"""
+import os
+import tempfile
+
+# Never touch the configured database
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test_metrics.db')}"
+os.environ.setdefault("QDRANT_URL", ":memory:")
+
+from fastapi.testclient import TestClient
+from prometheus_client.parser import text_string_to_metric_families
+
+import metrics
+from main import app
+
+ENDPOINT = '/test/"quoted"\\path'
+
+
+def scrape() -> dict:
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    return {family.name: family for family in text_string_to_metric_families(response.text)}
+
+
+def samples(family, suffix: str) -> dict:
+    return {
+        tuple(sorted(sample.labels.items())): sample.value
+        for sample in family.samples if sample.name == family.name + suffix
+    }
+
+
+def test_stage_histogram_parses():
+    for seconds in (0.003, 0.02, 0.02, 7.0):
+        metrics.STAGE_SECONDS.observe(seconds, ENDPOINT, "embed")
+    family = scrape()["attendance_stage_duration_seconds"]
+    assert family.type == "histogram"
+
+    labels = (("endpoint", ENDPOINT), ("stage", "embed"))
+    assert samples(family, "_count")[labels] == 4
+    assert abs(samples(family, "_sum")[labels] - 7.043) < 1e-9
+    buckets = {
+        dict(sample.labels)["le"]: sample.value for sample in family.samples
+        if sample.name.endswith("_bucket") and dict(sample.labels)["endpoint"] == ENDPOINT
+    }
+    assert buckets["0.001"] == 0 and buckets["0.005"] == 1 and buckets["0.025"] == 3
+    assert buckets["+Inf"] == 4
+
+
+def test_counters_parse():
+    metrics.FACES_REJECTED.inc(ENDPOINT, amount=3)
+    metrics.RESULT_CACHE_LOOKUPS.set_total(12, "hit")
+    metrics.RESULT_CACHE_LOOKUPS.set_total(5, "miss")
+    families = scrape()
+
+    rejected = families["faces_rejected"]
+    assert rejected.type == "counter"
+    assert samples(rejected, "_total")[(("endpoint", ENDPOINT),)] == 3
+    lookups = families["result_cache_lookups"]
+    assert lookups.type == "counter"
+    assert samples(lookups, "_total") == {(("result", "hit"),): 12, (("result", "miss"),): 5}
+
+
+def test_totals_match_exposition():
+    metrics.DB_SECONDS.observe(0.5, ENDPOINT, "SELECT")
+    family = scrape()["db_statement_duration_seconds"]
+    labels = (("endpoint", ENDPOINT), ("operation", "SELECT"))
+    count, total = metrics.DB_SECONDS.totals()[(ENDPOINT, "SELECT")]
+    assert (count, total) == (samples(family, "_count")[labels], samples(family, "_sum")[labels])
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
@@ -0,0 +1,371 @@
+"""Query-count checks: the attendance paths must not run a query per student.
+
+Each path runs for a small and a large class against a throw-away SQLite
+database and must issue the same number of SQL statements for both. The
+face models and Qdrant are not needed: every photo shows the first few
+students of the class, with their matches given directly. The last checks
+cover what gets written: one record per student, overrides left alone, also
+without ON CONFLICT and, after migrate_db, for databases that predate the
+unique index, live-stream evidence kept when the photos are re-scored, and
+completed sessions kept completed when a later photo fails.
+
+Run: python test_queries.py   (or: pytest test_queries.py)
+"""
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+# Never touch the configured database
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test_queries.db')}"
+
+import numpy as np
+from PIL import Image
+from sqlalchemy import inspect
+
+from attendance_jobs import AttendanceJobQueue
+from attendance_pipeline import AttendancePipeline, enrolled_students, record_attendance
+from database import (
+    SessionLocal, engine, init_db, count_queries, _update_or_insert, MigrationRequired,
+    User, Subject, Enrollment, AttendanceSession, AttendanceRecord
+)
+from face_matcher import SimilarityMatrix
+from migrate_db import migrate
+
+CLASS_SIZES = (5, 60)
+FACES_PER_PHOTO = 4
+
+init_db()
+
+
+class PhotoFaces:
+    """Stands in for the face models: FACES_PER_PHOTO sharp, frontal faces per photo"""
+
+    def detect(self, img_bytes: bytes, crowd: bool = True):
+        rng = np.random.default_rng(len(img_bytes))
+        boxes = np.array([[i * 100, 0, i * 100 + 80, 80] for i in range(FACES_PER_PHOTO)], np.float32)
+        landmarks = np.array([[30, 32], [50, 32], [40, 48], [32, 64], [48, 64]], np.float32)
+        landmarks = boxes[:, None, :2] + landmarks[None]
+        faces = rng.standard_normal((FACES_PER_PHOTO, 3, 160, 160)).astype(np.float32)
+        return boxes, faces, np.ones(FACES_PER_PHOTO, np.float32), landmarks
+
+    def embed(self, faces) -> np.ndarray:
+        return np.eye(len(faces), 512, dtype=np.float32)
+
+
+class BrokenFaces(PhotoFaces):
+    """The face models failing, e.g. a crashed inference worker"""
+
+    def detect(self, img_bytes: bytes, crowd: bool = True):
+        raise RuntimeError("inference worker died")
+
+
+class NoFaces(PhotoFaces):
+    def detect(self, img_bytes: bytes, crowd: bool = True):
+        return None, None, None, None
+
+
+class FirstStudentsMatcher:
+    """Face i is student i of the class"""
+
+    def similarity(self, embeddings, enrolled_ids, subject_id=None) -> SimilarityMatrix:
+        student_ids = sorted(enrolled_ids)
+        scores = np.full((len(embeddings), len(student_ids)), 0.1, np.float32)
+        for i in range(min(len(embeddings), len(student_ids))):
+            scores[i, i] = 0.9
+        return SimilarityMatrix(scores, student_ids, [{} for _ in student_ids])
+
+
+def make_class(db, size: int) -> AttendanceSession:
+    """A subject with `size` enrolled students and a new attendance session"""
+    tag = f"{size}-{db.query(Subject).count()}"
+    teacher = User(name="Teacher", email=f"teacher-{tag}@test", role="teacher", password_hash="x")
+    db.add(teacher)
+    db.flush()
+    subject = Subject(name="Subject", code=f"S-{tag}", teacher_id=teacher.id)
+    students = [
+        User(name=f"Student {i}", email=f"s{i}-{tag}@test", role="student", prn=f"{tag}-{i}", password_hash="x")
+        for i in range(size)
+    ]
+    db.add(subject)
+    db.add_all(students)
+    db.flush()
+    db.add_all([Enrollment(student_id=s.id, subject_id=subject.id) for s in students])
+    session = AttendanceSession(
+        subject_id=subject.id, teacher_id=teacher.id, session_date=datetime(2026, 1, 5, 9),
+        class_type="lecture", status="queued"
+    )
+    db.add(session)
+    db.commit()
+    return session
+
+
+def photo(seed: int) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def upload(db, session: AttendanceSession, seed: int, threshold: float = 0.5):
+    """Process a photo the way an attendance job does, committing the status as processing starts"""
+    def on_stage(stage: str) -> None:
+        if stage == "detecting":
+            session.status = stage
+            db.commit()
+
+    pipeline = AttendancePipeline(PhotoFaces(), FirstStudentsMatcher())
+    return pipeline.process(db, session, photo(seed), threshold=threshold, on_stage=on_stage)
+
+
+def _assert_flat(counts: dict) -> None:
+    small, large = (counts[size].statements for size in CLASS_SIZES)
+    assert len(small) == len(large), (
+        f"{len(small)} statements for {CLASS_SIZES[0]} students but {len(large)} for {CLASS_SIZES[1]}:\n"
+        + "\n".join(large)
+    )
+
+
+def test_upload_queries_do_not_grow_with_class_size():
+    counts = {}
+    for size in CLASS_SIZES:
+        db = SessionLocal()
+        try:
+            session = make_class(db, size)
+            with count_queries() as queries:
+                result = upload(db, session, seed=size)
+            assert result.total_detected == FACES_PER_PHOTO
+            assert len(result.detected_students) == size
+            counts[size] = queries
+        finally:
+            db.close()
+    _assert_flat(counts)
+
+
+def test_second_photo_queries_do_not_grow_with_class_size():
+    counts = {}
+    for size in CLASS_SIZES:
+        db = SessionLocal()
+        try:
+            session = make_class(db, size)
+            upload(db, session, seed=size)
+            with count_queries() as queries:
+                upload(db, session, seed=size + 1000)
+            counts[size] = queries
+        finally:
+            db.close()
+    _assert_flat(counts)
+
+
+def test_rescore_queries_do_not_grow_with_class_size():
+    counts = {}
+    for size in CLASS_SIZES:
+        db = SessionLocal()
+        try:
+            session = make_class(db, size)
+            upload(db, session, seed=size + 2000)
+            pipeline = AttendancePipeline(PhotoFaces(), FirstStudentsMatcher())
+            with count_queries() as queries:
+                result = pipeline.rescore(db, session, threshold=0.95)
+            assert len(result.changes) == FACES_PER_PHOTO  # everyone matched before is now absent
+            counts[size] = queries
+        finally:
+            db.close()
+    _assert_flat(counts)
+
+
+def test_subject_students_is_one_query():
+    from main import get_subject_students
+
+    for size in CLASS_SIZES:
+        db = SessionLocal()
+        try:
+            subject_id = make_class(db, size).subject_id
+            db.expire_all()
+            with count_queries() as queries:
+                students = asyncio.run(get_subject_students(subject_id, db=db, current_user=None))
+            assert len(students) == size
+            assert queries.count == 1, "\n".join(queries.statements)
+        finally:
+            db.close()
+
+
+def test_records_are_upserted():
+    db = SessionLocal()
+    try:
+        session = make_class(db, CLASS_SIZES[0])
+        session_id = session.id
+        upload(db, session, seed=3000)
+        first, *_, last = sorted(enrolled_students(db, session.subject_id))
+        db.query(AttendanceRecord).filter(
+            AttendanceRecord.session_id == session_id,
+            AttendanceRecord.student_id.in_([first, last])
+        ).update({"status": "late", "manual_override": True})
+        db.commit()
+
+        # Written again, e.g. by a retried job: still one record each, overrides kept
+        students = enrolled_students(db, session.subject_id)
+        for _ in range(2):
+            record_attendance(db, session, students, {last: (0.9, 0)})
+        records = dict(db.query(AttendanceRecord.student_id, AttendanceRecord.status).filter(
+            AttendanceRecord.session_id == session_id
+        ).all())
+        assert len(records) == CLASS_SIZES[0]
+        assert records[first] == records[last] == "late"
+        assert db.get(AttendanceSession, session_id).present_students == FACES_PER_PHOTO - 1
+    finally:
+        db.close()
+
+
+def test_duplicate_upload_applies_its_threshold():
+    # Re-uploading a photo with a stricter threshold re-scores the session rather than ignoring it
+    db = SessionLocal()
+    try:
+        session = make_class(db, CLASS_SIZES[0])
+        session_id = session.id
+        upload(db, session, seed=4000)
+        assert db.get(AttendanceSession, session_id).present_students == FACES_PER_PHOTO
+
+        result = upload(db, db.get(AttendanceSession, session_id), seed=4000, threshold=0.95)
+        assert result.processing_status == "duplicate"
+        assert result.total_detected == 0
+        statuses = {status for (status,) in db.query(AttendanceRecord.status).filter(
+            AttendanceRecord.session_id == session_id
+        )}
+        assert statuses == {"absent"}
+        assert db.get(AttendanceSession, session_id).present_students == 0
+    finally:
+        db.close()
+
+
+def run_job(session_id: int, inference, seed: int) -> None:
+    """Process a photo on the attendance job queue, as an upload does"""
+    queue = AttendanceJobQueue(AttendancePipeline(inference, FirstStudentsMatcher()), workers=1)
+    job = queue.submit(session_id, photo(seed), threshold=0.5)
+    deadline = time.monotonic() + 30
+    while not job.finished:
+        assert time.monotonic() < deadline, "attendance job did not finish"
+        time.sleep(0.01)
+
+
+def test_failed_photo_keeps_session_completed():
+    db = SessionLocal()
+    try:
+        for failing, fresh_status in ((BrokenFaces(), "error"), (NoFaces(), "queued")):
+            completed_id = make_class(db, CLASS_SIZES[0]).id
+            run_job(completed_id, PhotoFaces(), seed=5000)
+            run_job(completed_id, failing, seed=5001)
+            db.expire_all()
+            assert db.get(AttendanceSession, completed_id).status == "completed"
+            assert db.get(AttendanceSession, completed_id).present_students == FACES_PER_PHOTO
+
+            # Without earlier photos there is nothing to keep
+            fresh_id = make_class(db, CLASS_SIZES[0]).id
+            run_job(fresh_id, failing, seed=5002)
+            db.expire_all()
+            assert db.get(AttendanceSession, fresh_id).status == fresh_status
+    finally:
+        db.close()
+
+
+def test_upsert_without_on_conflict():
+    # The path of dialects without ON CONFLICT: just as idempotent, overrides just as safe
+    db = SessionLocal()
+    try:
+        session = make_class(db, CLASS_SIZES[0])
+        session_id = session.id
+        students = sorted(enrolled_students(db, session.subject_id))
+
+        def write(status: str, rows: list) -> None:
+            _update_or_insert(
+                db, AttendanceRecord.__table__,
+                [{"session_id": session_id, "student_id": s, "status": status, "manual_override": False} for s in rows],
+                keys=("session_id", "student_id"),
+                update=("status",),
+                where=AttendanceRecord.manual_override.isnot(True)
+            )
+
+        write("absent", students[:2])
+        db.query(AttendanceRecord).filter(AttendanceRecord.student_id == students[0]).update({"manual_override": True})
+        for _ in range(2):
+            write("present", students)
+        db.commit()
+        records = dict(db.query(AttendanceRecord.student_id, AttendanceRecord.status).filter(
+            AttendanceRecord.session_id == session_id
+        ).all())
+        assert len(records) == len(students)
+        assert records.pop(students[0]) == "absent"
+        assert set(records.values()) == {"present"}
+    finally:
+        db.close()
+
+
+def test_migration_removes_duplicate_records():
+    # Records written before the unique index existed: the API refuses them, the
+    # migration keeps the override, else the newest, and saves the others
+    db = SessionLocal()
+    try:
+        session = make_class(db, CLASS_SIZES[0])
+        first, second = sorted(enrolled_students(db, session.subject_id))[:2]
+        index = next(index for index in AttendanceRecord.__table__.indexes if index.unique)
+        index.drop(bind=engine)
+        db.add_all([
+            AttendanceRecord(session_id=session.id, student_id=first, status="late", manual_override=True),
+            AttendanceRecord(session_id=session.id, student_id=first, status="present"),
+            AttendanceRecord(session_id=session.id, student_id=second, status="absent"),
+            AttendanceRecord(session_id=session.id, student_id=second, status="present"),
+        ])
+        db.commit()
+
+        try:
+            init_db()
+            raise AssertionError("init_db started over duplicate records")
+        except MigrationRequired:
+            pass
+
+        backup = os.path.join(tempfile.mkdtemp(), "removed.jsonl")
+        assert migrate(backup)["removed_rows"] == 2
+        db.expire_all()
+        records = db.query(AttendanceRecord.student_id, AttendanceRecord.status).filter(
+            AttendanceRecord.session_id == session.id
+        ).all()
+        assert sorted(records) == sorted([(first, "late"), (second, "present")])
+        with open(backup) as saved:
+            assert sorted((row["student_id"], row["status"]) for row in map(json.loads, saved)) == sorted(
+                [(first, "present"), (second, "absent")]
+            )
+        assert index.name in {i["name"] for i in inspect(engine).get_indexes(AttendanceRecord.__tablename__)}
+        init_db()
+    finally:
+        db.close()
+
+
+def test_rescore_keeps_stream_evidence():
+    db = SessionLocal()
+    try:
+        session = make_class(db, CLASS_SIZES[0])
+        session_id = session.id
+        upload(db, session, seed=4000)
+        students = enrolled_students(db, session.subject_id)
+        streamed = sorted(students)[-1]  # not in any photo
+        record_attendance(db, session, students, {streamed: (0.8, None)}, tracks={streamed: 7})
+
+        result = AttendancePipeline(PhotoFaces(), FirstStudentsMatcher()).rescore(db, session, threshold=0.95)
+        records = dict(db.query(AttendanceRecord.student_id, AttendanceRecord.status).filter(
+            AttendanceRecord.session_id == session_id
+        ).all())
+        assert records[streamed] == "present"
+        assert streamed not in {change.student_id for change in result.changes}
+        assert db.get(AttendanceSession, session_id).present_students == 1
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
@@ -0,0 +1,190 @@
+"""
+Tiled, multi-scale crowd detection for high-resolution photos.
+
+Running MTCNN's image pyramid over a 12-48 MP frame is slow and needs a lot
+of memory, yet the default min_face_size still misses back-row faces. A
+large photo is instead searched in two passes:
+
+* a coarse pass over a downsampled copy finds the large, near faces;
+* overlapping full-resolution tiles, run in parallel, find the small ones.
+
+Detections from both passes are merged with cross-tile NMS and returned
+largest first, like MTCNN's own output. Photos that already fit the coarse
+size go through a single ordinary MTCNN pass.
+"""
+import copy
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+DETECT_TILE_SIZE = int(os.getenv("DETECT_TILE_SIZE", "1024"))
+DETECT_TILE_OVERLAP = int(os.getenv("DETECT_TILE_OVERLAP", "160"))
+DETECT_COARSE_MAX_SIDE = int(os.getenv("DETECT_COARSE_MAX_SIDE", "1600"))
+DETECT_TILE_WORKERS = int(os.getenv("DETECT_TILE_WORKERS", "4"))
+DETECT_NMS_IOU = float(os.getenv("DETECT_NMS_IOU", "0.4"))
+# Smallest face (full-resolution pixels) the tile pass looks for; 0 keeps MTCNN's min_face_size
+DETECT_TILE_MIN_FACE = int(os.getenv("DETECT_TILE_MIN_FACE", "0"))
+
+Detections = Tuple[np.ndarray, np.ndarray, np.ndarray]  # boxes Nx4, probs N, landmarks Nx5x2
+
+
+def _empty() -> Detections:
+    return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros((0, 5, 2), np.float32)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, threshold: float, method: str = "union") -> np.ndarray:
+    """Indices of the boxes kept by greedy non-maximum suppression, highest score first.
+
+    "union" drops boxes whose IoU with a kept box exceeds the threshold (as
+    torchvision.ops.nms does); "min" divides the overlap by the smaller box
+    area instead, as MTCNN's last stage does.
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    # MTCNN's "min" variant also counts box edges as pixels
+    extra = 1.0 if method == "min" else 0.0
+    areas = (x2 - x1 + extra) * (y2 - y1 + extra)
+
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]) + extra)
+        h = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]) + extra)
+        inter = w * h
+        if method == "min":
+            overlap = inter / np.minimum(areas[i], areas[rest])
+        else:
+            overlap = inter / (areas[i] + areas[rest] - inter)
+        order = rest[overlap <= threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def tile_grid(width: int, height: int, tile: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """(left, top, right, bottom) windows covering the image with the given overlap"""
+    def starts(length: int) -> List[int]:
+        if length <= tile:
+            return [0]
+        count = math.ceil((length - overlap) / (tile - overlap))
+        step = (length - tile) / (count - 1)
+        return [round(i * step) for i in range(count)]
+
+    return [
+        (left, top, min(left + tile, width), min(top + tile, height))
+        for top in starts(height)
+        for left in starts(width)
+    ]
+
+
+class TiledDetector:
+    """Drop-in replacement for a keep_all MTCNN that tiles large photos.
+
+    Call it like MTCNN: `faces, probs = detector(pil_img, return_prob=True)`.
+    Works with facenet-pytorch's MTCNN and with the ONNX Runtime port alike.
+    """
+
+    def __init__(
+        self,
+        mtcnn,
+        tile_size: int = DETECT_TILE_SIZE,
+        overlap: int = DETECT_TILE_OVERLAP,
+        coarse_max_side: int = DETECT_COARSE_MAX_SIDE,
+        workers: int = DETECT_TILE_WORKERS,
+        nms_iou: float = DETECT_NMS_IOU,
+        tile_min_face: int = DETECT_TILE_MIN_FACE
+    ):
+        if overlap >= tile_size:
+            raise ValueError("Tile overlap must be smaller than the tile size")
+        self.mtcnn = mtcnn
+        # Shallow copy: shares the P/R/O-Net weights, only the pyramid start differs
+        self.tile_mtcnn = mtcnn
+        if tile_min_face and tile_min_face != mtcnn.min_face_size:
+            self.tile_mtcnn = copy.copy(mtcnn)
+            self.tile_mtcnn.min_face_size = tile_min_face
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.coarse_max_side = coarse_max_side
+        self.nms_iou = nms_iou
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="detect-tile")
+
+    def _detect(self, img: Image.Image, mtcnn=None) -> Detections:
+        boxes, probs, points = (mtcnn or self.mtcnn).detect(img, landmarks=True)
+        if boxes is None:
+            return _empty()
+        return boxes.astype(np.float32), probs.astype(np.float32), points.astype(np.float32)
+
+    def _detect_tile(self, img: Image.Image, window, max_face: float) -> Detections:
+        left, top, right, bottom = window
+        boxes, probs, points = self._detect(img.crop(window), self.tile_mtcnn)
+        if not len(boxes):
+            return boxes, probs, points
+
+        sizes = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+        # Faces cut by an inner tile edge are seen whole by the neighbouring tile
+        margin = 2
+        cut = np.zeros(len(boxes), dtype=bool)
+        if left > 0:
+            cut |= boxes[:, 0] <= margin
+        if top > 0:
+            cut |= boxes[:, 1] <= margin
+        if right < img.width:
+            cut |= boxes[:, 2] >= (right - left) - margin
+        if bottom < img.height:
+            cut |= boxes[:, 3] >= (bottom - top) - margin
+        keep = (sizes <= max_face) & ~cut
+
+        offset = np.array([left, top], dtype=np.float32)
+        return (
+            boxes[keep] + np.tile(offset, 2),
+            probs[keep],
+            points[keep] + offset
+        )
+
+    def detect(self, img: Image.Image, landmarks: bool = False):
+        """Boxes (largest first), probabilities (and landmarks) in full-resolution coordinates, like MTCNN.detect"""
+        width, height = img.size
+        scale = self.coarse_max_side / max(width, height)
+        if scale >= 1:
+            boxes, probs, points = self._detect(img)
+        else:
+            # Coarse pass: MTCNN's min_face_size maps to min_face_size / scale full-res pixels
+            coarse = img.resize((round(width * scale), round(height * scale)), Image.BILINEAR)
+            c_boxes, c_probs, c_points = self._detect(coarse)
+            parts = [(c_boxes / scale, c_probs, c_points / scale)]
+
+            # Fine pass: tiles only need to catch faces the coarse pass is too small to see,
+            # and the overlap must be wide enough for such a face to sit whole in one tile
+            max_face = self.mtcnn.min_face_size / scale * 1.5
+            overlap = min(max(self.overlap, math.ceil(max_face)), self.tile_size // 2)
+            windows = tile_grid(width, height, self.tile_size, overlap)
+            parts += self._executor.map(lambda w: self._detect_tile(img, w, max_face), windows)
+
+            boxes = np.concatenate([p[0] for p in parts])
+            probs = np.concatenate([p[1] for p in parts])
+            points = np.concatenate([p[2] for p in parts])
+            if len(boxes):
+                keep = nms(boxes, probs, self.nms_iou)
+                # NMS keeps faces in score order; MTCNN (select_largest) hands them out largest first
+                areas = (boxes[keep, 2] - boxes[keep, 0]) * (boxes[keep, 3] - boxes[keep, 1])
+                keep = keep[np.argsort(-areas, kind="stable")]
+                boxes, probs, points = boxes[keep], probs[keep], points[keep]
+
+        if not len(boxes):
+            boxes = probs = points = None
+        if landmarks:
+            return boxes, probs, points
+        return boxes, probs
+
+    def __call__(self, img: Image.Image, return_prob: bool = False):
+        boxes, probs = self.detect(img)
+        faces = None
+        if boxes is not None:
+            faces = self.mtcnn.extract(img, boxes, None)
+        if return_prob:
+            return faces, probs
+        return faces
@@ -0,0 +1,187 @@
+"""
+The API's face-recognition stack, built on first use.
+
+Qdrant, the face models (in-process, on the inference workers or behind
+the remote inference service), the embedding micro-batcher, the matcher
+and the attendance job queue are only created by `load()`: on the first
+request that needs them, or by the background warm-up the API starts once
+it accepts traffic. Until then the
+process never imports torch, onnxruntime, scipy or qdrant-client, so
+replicas serving only the admin and reporting endpoints start in well
+under a second.
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+from face_inference import EMBEDDING_SIZE
+from inference_client import INFERENCE_URL
+
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+COLLECTION_NAME = "Student_Faces"
+# Face matching: "enrolled" scores faces in-process against only the
+# subject's enrolled students, "qdrant" runs a filtered vector search
+MATCH_MODE = os.getenv("MATCH_MODE", "enrolled")
+# Load the stack in the background as soon as the API starts; 0 waits for the first request
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") != "0"
+
+
+def create_collection(client, collection_name: str, size: int) -> None:
+    from qdrant_client import models
+
+    from face_templates import create_version_collection
+
+    try:
+        collections = client.get_collections()
+        existing = [c.name for c in collections.collections]
+
+        if collection_name not in existing:
+            client.create_collection(
+                collection_name=collection_name,
+                vectors_config=models.VectorParams(size=size, distance=models.Distance.COSINE)
+            )
+            print(f"✅ Collection '{collection_name}' created.")
+        else:
+            print(f"ℹ️  Collection '{collection_name}' already exists.")
+
+        # Index user_id so per-subject filtering doesn't scan the whole collection
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name="user_id",
+            field_schema=models.PayloadSchemaType.INTEGER
+        )
+        create_version_collection(client, collection_name)
+    except Exception as e:
+        print(f"❌ Error creating collection: {e}")
+
+
+class VisionStack:
+    """Everything the face endpoints need, loaded once behind a lock.
+
+    `state` is "cold" until loading starts, then "loading" and finally
+    "ready" or "error"; a failed load is retried by the next caller.
+    """
+
+    def __init__(
+        self,
+        qdrant_url: str = QDRANT_URL,
+        collection_name: str = COLLECTION_NAME,
+        match_mode: str = MATCH_MODE,
+        inference_url: str = INFERENCE_URL
+    ):
+        self.qdrant_url = qdrant_url
+        self.collection_name = collection_name
+        self.match_mode = match_mode
+        self.inference_url = inference_url
+        self.state = "cold"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+        self.client = None
+        self.inference = None
+        self.inference_client = None
+        self.inference_pool = None
+        self.local_inference = None
+        self.embedding_batcher = None
+        self.enrolled_matcher = None
+        self.matcher = None
+        self.result_cache = None
+        self.attendance_jobs = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def load(self) -> "VisionStack":
+        """Build the stack if needed; blocks while another thread is building it"""
+        if self.ready:
+            return self
+        with self._lock:
+            if not self.ready:
+                self.state = "loading"
+                start = time.perf_counter()
+                try:
+                    self._build()
+                except Exception as e:
+                    self.state = "error"
+                    self.error = str(e)
+                    print(f"❌ Failed to load the vision stack: {e}")
+                    raise
+                self.load_seconds = round(time.perf_counter() - start, 3)
+                self.error = None
+                self.state = "ready"
+                print(f"✅ Vision stack ready in {self.load_seconds}s")
+        return self
+
+    def _build(self) -> None:
+        from qdrant_client import QdrantClient
+
+        import metrics
+        from attendance_jobs import AttendanceJobQueue
+        from attendance_pipeline import AttendancePipeline
+        from embedding_batcher import MicroBatchEmbedder
+        from face_inference import build_inference
+        from face_matcher import QdrantMatcher, EnrolledMatcher
+        from inference_client import create_inference_client
+        from inference_pool import InferencePool
+        from result_cache import create_result_cache
+
+        client = metrics.instrument_client(QdrantClient(self.qdrant_url))
+        create_collection(client, self.collection_name, EMBEDDING_SIZE)
+        enrolled_matcher = EnrolledMatcher(client, self.collection_name, track_version=True)
+        matcher = enrolled_matcher if self.match_mode == "enrolled" else QdrantMatcher(client, self.collection_name)
+
+        # Face models (torch or ONNX Runtime): on a separate inference service when
+        # INFERENCE_URL is set, otherwise in this process or its worker processes
+        if self.inference_url:
+            inference = self.inference_client = create_inference_client(self.inference_url)
+        else:
+            inference = build_inference()
+            backend = inference
+            if isinstance(inference, MicroBatchEmbedder):
+                self.embedding_batcher, backend = inference, inference.backend
+            if isinstance(backend, InferencePool):
+                self.inference_pool = backend
+            else:
+                self.local_inference = backend
+
+        # Attendance photos are processed off the event loop by a bounded worker pool;
+        # detections and embeddings of photos seen before come from the result cache
+        self.result_cache = create_result_cache()
+        self.attendance_jobs = AttendanceJobQueue(AttendancePipeline(inference, matcher, self.result_cache))
+        self.client, self.inference = client, inference
+        self.enrolled_matcher, self.matcher = enrolled_matcher, matcher
+
+    def warm_up_in_background(self) -> threading.Thread:
+        """Load the stack on a daemon thread so the API serves requests meanwhile"""
+        def warm_up() -> None:
+            try:
+                self.load()
+            except Exception:
+                pass  # recorded in state/error; the next request retries
+
+        thread = threading.Thread(target=warm_up, name="vision-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def invalidate_subject(self, subject_id: int) -> None:
+        if self.enrolled_matcher is not None:
+            self.enrolled_matcher.invalidate_subject(subject_id)
+
+    def invalidate_student(self, student_id: int) -> None:
+        if self.enrolled_matcher is not None:
+            self.enrolled_matcher.invalidate_student(student_id)
+
+    def status(self) -> dict:
+        status = {"state": self.state, "load_seconds": self.load_seconds}
+        if self.error:
+            status["error"] = self.error
+        return status
+
+    def shutdown(self) -> None:
+        if self.inference_pool is not None:
+            self.inference_pool.shutdown()
+        if self.inference_client is not None:
+            self.inference_client.close()
@@ -88,6 +88,16 @@ export interface ImageProcessingResponse {
   processing_status: string;
 }
 
+export interface AttendanceJob {
+  job_id: string;
+  session_id: number;
+  status: 'queued' | 'detecting' | 'embedding' | 'matching' | 'done' | 'error';
+  error?: string;
+  result?: ImageProcessingResponse;
+  created_at: string;
+  updated_at: string;
+}
+
 // API Service Class
 class ApiService {
   private token: string | null = null;
@@ -332,7 +342,11 @@ class ApiService {
     return this.handleResponse<AttendanceSession>(response);
   }
 
-  async uploadAttendanceImage(sessionId: number, imageFile: File): Promise<ImageProcessingResponse> {
+  async uploadAttendanceImage(
+    sessionId: number,
+    imageFile: File,
+    onProgress?: (status: AttendanceJob['status']) => void,
+  ): Promise<ImageProcessingResponse> {
     const formData = new FormData();
     formData.append('image', imageFile);
 
@@ -344,7 +358,26 @@ class ApiService {
       body: formData,
     });
 
-    return this.handleResponse<ImageProcessingResponse>(response);
+    // The photo is processed in the background; poll the job until it finishes
+    let job = await this.handleResponse<AttendanceJob>(response);
+    while (job.status !== 'done' && job.status !== 'error') {
+      onProgress?.(job.status);
+      await new Promise(resolve => setTimeout(resolve, 1000));
+      job = await this.getAttendanceJob(job.job_id);
+    }
+
+    if (job.status === 'error' || !job.result) {
+      throw new Error(job.error || 'Attendance processing failed');
+    }
+    return job.result;
+  }
+
+  async getAttendanceJob(jobId: string): Promise<AttendanceJob> {
+    const response = await fetch(`${API_BASE_URL}/attendance/jobs/${jobId}`, {
+      headers: this.getHeaders(),
+    });
+
+    return this.handleResponse<AttendanceJob>(response);
   }
 
   async markAttendance(sessionId: number, attendanceData: {